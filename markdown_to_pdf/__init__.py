@@ -5,6 +5,13 @@ Converts markdown files to PDF, EPUB, or MOBI format with Mermaid and PlantUML s
 MIT License - Copyright (c) 2025 Markdown to PDF Converter
 """
 
+import sys
+
+# Fail before importing anything heavy: the modules below use built-in generic annotations
+# (tuple[...], list[...]) that raise TypeError at import time on Python 3.8
+if sys.version_info < (3, 9):
+    raise SystemExit("markdown-to-pdf requires Python 3.9 or newer")
+
 __version__ = "1.0.0"
 
 from .converter import MarkdownToPDFConverter
@@ -96,6 +96,10 @@ def get_config_from_env() -> Dict[str, Any]:
         "MD2PDF_MAX_DIAGRAM_WIDTH": "max_diagram_width",
         "MD2PDF_MAX_DIAGRAM_HEIGHT": "max_diagram_height",
         "MD2PDF_PLANTUML_SERVER": "plantuml_server",
+        "MD2PDF_MERMAID_RENDERER": "mermaid_renderer",
+        "MD2PDF_PANDOC_SERVER": "pandoc_server",
+        "MD2PDF_CALIBRE_LIB_DIR": "calibre_lib_dir",
+        "MD2PDF_EPUB_BACKEND": "epub_backend",
     }
     
     for env_var, config_key in env_mapping.items():
@@ -149,6 +153,10 @@ class Config:
             "max_diagram_width": 1680,
             "max_diagram_height": 2240,
             "plantuml_server": "https://www.plantuml.com/plantuml/png/",  # Use local: http://localhost:8080/plantuml/png/
+            "mermaid_renderer": "auto",  # auto (mmdr if installed, else playwright), mmdr, or playwright
+            "pandoc_server": None,  # e.g. http://localhost:3030/ for a running `pandoc server`
+            "calibre_lib_dir": None,  # e.g. /usr/lib/calibre to run MOBI conversion in-process
+            "epub_backend": "pandoc",  # pandoc, or ebooklib to assemble EPUB files in-process
         }
     
     def get(self, key: str, default: Any = None) -> Any:
@@ -183,6 +191,24 @@ class Config:
         """Get PlantUML server URL."""
         return self._config.get("plantuml_server", "https://www.plantuml.com/plantuml/png/")
     
+    def get_mermaid_renderer(self) -> str:
+        """Get Mermaid renderer ("auto", "mmdr" or "playwright")."""
+        renderer = str(self._config.get("mermaid_renderer", "auto")).strip().lower()
+        return renderer if renderer in ("auto", "mmdr", "playwright") else "auto"
+    
+    def get_pandoc_server(self) -> Optional[str]:
+        """Get pandoc server URL (None means run pandoc as a subprocess)."""
+        return self._config.get("pandoc_server") or None
+    
+    def get_calibre_lib_dir(self) -> Optional[str]:
+        """Get Calibre library directory for in-process MOBI conversion (None means use ebook-convert)."""
+        return self._config.get("calibre_lib_dir") or None
+    
+    def get_epub_backend(self) -> str:
+        """Get EPUB backend ("pandoc" or "ebooklib")."""
+        backend = str(self._config.get("epub_backend", "pandoc")).strip().lower()
+        return backend if backend in ("pandoc", "ebooklib") else "pandoc"
+    
     def update(self, updates: Dict[str, Any]) -> None:
         """Update configuration with new values."""
         self._config.update(updates)
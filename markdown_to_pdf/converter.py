@@ -8,11 +8,19 @@ MIT License - Copyright (c) 2025 Markdown to PDF Converter
 
 import os
 import sys
+import argparse
 import subprocess
 import tempfile
 import shutil
 import json
+import base64
+import hashlib
+import urllib.request
+import functools
+import re
 import time
+import html
+import string
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import asyncio
@@ -20,30 +28,393 @@ from playwright.async_api import async_playwright
 import plantuml
 from colorama import init, Fore, Back, Style
 from PIL import Image, ImageFilter
-from .verification import DocumentStateManager, calculate_file_hash
-from .config import Config
+from .verification import DocumentStateManager, calculate_file_hash, clear_file_hash_cache
+from .config import Config, parse_dimension_value
 from .dependencies import check_dependencies
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import threading
 import multiprocessing
+import multiprocessing.util
 from tqdm import tqdm
 
+# Page stylesheet for HTML -> PDF rendering. Profile-dependent font sizes are filled in once per
+# converter (see _build_css_template); margins are filled in per margin set (see _page_css).
+_PAGE_CSS_TEMPLATE = string.Template("""@page {
+    margin: ${top_cm}cm ${right_cm}cm ${bottom_cm}cm ${left_cm}cm;
+    size: A4 portrait;
+    width: 210mm;
+    height: 297mm;
+}
+
+body {
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
+    line-height: 1.4;
+    color: #333;
+    max-width: none;
+    margin: 0;
+    padding: 0;
+    font-size: ${base_font_size};
+    width: 100%;
+    box-sizing: border-box;
+}
+
+/* Ensure content fits within A4 page boundaries */
+* {
+    box-sizing: border-box;
+}
+
+h1, h2, h3, h4, h5, h6 {
+    color: #2c3e50;
+    margin-top: 0.8em;
+    margin-bottom: 0.3em;
+    font-weight: 600;
+}
+
+h1 {
+    font-size: ${h1_size}em;
+    border-bottom: 2px solid #3498db;
+    padding-bottom: 0.2em;
+}
+
+h2 {
+    font-size: ${h2_size}em;
+    border-bottom: 1px solid #bdc3c7;
+    padding-bottom: 0.1em;
+}
+
+h3 {
+    font-size: ${h3_size}em;
+}
+
+h4 {
+    font-size: ${h4_size}em;
+    text-decoration: underline;
+}
+
+h5 {
+    font-size: ${h5_size}em;
+    text-decoration: underline;
+}
+
+h6 {
+    font-size: ${small_size}em;
+    text-decoration: underline;
+}
+
+p {
+    margin: 0.5em 0;
+    text-align: justify;
+}
+
+code {
+    background-color: #f8f9fa;
+    border: 1px solid #e9ecef;
+    border-radius: 3px;
+    padding: 0.1em 0.3em;
+    font-family: 'Courier New', Consolas, monospace;
+    font-size: ${small_size}em;
+    color: #e83e8c;
+}
+
+pre {
+    background-color: #f8f9fa;
+    border: 1px solid #e9ecef;
+    border-radius: 5px;
+    padding: 0.5em;
+    overflow-x: auto;
+    margin: 0.5em 0;
+    font-size: ${small_size}em;
+}
+
+pre code {
+    background: none;
+    border: none;
+    padding: 0;
+    color: #333;
+}
+
+blockquote {
+    border-left: 4px solid #3498db;
+    margin: 0.5em 0;
+    padding: 0.3em 0.8em;
+    background-color: #f8f9fa;
+    color: #555;
+}
+
+table {
+    border-collapse: collapse;
+    width: 100%;
+    margin: 0.5em 0;
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+}
+
+th, td {
+    border: 1px solid #ddd;
+    padding: 0.3em;
+    text-align: left;
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+}
+
+th {
+    background-color: #f8f9fa;
+    font-weight: 600;
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+}
+
+ul, ol {
+    margin: 0.5em 0;
+    padding-left: 1.5em;
+    display: block;
+}
+
+li {
+    margin: 0.2em 0;
+    display: list-item;
+    list-style-type: disc;
+}
+
+ul li {
+    list-style-type: disc;
+}
+
+ol li {
+    list-style-type: decimal;
+}
+
+/* Ensure nested lists work properly */
+ul ul, ol ol, ul ol, ol ul {
+    margin: 0.2em 0;
+    padding-left: 1.2em;
+}
+
+ul ul li {
+    list-style-type: circle;
+}
+
+ul ul ul li {
+    list-style-type: square;
+}
+
+img {
+    max-width: 100%;
+    max-height: ${img_max_height_cm}cm;
+    width: auto;
+    height: auto;
+    display: block;
+    margin: 0.5em auto;
+    object-fit: contain;
+}
+
+/* Specific styling for Mermaid diagram images */
+img[alt*=""] {
+    margin: 0.3em auto;
+    padding: 0;
+    border: none;
+    background: transparent;
+}
+
+a {
+    color: #3498db;
+    text-decoration: none;
+}
+
+a:hover {
+    text-decoration: underline;
+}
+
+.page-break {
+    page-break-before: always;
+}
+
+/* Better page break handling for A4 */
+h1, h2, h3 {
+    page-break-after: avoid;
+    break-after: avoid;
+}
+
+h1, h2, h3, h4, h5, h6 {
+    page-break-inside: avoid;
+    break-inside: avoid;
+}
+
+p, li {
+    orphans: 3;
+    widows: 3;
+}
+
+/* Prevent large elements from breaking across pages */
+pre, blockquote, table, img {
+    page-break-inside: avoid;
+    break-inside: avoid;
+}
+
+/* Ensure tables fit within page width */
+table {
+    max-width: 100%;
+    table-layout: auto;
+}
+
+/* Force table font inheritance and override any defaults */
+table, table *, table th, table td, table tr {
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+    line-height: inherit !important;
+}
+
+/* Additional specificity for markdown-generated tables */
+body table, body table th, body table td {
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+}
+""")
+
+# Per-document HTML shell; ${stylesheet} is either a <link> to the shared stylesheet file
+# (PDF rendering) or an inline <style> block (saved HTML output)
+_HTML_TEMPLATE = string.Template("""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>${title}</title>
+    ${stylesheet}
+</head>
+<body>
+    ${content}
+</body>
+</html>
+""")
+
+
+# Markdown ![alt](src) or HTML <img src="..."> reference; match.lastgroup tells which form matched
+_IMAGE_REF_PATTERN = re.compile(
+    r'(?P<md>!\[(?P<alt>[^\]]*)\]\((?P<md_src>[^)]+)\))'
+    r'|(?P<html><img[^>]+src=["\'](?P<html_src>[^"\']+)["\'][^>]*>)'
+)
+
+
+# Title extraction (see _extract_title): ATX "# Title" and setext "Title\n=====" level-1 headings
+_TITLE_SCAN_CHARS = 8192
+_ATX_H1_PATTERN = re.compile(r'^[ \t]*# (?P<title>[^\n]*\S)', re.MULTILINE)
+# Setext underlines may have spaces between the '=' signs ('= = =', '= ==')
+_SETEXT_H1_PATTERN = re.compile(r'^(?P<title>[^\n]*\S)[ \t]*\r?\n[ \t]*=[= \t]*\r?$', re.MULTILINE)
+
+
+# Mermaid/PlantUML code blocks, optionally preceded by a <!-- no-resize --> or <!-- scale:N% -->
+# modifier line. Handles both Unix (\n) and Windows (\r\n) line endings.
+# Groups: 1 = "no-resize", 2 = scale percentage digits, 3 = diagram code
+_DIAGRAM_PATTERNS = {
+    kind: re.compile(
+        r'(?:<!--\s*(?:(no-resize)|scale:(\d+)%)\s*-->\s*\r?\n)?```' + kind + r'\r?\n(.*?)\r?\n```',
+        re.DOTALL | re.IGNORECASE
+    )
+    for kind in ("mermaid", "plantuml")
+}
+
+# Upper bound on PlantUML server requests in flight at once for one document, and for the
+# up-front pass over every file in a batch (see _pre_render_plantuml_diagrams)
+_PLANTUML_CONCURRENCY = 4
+_PLANTUML_PRERENDER_CONCURRENCY = 16
+
+# Diagram cache key part for Mermaid diagrams rendered in the browser (see _diagram_cache_path)
+_PLAYWRIGHT_RENDERER_ID = ("playwright",)
+
+
+# Page break markers, all rewritten in a single pass:
+#   <!-- page-break -->              HTML comment
+#   <div class="page-break"></div>   HTML div (already the target form for PDF)
+#   ```page-break\n```               custom code block
+#   <page-break>                     custom tag
+#   ---\n{.page-break}               horizontal rule with Pandoc attribute
+_PAGE_BREAK_DIV = '<div class="page-break"></div>'
+_PAGE_BREAK_PATTERN = re.compile(
+    r'<!--\s*page-break\s*-->'
+    r'|<div class="page-break"></div>'
+    r'|```page-break\n```'
+    r'|<page-break>'
+    r'|---\s*\n\s*\{\.page-break\}',
+    re.IGNORECASE
+)
+
+# Page breaks and image references rewritten together in one scan (see _process_and_embed_images);
+# the page-break alternative keeps its case-insensitivity, the image alternatives stay case-sensitive
+_PAGE_BREAK_OR_IMAGE_PATTERN = re.compile(
+    f'(?P<page_break>(?i:{_PAGE_BREAK_PATTERN.pattern}))|{_IMAGE_REF_PATTERN.pattern}'
+)
+
+
+# Margin conversion is pure and sees the same few margin strings for every document: memoize it
+_MARGIN_PATTERN = re.compile(r'^(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*(cm|in|mm|pt|px)?$')
+
+
+@functools.lru_cache(maxsize=64)
+def _margin_to_cm(margin_str: str) -> float:
+    """Convert a margin string (e.g. "1in", "2.5cm") to centimeters; unparseable values give 1 inch."""
+    match = _MARGIN_PATTERN.match(margin_str.strip())
+    if not match:
+        return 2.54  # default 1 inch in cm
+    
+    value_str, unit = match.groups()
+    value = float(value_str)
+    
+    # Convert to cm (no unit means inches)
+    if unit == 'cm':
+        return value
+    elif unit == 'mm':
+        return value / 10
+    elif unit == 'pt':
+        return value * 0.0352778
+    elif unit == 'px':
+        return value * 0.0264583
+    else:
+        return value * 2.54
+
+
+@functools.lru_cache(maxsize=64)
+def _margins_to_cm(margins_key: tuple) -> tuple:
+    """Convert a (top, right, bottom, left) margin-string tuple to centimeters."""
+    return tuple(_margin_to_cm(margin) for margin in margins_key)
+
+
 # --- Module-level worker infrastructure for ProcessPoolExecutor ---
 # ProcessPoolExecutor requires picklable callables. We use a module-level
 # converter instance per worker process so each gets its own browser, event
 # loop, and DB connection — fully isolated from other workers.
 _worker_converter = None
+# Seconds a worker waits for its browser to close while exiting
+_WORKER_SHUTDOWN_TIMEOUT = 10
 
 
 def _init_worker_process(converter_kwargs: dict) -> None:
     """Initializer called once per worker process. Creates a process-local converter."""
     global _worker_converter
     _worker_converter = MarkdownToPDFConverter(**converter_kwargs)
+    _worker_converter.state_manager.load_all()
+    # The browser stays up across files; close it when the pool shuts the worker down
+    # (multiprocessing exits workers without running atexit handlers, but runs these finalizers)
+    multiprocessing.util.Finalize(None, _shutdown_worker_process, exitpriority=10)
+
+
+def _shutdown_worker_process() -> None:
+    """Finalizer run as a worker process exits. Closes the process-local browser.
+    
+    The wait is bounded: a hung Chromium must not keep the worker (and with it pool shutdown)
+    alive. On timeout the event loop is stopped and the process exits without a clean close.
+    """
+    if _worker_converter is not None:
+        try:
+            _worker_converter._run_async(_worker_converter._close_browser(), timeout=_WORKER_SHUTDOWN_TIMEOUT)
+        except FutureTimeoutError:
+            _worker_converter._log_warning(f"Browser did not close within {_WORKER_SHUTDOWN_TIMEOUT}s; abandoning it")
+            _worker_converter._loop.call_soon_threadsafe(_worker_converter._loop.stop)
 
 
-def _worker_convert_file(md_file: Path) -> tuple:
+def _worker_convert_file(md_file: Path, md_hash: Optional[str] = None) -> tuple:
     """Top-level function executed in worker process. Converts a single file."""
-    return _worker_converter._convert_single_file(md_file)
+    return _worker_converter._convert_single_file(md_file, md_hash)
 
 
 # Initialize colorama for cross-platform colored output
@@ -69,7 +440,7 @@ class MarkdownToPDFConverter:
         }
     }
     
-    def __init__(self, source_dir: str, output_dir: str, temp_dir: str, page_margins: str = "1in 0.75in", debug: bool = False, db_path: Optional[str] = None, style_profile: str = "a4-print", max_workers: int = 4, max_diagram_width = 1680, max_diagram_height = 2240, force_regenerate: bool = False, save_html: bool = False, save_html_bundle: bool = False):
+    def __init__(self, source_dir: str, output_dir: str, temp_dir: str, page_margins: str = "1in 0.75in", debug: bool = False, db_path: Optional[str] = None, style_profile: str = "a4-print", max_workers: int = 4, max_diagram_width = 1680, max_diagram_height = 2240, force_regenerate: bool = False, save_html: bool = False, save_html_bundle: bool = False, show_inner_progress: bool = True):
         """Initialize the converter.
         
         Args:
@@ -78,6 +449,7 @@ class MarkdownToPDFConverter:
             force_regenerate: If True, bypass verification and regenerate all files
             save_html: If True, save the intermediate HTML alongside the PDF
             save_html_bundle: If True, save HTML with external image assets in output/html/{stem}/
+            show_inner_progress: If False, hide the per-file step and per-diagram progress bars
         """
         self.source_dir = Path(source_dir)
         self.output_dir = Path(output_dir)
@@ -91,11 +463,18 @@ class MarkdownToPDFConverter:
         self.force_regenerate = force_regenerate
         self.save_html = save_html
         self.save_html_bundle = save_html_bundle
+        self.show_inner_progress = show_inner_progress
         self._lock = threading.Lock()  # For logging in sequential mode
         
-        # Browser and event loop state (process-isolated; each worker process gets its own converter)
+        # Browser state (process-isolated; each worker process gets its own converter)
         self._local = type('BrowserState', (), {})()
         
+        # All Playwright coroutines run on one persistent event loop owned by a daemon thread;
+        # callers submit work with _run_async() and block only on the result
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._run_event_loop, name="playwright-loop", daemon=True)
+        self._loop_thread.start()
+        
         # Performance optimization: reuse PlantUML client for connection pooling
         # Get PlantUML server URL from config (supports local or external server)
         from .config import Config
@@ -104,6 +483,29 @@ class MarkdownToPDFConverter:
         self._plantuml_client = plantuml.PlantUML(url=self._plantuml_server)
         self._log_debug(f"Using PlantUML server: {self._plantuml_server}")
         
+        # Optional resident `pandoc server`; when unset or unreachable, pandoc runs as a subprocess
+        self._pandoc_server = config.get_pandoc_server()
+        if self._pandoc_server:
+            self._log_debug(f"Using pandoc server: {self._pandoc_server}")
+        
+        # Mermaid renderer: the native mmdr binary skips Chromium entirely when available;
+        # Playwright stays the fallback for "auto" and for any diagram mmdr fails on
+        self._mermaid_renderer = config.get_mermaid_renderer()
+        self._mmdr_path = shutil.which("mmdr") if self._mermaid_renderer in ("auto", "mmdr") else None
+        if self._mermaid_renderer == "mmdr" and self._mmdr_path is None:
+            self._log_warning("mermaid_renderer is 'mmdr' but the mmdr binary was not found on PATH; falling back to Playwright")
+        self._log_debug(f"Mermaid renderer: {'mmdr (' + self._mmdr_path + ')' if self._mmdr_path else 'playwright'}")
+        
+        # Identifies what renders each diagram kind, for the diagram cache key; the mmdr binary's
+        # mtime stands in for its version (an upgrade replaces the file) without running it
+        mermaid_renderer_id = _PLAYWRIGHT_RENDERER_ID
+        if self._mmdr_path:
+            try:
+                mermaid_renderer_id = ("mmdr", self._mmdr_path, os.stat(self._mmdr_path).st_mtime_ns)
+            except OSError:
+                mermaid_renderer_id = ("mmdr", self._mmdr_path)
+        self._diagram_renderer_ids = {"mermaid": mermaid_renderer_id, "plantuml": (self._plantuml_server,)}
+        
         # Create format-specific output directories
         self.pdf_dir = self.output_dir / "pdf"
         self.html_dir = self.output_dir / "html" if self.save_html else None
@@ -129,6 +531,10 @@ class MarkdownToPDFConverter:
         # Log style profile information
         profile_info = self.STYLE_PROFILES[self.style_profile]
         self._log_info(f"Using style profile: {profile_info['name']} - {profile_info['description']}")
+        
+        # Profile-dependent CSS is identical for every document, so format it only once
+        self._css_template = self._build_css_template()
+        self._page_css_cache: Dict[tuple, str] = {}
         self._log_debug(f"Default diagram dimensions: {self.diagram_width}x{self.diagram_height}px")
     
     def _log_debug(self, message: str) -> None:
@@ -157,6 +563,18 @@ class MarkdownToPDFConverter:
         with self._lock:
             print(f"{Fore.GREEN}[OK]{Style.RESET_ALL} {message}")
     
+    def _run_event_loop(self) -> None:
+        """Run the converter's event loop forever (target of the loop thread)."""
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+    
+    def _run_async(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the event-loop thread and wait for its result.
+        
+        Raises concurrent.futures.TimeoutError if timeout (seconds) elapses first.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+    
     async def _launch_browser(self) -> None:
         """Launch a fresh Chromium browser instance."""
         tls = self._local
@@ -194,23 +612,63 @@ class MarkdownToPDFConverter:
             await self._launch_browser()
             tls.page = await tls.browser.new_page(device_scale_factor=device_scale_factor)
     
+    async def _get_pdf_page(self):
+        """Return the persistent page used for PDF printing, launching the browser if needed.
+        
+        Unlike the diagram page, this page is kept open and reused for every document
+        printed while the browser is alive.
+        """
+        tls = self._local
+        
+        if not hasattr(tls, 'browser') or tls.browser is None or not tls.browser.is_connected():
+            self._log_debug("Initializing browser instance")
+            await self._launch_browser()
+            tls.pdf_page = None
+        
+        page = getattr(tls, 'pdf_page', None)
+        if page is None or page.is_closed():
+            page = await tls.browser.new_page()
+            # Give the page a file:// origin so set_content() documents may link
+            # the stylesheet file in the temp dir
+            anchor = (self.temp_dir / "pdf_page.html").absolute()
+            if not anchor.exists():
+                self.temp_dir.mkdir(parents=True, exist_ok=True)
+                anchor.write_text("<!DOCTYPE html><html></html>", encoding='utf-8')
+            await page.goto(anchor.as_uri())
+            tls.pdf_page = page
+        return page
+    
+    async def _close_diagram_page(self) -> None:
+        """Close the diagram rendering page, keeping the browser and PDF page alive for reuse."""
+        tls = self._local
+        page = getattr(tls, 'page', None)
+        tls.page = None
+        try:
+            if page and not page.is_closed():
+                await page.close()
+        except Exception:
+            pass
+    
     async def _close_browser(self) -> None:
         """Close browser and cleanup resources."""
         tls = self._local
         
         # Grab references and null them out first to prevent double-close on crash
         page = getattr(tls, 'page', None)
+        pdf_page = getattr(tls, 'pdf_page', None)
         browser = getattr(tls, 'browser', None)
         pw = getattr(tls, 'playwright', None)
         tls.page = None
+        tls.pdf_page = None
         tls.browser = None
         tls.playwright = None
         
-        try:
-            if page and not page.is_closed():
-                await page.close()
-        except Exception:
-            pass
+        for open_page in (page, pdf_page):
+            try:
+                if open_page and not open_page.is_closed():
+                    await open_page.close()
+            except Exception:
+                pass
         try:
             if browser and browser.is_connected():
                 await browser.close()
@@ -284,33 +742,9 @@ class MarkdownToPDFConverter:
         else:
             raise ValueError(f"Invalid margin format: '{self.page_margins}'. Use 1, 2, or 4 values.")
     
-    def _convert_margin_to_cm(self, margin_str: str) -> float:
-        """Convert margin string to centimeters for Puppeteer."""
-        import re
-        
-        match = re.match(r'^(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*(cm|in|mm|pt|px)?$', margin_str.strip())
-        if not match:
-            return 2.54  # default 1 inch in cm
-        
-        value_str, unit = match.groups()
-        value = float(value_str)
-        
-        if not unit:
-            unit = 'in'
-        
-        # Convert to cm
-        if unit == 'cm':
-            return value
-        elif unit == 'in':
-            return value * 2.54
-        elif unit == 'mm':
-            return value / 10
-        elif unit == 'pt':
-            return value * 0.0352778
-        elif unit == 'px':
-            return value * 0.0264583
-        else:
-            return value * 2.54
+    def _margins_cm(self, margins: Dict[str, str]) -> tuple[float, float, float, float]:
+        """Return (top, right, bottom, left) margins in centimeters (memoized per margin set)."""
+        return _margins_to_cm((margins['top'], margins['right'], margins['bottom'], margins['left']))
     
     def _get_viewport_dimensions(self) -> tuple[int, int]:
         """Get viewport dimensions for diagram rendering (always integers).
@@ -351,11 +785,7 @@ class MarkdownToPDFConverter:
     def _get_page_content_height_px(self) -> int:
         """Get the A4 content area height in pixels, in the same coordinate
         system as _get_page_width_px().  Accounts for configured margins."""
-        margins = self._parse_margins()
-        top_cm = self._convert_margin_to_cm(margins['top'])
-        bottom_cm = self._convert_margin_to_cm(margins['bottom'])
-        left_cm = self._convert_margin_to_cm(margins['left'])
-        right_cm = self._convert_margin_to_cm(margins['right'])
+        top_cm, right_cm, bottom_cm, left_cm = self._margins_cm(self._parse_margins())
         content_width_cm = 21.0 - left_cm - right_cm
         content_height_cm = 29.7 - top_cm - bottom_cm
         page_width_px = self._get_page_width_px()
@@ -592,8 +1022,40 @@ class MarkdownToPDFConverter:
             self._log_error(f"Failed to resize image {image_path}: {e}")
             return False
     
-    async def _render_mermaid_diagram(self, mermaid_code: str, output_path: Path) -> tuple[bool, str]:
-        """Render Mermaid diagram to image using Playwright."""
+    def _render_mermaid_with_mmdr(self, mermaid_code: str, output_path: Path) -> tuple[bool, str]:
+        """Render Mermaid diagram to PNG with the native mmdr binary (no browser required)."""
+        try:
+            subprocess.run(
+                [self._mmdr_path, "-i", "-", "-o", str(output_path), "-f", "png", "--fastText"],
+                input=mermaid_code.encode("utf-8"),
+                capture_output=True,
+                check=True,
+                timeout=30,
+            )
+            if not output_path.exists():
+                return False, "mmdr exited successfully but produced no image"
+            return True, ""
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode("utf-8", errors="replace").strip() if e.stderr else ""
+            return False, f"mmdr failed with exit code {e.returncode}: {stderr}"
+        except Exception as e:
+            return False, f"mmdr failed: {e}"
+    
+    async def _render_mermaid_diagram(self, mermaid_code: str, output_path: Path) -> tuple[bool, str, tuple]:
+        """Render Mermaid diagram to image using mmdr when available, otherwise Playwright.
+        
+        Returns (success, error_msg, renderer_id), where renderer_id identifies the renderer that
+        produced the image, which differs from the configured one after a fallback.
+        """
+        if self._mmdr_path:
+            # Run the subprocess off the event-loop thread so the loop stays responsive
+            success, error_msg = await asyncio.get_running_loop().run_in_executor(
+                None, self._render_mermaid_with_mmdr, mermaid_code, output_path
+            )
+            if success:
+                return True, "", self._diagram_renderer_ids["mermaid"]
+            self._log_warning(f"{error_msg}; falling back to Playwright")
+        
         try:
             # 2x device scale for high-DPI rasterization of vector SVGs
             await self._ensure_browser(device_scale_factor=2)
@@ -819,41 +1281,69 @@ class MarkdownToPDFConverter:
                     scale='device'
                 )
             
-            return True, ""
+            return True, "", _PLAYWRIGHT_RENDERER_ID
                 
         except Exception as e:
             error_msg = f"Failed to render Mermaid diagram: {e}"
             self._log_error(error_msg)
-            return False, error_msg
+            return False, error_msg, _PLAYWRIGHT_RENDERER_ID
+    
+    async def _render_mermaid_batch(self, jobs: List[tuple], pbar=None) -> List[tuple]:
+        """Render (mermaid_code, output_path, fit_scale) jobs one after another on the shared browser page.
+        
+        Each rendered image is fitted to the page (fit_scale percent of page width, or not at
+        all when fit_scale is None) in the default executor while the next diagram renders.
+        Stops at the first failure. Returns one (success, error_msg, renderer_id) tuple per
+        attempted job.
+        """
+        loop = asyncio.get_running_loop()
+        results = []
+        fits = []
+        for mermaid_code, output_path, fit_scale in jobs:
+            result = await self._render_mermaid_diagram(mermaid_code, output_path)
+            results.append(result)
+            if pbar is not None:
+                pbar.update(1)
+            if not result[0]:
+                break
+            if fit_scale is not None:
+                fits.append(loop.run_in_executor(None, self._fit_diagram_to_page, output_path, fit_scale, 2))
+        if fits:
+            await asyncio.gather(*fits)
+        return results
     
-    def _render_plantuml_diagram(self, plantuml_code: str, output_path: Path, max_retries: int = 3) -> tuple[bool, str]:
+    def _render_plantuml_diagram(self, plantuml_code: str, output_path: Path, max_retries: int = 3,
+                                 client: Optional[plantuml.PlantUML] = None) -> tuple[bool, str]:
         """Render PlantUML diagram to image using the plantuml library.
         
         Retries on transient network errors (SSL, connection, timeout) with exponential backoff.
         Creates a fresh client on each retry to avoid reusing broken connections.
+        Concurrent callers must pass their own client; the shared one is not thread-safe.
         """
         last_error_msg = ""
-        client = self._plantuml_client
+        client = client or self._plantuml_client
         
         for attempt in range(1, max_retries + 1):
             try:
                 # Render the diagram to PNG and get raw image data
                 image_data = client.processes(plantuml_code)
                 
-                # Write the image data to file
-                with open(output_path, 'wb') as f:
-                    f.write(image_data)
-                
-                # Check if the file was created successfully
-                if output_path.exists() and output_path.stat().st_size > 0:
-                    if attempt > 1:
-                        self._log_debug(f"PlantUML diagram rendered successfully on attempt {attempt}")
-                    self._log_debug(f"PlantUML diagram rendered successfully to: {output_path}")
-                    return True, ""
-                else:
+                if not image_data:
                     last_error_msg = "PlantUML diagram file was not created or is empty"
                     self._log_error(last_error_msg)
                     return False, last_error_msg
+                
+                # Write to a sibling .part file and atomically move it into place, so an
+                # interrupted write never leaves a truncated PNG at output_path
+                partial_path = output_path.with_name(output_path.name + ".part")
+                with open(partial_path, 'wb') as f:
+                    f.write(image_data)
+                os.replace(partial_path, output_path)
+                
+                if attempt > 1:
+                    self._log_debug(f"PlantUML diagram rendered successfully on attempt {attempt}")
+                self._log_debug(f"PlantUML diagram rendered successfully to: {output_path}")
+                return True, ""
                     
             except Exception as e:
                 # Handle exception carefully - some PlantUML exceptions don't have proper string representation
@@ -882,42 +1372,104 @@ class MarkdownToPDFConverter:
         # Should not reach here, but just in case
         return False, last_error_msg
     
-    def _replace_mermaid_with_images(self, content: str, file_id: str = "", filename: str = "") -> str:
-        """Replace Mermaid code blocks with image references.
+    async def _render_plantuml_batch(self, jobs: List[tuple], pbar=None,
+                                     concurrency: int = _PLANTUML_CONCURRENCY) -> List[tuple]:
+        """Render (plantuml_code, output_path, fit_scale) jobs concurrently against the PlantUML server.
         
-        Supports HTML comment modifiers on line above diagram:
-        <!-- no-resize -->
-        ```mermaid
-        graph TD
-            A --> B
-        ```
+        Up to ``concurrency`` requests run at once in the default executor, each with its
+        own client. Each rendered image is then fitted to the page (fit_scale percent of page
+        width, or not at all when fit_scale is None). Returns one (success, error_msg) tuple per job.
+        """
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(concurrency)
+        
+        async def render(plantuml_code: str, output_path: Path, fit_scale: Optional[float]) -> tuple:
+            async with limit:
+                client = plantuml.PlantUML(url=self._plantuml_server)
+                result = await loop.run_in_executor(
+                    None, self._render_plantuml_diagram, plantuml_code, output_path, 3, client
+                )
+            if pbar is not None:
+                pbar.update(1)
+            if result[0] and fit_scale is not None:
+                await loop.run_in_executor(None, self._fit_diagram_to_page, output_path, fit_scale)
+            return result
         
-        <!-- scale:150% -->
-        ```mermaid
-        graph TD
-            A --> B
-        ```
+        return await asyncio.gather(*(render(*job) for job in jobs))
+    
+    def _pandoc_via_server(self, text: str, to: str, options: Dict[str, Any], extra_files: Optional[List[Path]] = None) -> Optional[bytes]:
+        """Convert markdown text with the configured `pandoc server` and return the output bytes.
+        
+        The server never reads the filesystem, so local images referenced by the text (and any
+        extra_files, e.g. stylesheets) are sent base64-encoded in the request's "files" map.
+        Returns None on any failure so the caller can fall back to the pandoc subprocess.
         """
-        import re
+        files: Dict[str, str] = {}
+        refs = [match.group('html_src') or match.group('md_src') for match in _IMAGE_REF_PATTERN.finditer(text)]
+        refs.extend(str(path) for path in extra_files or [])
+        for ref in refs:
+            if ref in files or ref.startswith('http') or ref.startswith('data:'):
+                continue
+            try:
+                files[ref] = base64.b64encode(Path(ref).read_bytes()).decode('ascii')
+            except OSError:
+                continue
+        
+        payload = {"text": text, "from": "markdown", "to": to, "files": files, **options}
+        request = urllib.request.Request(
+            self._pandoc_server,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                result = json.loads(response.read().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            self._log_warning(f"pandoc server request failed ({e}); falling back to pandoc subprocess")
+            return None
         
-        # Pattern to match optional HTML comment modifiers on line above, followed by mermaid block
-        # Handles both Unix (\n) and Windows (\r\n) line endings
-        # Captures: no-resize OR scale:X%
-        mermaid_pattern = r'(?:<!--\s*(?:(no-resize)|scale:(\d+)%)\s*-->\s*\r?\n)?```mermaid\r?\n(.*?)\r?\n```'
+        if "error" in result or "output" not in result:
+            self._log_warning(f"pandoc server conversion failed ({result.get('error', 'no output')}); falling back to pandoc subprocess")
+            return None
+        for message in result.get("messages", []):
+            self._log_debug(f"pandoc server: {message}")
         
-        # Find all matches with their modifiers
-        matches = list(re.finditer(mermaid_pattern, content, re.DOTALL | re.IGNORECASE))
+        output = result["output"]
+        return base64.b64decode(output) if result.get("base64") else output.encode('utf-8')
+    
+    def _contains_marker(self, content: str, marker: str) -> bool:
+        """Case-insensitive substring test for a lowercase marker.
         
-        if not matches:
-            return content
+        The exact-case search is tried first so the usual spelling never pays for lowercasing.
+        """
+        return marker in content or marker in content.lower()
+    
+    def _diagram_img_tag(self, image_path: Path, target_scale: float, skip_resize: bool) -> str:
+        """Build the markdown/HTML image reference for a rendered diagram."""
+        if target_scale != 100.0 and not skip_resize:
+            return f'<img src="{image_path}" style="max-width:{target_scale}%" />'
+        return f"![]({image_path})"
+    
+    def _substitute_matches(self, content: str, matches: list, replacements: List[str]) -> str:
+        """Replace each regex match span in content with its replacement, in a single pass."""
+        parts = []
+        last_end = 0
+        for match, replacement in zip(matches, replacements):
+            parts.append(content[last_end:match.start()])
+            parts.append(replacement)
+            last_end = match.end()
+        parts.append(content[last_end:])
+        return "".join(parts)
+    
+    def _diagram_blocks(self, content: str, kind: str) -> List[tuple]:
+        """Find the ``kind`` ("mermaid" or "plantuml") code blocks in content.
         
-        # Process with progress bar
-        desc = f"  {filename} - Mermaid" if filename else "  Mermaid diagrams"
-        for i, match in enumerate(tqdm(matches, desc=desc, unit="diagram", leave=False)):
+        Returns one (match, code, skip_resize, target_scale) tuple per block, in document order.
+        """
+        blocks = []
+        for match in _DIAGRAM_PATTERNS[kind].finditer(content):
             no_resize_modifier = match.group(1)  # "no-resize" or None
             scale_percent = match.group(2)  # percentage digits or None
-            mermaid_code = match.group(3)
-            full_block = match.group(0)
             
             # Determine resize behavior
             skip_resize = no_resize_modifier is not None
@@ -929,40 +1481,115 @@ class MarkdownToPDFConverter:
                 else:
                     self._log_warning(f"Scale percentage must be greater than 0%, got {scale_percent}%. Using default (100%).")
             
-            # Create unique image path using file_id to avoid race conditions
-            image_path = self.temp_dir / f"mermaid_diagram_{file_id}_{i}.png"
+            blocks.append((match, match.group(3), skip_resize, target_scale))
+        return blocks
+    
+    def _diagram_cache_path(self, kind: str, code: str, skip_resize: bool, target_scale: float,
+                            renderer_id: Optional[tuple] = None) -> Path:
+        """Content-addressed image path for a diagram, shared by every file and worker.
+        
+        The key also covers the renderer (the configured one unless renderer_id names another)
+        and the settings that shape the fitted image, so a temp dir kept with --no-cleanup is
+        never reused across renderers or page settings.
+        """
+        if renderer_id is None:
+            renderer_id = self._diagram_renderer_ids.get(kind)
+        key = repr((kind, code.strip(), skip_resize, target_scale, self.style_profile,
+                    self.page_margins, self.diagram_width, self.diagram_height, renderer_id))
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        return self.temp_dir / "diagrams" / f"{kind}_{digest}.png"
+    
+    def _diagram_staging_path(self, image_path: Path) -> Path:
+        """Process-unique path a diagram is rendered and fitted under before moving into the cache."""
+        return image_path.with_name(f"{image_path.stem}.{os.getpid()}.png")
+    
+    def _replace_diagrams_with_images(self, content: str, kind: str, filename: str = "") -> str:
+        """Replace ``kind`` code blocks with references to rendered images.
+        
+        Images live in the content-addressed diagram cache: diagrams already rendered (by an
+        earlier block, another file, or the up-front PlantUML pass) are reused, and only the
+        missing ones are rendered, as one batch on the event-loop thread.
+        """
+        blocks = self._diagram_blocks(content, kind)
+        if not blocks:
+            return content
+        
+        label = "Mermaid" if kind == "mermaid" else "PlantUML"
+        image_paths: List[Path] = []
+        render_jobs: List[tuple] = []  # (index, code, staging_path, image_path, skip_resize)
+        pending = set()
+        
+        for i, (_, code, skip_resize, target_scale) in enumerate(blocks):
+            image_path = self._diagram_cache_path(kind, code, skip_resize, target_scale)
+            image_paths.append(image_path)
+            if image_path in pending or image_path.exists():
+                self._log_debug(f"{label} diagram {i} already rendered, reusing {image_path}")
+                continue
+            pending.add(image_path)
             
-            # Render Mermaid diagram
             modifier_info = ""
             if skip_resize:
                 modifier_info = " (no-resize)"
             elif target_scale != 100.0:
                 modifier_info = f" (scale:{target_scale}%)"
-            self._log_debug(f"Rendering Mermaid diagram {i} to: {image_path}{modifier_info}")
-            
-            # Reuse event loop from file processing
-            success, error_msg = self._local.event_loop.run_until_complete(
-                self._render_mermaid_diagram(mermaid_code, image_path)
-            )
-            if not success:
-                raise RuntimeError(f"Mermaid diagram {i} failed to render: {error_msg}")
+            self._log_debug(f"Rendering {label} diagram {i} to: {image_path}{modifier_info}")
+            render_jobs.append((i, code, self._diagram_staging_path(image_path), image_path, skip_resize, target_scale))
+        
+        if render_jobs:
+            (self.temp_dir / "diagrams").mkdir(parents=True, exist_ok=True)
+            render_batch = self._render_mermaid_batch if kind == "mermaid" else self._render_plantuml_batch
+            desc = f"  {filename} - {label}" if filename else f"  {label} diagrams"
+            with tqdm(total=len(render_jobs), desc=desc, unit="diagram", leave=False,
+                      disable=not self.show_inner_progress) as pbar:
+                # Diagrams are fitted to page width (or a scaled fraction of it) unless marked no-resize
+                results = self._run_async(render_batch(
+                    [(code, staging_path, None if skip_resize else target_scale)
+                     for _, code, staging_path, _, skip_resize, target_scale in render_jobs],
+                    pbar
+                ))
             
-            # Fit diagram to page width (or scaled fraction of it)
-            if skip_resize:
-                self._log_debug(f"Skipping resize for Mermaid diagram {i} due to no-resize modifier")
-            else:
-                self._fit_diagram_to_page(image_path, scale_percent=target_scale, dpi_scale=2)
-            
-            self._log_debug(f"Mermaid diagram rendered successfully, using path: {image_path}")
-            if target_scale != 100.0 and not skip_resize:
-                img_tag = f'<img src="{image_path}" style="max-width:{target_scale}%" />'
-            else:
-                img_tag = f"![]({image_path})"
-            content = content.replace(full_block, img_tag)
+            published: Dict[Path, Path] = {}
+            for (i, code, staging_path, image_path, skip_resize, target_scale), (success, error_msg, *renderer) in zip(render_jobs, results):
+                if not success:
+                    raise RuntimeError(f"{label} diagram {i} failed to render: {error_msg}")
+                if renderer and renderer[0] != self._diagram_renderer_ids.get(kind):
+                    # A fallback renderer drew it; file it under that renderer's key instead
+                    published[image_path] = self._diagram_cache_path(kind, code, skip_resize, target_scale, renderer[0])
+                    image_path = published[image_path]
+                # Published only once fitted, so other workers never pick up a half-processed image
+                os.replace(staging_path, image_path)
+                if skip_resize:
+                    self._log_debug(f"Skipped resize for {label} diagram {i} due to no-resize modifier")
+                self._log_debug(f"{label} diagram rendered successfully, using path: {image_path}")
+        
+            image_paths = [published.get(image_path, image_path) for image_path in image_paths]
+        
+        img_tags = [self._diagram_img_tag(image_path, target_scale, skip_resize)
+                    for image_path, (_, _, skip_resize, target_scale) in zip(image_paths, blocks)]
+        return self._substitute_matches(content, [block[0] for block in blocks], img_tags)
+    
+    def _replace_mermaid_with_images(self, content: str, filename: str = "") -> str:
+        """Replace Mermaid code blocks with image references.
         
-        return content
+        Supports HTML comment modifiers on line above diagram:
+        <!-- no-resize -->
+        ```mermaid
+        graph TD
+            A --> B
+        ```
+        
+        <!-- scale:150% -->
+        ```mermaid
+        graph TD
+            A --> B
+        ```
+        """
+        # Cheap substring check first: most documents have no diagrams at all
+        if not self._contains_marker(content, "```mermaid"):
+            return content
+        return self._replace_diagrams_with_images(content, "mermaid", filename)
     
-    def _replace_plantuml_with_images(self, content: str, file_id: str = "", filename: str = "") -> str:
+    def _replace_plantuml_with_images(self, content: str, filename: str = "") -> str:
         """Replace PlantUML code blocks with image references.
         
         Supports HTML comment modifiers on line above diagram:
@@ -980,113 +1607,64 @@ class MarkdownToPDFConverter:
         @enduml
         ```
         """
-        import re
-        
-        # Pattern to match optional HTML comment modifiers on line above, followed by plantuml block
-        # Handles both Unix (\n) and Windows (\r\n) line endings
-        # Captures: no-resize OR scale:X%
-        plantuml_pattern = r'(?:<!--\s*(?:(no-resize)|scale:(\d+)%)\s*-->\s*\r?\n)?```plantuml\r?\n(.*?)\r?\n```'
-        
-        # Find all matches with their modifiers
-        matches = list(re.finditer(plantuml_pattern, content, re.DOTALL | re.IGNORECASE))
-        
-        if not matches:
+        # Cheap substring check first: most documents have no diagrams at all
+        if not self._contains_marker(content, "```plantuml"):
             return content
+        return self._replace_diagrams_with_images(content, "plantuml", filename)
+    
+    def _pre_render_plantuml_diagrams(self, md_files: List[Path], md_hashes: Dict[Path, Optional[str]]) -> None:
+        """Render the PlantUML diagrams of every file about to be converted into the diagram cache.
         
-        # Process with progress bar
-        desc = f"  {filename} - PlantUML" if filename else "  PlantUML diagrams"
-        for i, match in enumerate(tqdm(matches, desc=desc, unit="diagram", leave=False)):
-            no_resize_modifier = match.group(1)  # "no-resize" or None
-            scale_percent = match.group(2)  # percentage digits or None
-            plantuml_code = match.group(3)
-            full_block = match.group(0)
-            
-            # Determine resize behavior
-            skip_resize = no_resize_modifier is not None
-            target_scale = 100.0  # Default: fill page width
-            if scale_percent:
-                percent_value = float(scale_percent)
-                if percent_value > 0:
-                    target_scale = percent_value
-                else:
-                    self._log_warning(f"Scale percentage must be greater than 0%, got {scale_percent}%. Using default (100%).")
-            
-            # Create unique image path using file_id to avoid race conditions
-            image_path = self.temp_dir / f"plantuml_diagram_{file_id}_{i}.png"
-            
-            # Render PlantUML diagram
-            modifier_info = ""
-            if skip_resize:
-                modifier_info = " (no-resize)"
-            elif target_scale != 100.0:
-                modifier_info = f" (scale:{target_scale}%)"
-            self._log_debug(f"Rendering PlantUML diagram {i} to: {image_path}{modifier_info}")
-            
-            success, error_msg = self._render_plantuml_diagram(plantuml_code, image_path)
-            if not success:
-                raise RuntimeError(f"PlantUML diagram {i} failed to render: {error_msg}")
-            
-            # Fit diagram to page width (or scaled fraction of it)
-            if skip_resize:
-                self._log_debug(f"Skipping resize for PlantUML diagram {i} due to no-resize modifier")
-            else:
-                self._fit_diagram_to_page(image_path, scale_percent=target_scale)
-            
-            self._log_debug(f"PlantUML diagram rendered successfully, using path: {image_path}")
-            if target_scale != 100.0 and not skip_resize:
-                img_tag = f'<img src="{image_path}" style="max-width:{target_scale}%" />'
-            else:
-                img_tag = f"![]({image_path})"
-            content = content.replace(full_block, img_tag)
+        Diagrams are independent server round trips, so the whole batch is requested with more
+        parallelism than one file's conversion uses; the per-file step then only substitutes
+        references. Failures are left to the per-file step, which retries and reports them.
+        """
+        jobs: Dict[Path, tuple] = {}
+        for md_file in md_files:
+            # Files whose markdown is unchanged are most likely skipped; anything missed here
+            # is still rendered by the per-file step
+            state = self.state_manager.get_document_state(md_file.name)
+            if not self.force_regenerate and state and state['markdown_hash'] == md_hashes.get(md_file):
+                continue
+            try:
+                content = md_file.read_text(encoding='utf-8')
+            except (OSError, UnicodeDecodeError):
+                continue
+            if not self._contains_marker(content, "```plantuml"):
+                continue
+            for _, code, skip_resize, target_scale in self._diagram_blocks(content, "plantuml"):
+                image_path = self._diagram_cache_path("plantuml", code, skip_resize, target_scale)
+                if image_path not in jobs and not image_path.exists():
+                    jobs[image_path] = (code, self._diagram_staging_path(image_path), None if skip_resize else target_scale)
         
-        return content
+        if not jobs:
+            return
+        
+        self._log_info(f"Pre-rendering {len(jobs)} PlantUML diagram(s) across all files")
+        (self.temp_dir / "diagrams").mkdir(parents=True, exist_ok=True)
+        with tqdm(total=len(jobs), desc="PlantUML diagrams", unit="diagram", leave=False) as pbar:
+            results = self._run_async(self._render_plantuml_batch(
+                list(jobs.values()), pbar, _PLANTUML_PRERENDER_CONCURRENCY
+            ))
+        for (image_path, (_, staging_path, _)), (success, _) in zip(jobs.items(), results):
+            if success:
+                os.replace(staging_path, image_path)
+    
+    def _page_break_replacement(self) -> str:
+        """Return what every page break marker is rewritten to."""
+        return _PAGE_BREAK_DIV
     
     def _process_page_breaks(self, content: str) -> str:
         """Process page break markers in markdown content."""
-        import re
-        
-        # Option 1: HTML comment page breaks
-        # <!-- page-break -->
-        content = re.sub(
-            r'<!--\s*page-break\s*-->',
-            '<div class="page-break"></div>',
-            content,
-            flags=re.IGNORECASE
-        )
-        
-        # Option 2: HTML div with page-break class
-        # <div class="page-break"></div> (already in correct format)
-        
-        # Option 3: Custom code block page breaks
-        # ```page-break
-        content = re.sub(
-            r'```page-break\n```',
-            '<div class="page-break"></div>',
-            content,
-            flags=re.IGNORECASE
-        )
-        
-        # Option 4: Custom tag page breaks
-        # <page-break>
-        content = re.sub(
-            r'<page-break>',
-            '<div class="page-break"></div>',
-            content,
-            flags=re.IGNORECASE
-        )
+        # Every supported marker contains "page-break"; skip the regex passes when none is present
+        if not self._contains_marker(content, "page-break"):
+            return content
         
-        # Option 5: Horizontal rule with page-break class (Pandoc attribute syntax)
-        # ---
-        # {.page-break}
-        content = re.sub(
-            r'---\s*\n\s*\{\.page-break\}',
-            '<div class="page-break"></div>',
-            content,
-            flags=re.IGNORECASE | re.MULTILINE
-        )
+        # One pass replaces every marker form (see _PAGE_BREAK_PATTERN for the list)
+        content = _PAGE_BREAK_PATTERN.sub(self._page_break_replacement(), content)
         
         # Count page breaks for debugging
-        page_break_count = content.count('<div class="page-break"></div>')
+        page_break_count = content.count(_PAGE_BREAK_DIV)
         if page_break_count > 0:
             self._log_debug(f"Processed {page_break_count} page break(s)")
         
@@ -1102,8 +1680,12 @@ class MarkdownToPDFConverter:
             # This includes the heading itself and all content until the next heading of same or higher level
             toc_pattern = r'^#{2,3}\s+Table\s+of\s+contents\s*$.*?(?=^#{1,3}\s|\Z)'
             
-            # Use MULTILINE and DOTALL flags to match across lines
-            filtered_content = re.sub(toc_pattern, '', content, flags=re.MULTILINE | re.DOTALL | re.IGNORECASE)
+            # Every match contains "contents"; skip the section scan when it is absent
+            if self._contains_marker(content, "contents"):
+                # Use MULTILINE and DOTALL flags to match across lines
+                filtered_content = re.sub(toc_pattern, '', content, flags=re.MULTILINE | re.DOTALL | re.IGNORECASE)
+            else:
+                filtered_content = content
             
             # Clean up any extra whitespace that might be left
             filtered_content = re.sub(r'\n\s*\n\s*\n', '\n\n', filtered_content)
@@ -1116,386 +1698,191 @@ class MarkdownToPDFConverter:
         
         return content
     
-    def _process_and_embed_images(self, content: str, md_file: Path) -> str:
-        """Process and embed referenced images into the temp directory."""
-        import re
-        import shutil
-        
-        # Find all image references (both markdown and HTML img tags)
-        # Pattern for markdown images: ![alt](path)
-        markdown_img_pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
-        # Pattern for HTML img tags: <img src="path" ...>
-        html_img_pattern = r'<img[^>]+src=["\']([^"\']+)["\'][^>]*>'
+    def _process_and_embed_images(self, content: str, md_file: Path, page_breaks: bool = False) -> str:
+        """Process and embed referenced images into the temp directory.
         
-        processed_content = content
+        Markdown and HTML image references are handled in a single pass; each distinct
+        reference is resolved once and each source asset is copied at most once. With
+        page_breaks=True the same pass also rewrites page break markers (replacing a
+        separate _process_page_breaks scan).
+        """
         md_dir = md_file.parent
-        
-        # Process markdown image references
-        for match in re.finditer(markdown_img_pattern, content):
-            alt_text = match.group(1)
-            img_path = match.group(2)
-            
-            # Skip if it's already a temp file or absolute URL
-            if img_path.startswith('http') or img_path.startswith('data:'):
-                continue
-            
-            # Check if this is a diagram generated by our script (Mermaid or PlantUML)
-            if img_path.startswith('temp/') or img_path.startswith('temp\\'):
-                # Convert relative temp path to absolute path for pandoc
-                if not os.path.isabs(img_path):
-                    # Convert to absolute path
-                    abs_img_path = self.temp_dir / img_path.replace('temp/', '').replace('temp\\', '')
-                    if abs_img_path.exists():
-                        # Replace the relative path with absolute path
-                        processed_content = processed_content.replace(
-                            f"]({img_path})",
-                            f"]({abs_img_path})"
-                        )
-                        self._log_debug(f"Converted temp image path to absolute: {img_path} -> {abs_img_path}")
-                    else:
-                        self._log_warning(f"Temp image not found: {abs_img_path}")
-                continue
-                
-            # Resolve relative path from markdown file location
-            if not os.path.isabs(img_path):
-                full_img_path = md_dir / img_path
-            else:
-                full_img_path = Path(img_path)
-            
-            if full_img_path.exists():
-                # Copy image to temp directory
-                temp_img_name = f"embedded_{full_img_path.stem}_{full_img_path.suffix}"
-                temp_img_path = self.temp_dir / temp_img_name
-                
+        resolved: Dict[str, Optional[str]] = {}  # reference as written -> replacement path (None = keep)
+        embedded: Dict[Path, Path] = {}  # source asset -> copy in temp dir
+        md_dir_names = None  # file names in md_dir, listed once on first use
+        
+        def image_exists(full_img_path: Path) -> bool:
+            # Images next to the note are checked against one directory listing instead of a stat each
+            nonlocal md_dir_names
+            if full_img_path.parent != md_dir:
+                return full_img_path.exists()
+            if md_dir_names is None:
                 try:
-                    shutil.copy2(full_img_path, temp_img_path)
-                    self._log_debug(f"Embedded image: {img_path} -> {temp_img_name}")
-                    
-                    # Update the reference in content
-                    old_ref = f"![{alt_text}]({img_path})"
-                    new_ref = f"![{alt_text}]({temp_img_path})"
-                    processed_content = processed_content.replace(old_ref, new_ref)
-                    
-                except Exception as e:
-                    self._log_warning(f"Failed to embed image {img_path}: {e}")
-            else:
-                self._log_warning(f"Image not found: {full_img_path}")
+                    with os.scandir(md_dir) as entries:
+                        md_dir_names = {entry.name for entry in entries}
+                except OSError:
+                    return full_img_path.exists()
+            return full_img_path.name in md_dir_names
+        
+        page_break = self._page_break_replacement()
+        
+        def replace_reference(match) -> str:
+            if match.lastgroup == 'page_break':
+                return page_break
+            is_html = match.lastgroup == 'html'
+            img_path = match.group('html_src') if is_html else match.group('md_src')
+            if img_path not in resolved:
+                label = "HTML image" if is_html else "image"
+                resolved[img_path] = self._resolve_image_reference(img_path, md_dir, embedded, label, image_exists)
+            new_path = resolved[img_path]
+            if new_path is None:
+                return match.group(0)
+            if is_html:
+                return match.group(0).replace(img_path, new_path)
+            return f"![{match.group('alt')}]({new_path})"
+        
+        if page_breaks and self._contains_marker(content, "page-break"):
+            return _PAGE_BREAK_OR_IMAGE_PATTERN.sub(replace_reference, content)
+        return _IMAGE_REF_PATTERN.sub(replace_reference, content)
+    
+    def _link_or_copy(self, src: Path, dst: Path) -> None:
+        """Place src at dst as a hardlink (no bytes copied), falling back to a copy.
         
-        # Process HTML img tags
-        for match in re.finditer(html_img_pattern, content):
-            img_path = match.group(1)
-            
-            # Skip if it's already a temp file or absolute URL
-            if img_path.startswith('http') or img_path.startswith('data:'):
-                continue
-            
-            # Check if this is a diagram generated by our script (Mermaid or PlantUML)
-            if img_path.startswith('temp/') or img_path.startswith('temp\\'):
-                # Convert relative temp path to absolute path for pandoc
-                if not os.path.isabs(img_path):
-                    # Convert to absolute path
-                    abs_img_path = self.temp_dir / img_path.replace('temp/', '').replace('temp\\', '')
-                    if abs_img_path.exists():
-                        # Replace the relative path with absolute path
-                        processed_content = processed_content.replace(
-                            f"]({img_path})",
-                            f"]({abs_img_path})"
-                        )
-                        self._log_debug(f"Converted temp image path to absolute: {img_path} -> {abs_img_path}")
-                    else:
-                        self._log_warning(f"Temp image not found: {abs_img_path}")
-                continue
-                
-            # Resolve relative path from markdown file location
-            if not os.path.isabs(img_path):
-                full_img_path = md_dir / img_path
-            else:
-                full_img_path = Path(img_path)
-            
-            if full_img_path.exists():
-                # Copy image to temp directory
-                temp_img_name = f"embedded_{full_img_path.stem}_{full_img_path.suffix}"
-                temp_img_path = self.temp_dir / temp_img_name
-                
-                try:
-                    shutil.copy2(full_img_path, temp_img_path)
-                    self._log_debug(f"Embedded HTML image: {img_path} -> {temp_img_name}")
-                    
-                    # Update the reference in content
-                    old_ref = match.group(0)
-                    new_ref = old_ref.replace(img_path, str(temp_img_path))
-                    processed_content = processed_content.replace(old_ref, new_ref)
-                    
-                except Exception as e:
-                    self._log_warning(f"Failed to embed HTML image {img_path}: {e}")
-            else:
-                self._log_warning(f"HTML image not found: {full_img_path}")
+        Embedded assets are only read from the temp dir, never modified, so sharing the inode is safe.
+        The link or copy is made under a process-unique name and then moved over dst, so another
+        worker reading dst never finds it missing or half-copied.
+        """
+        try:
+            if os.path.samefile(src, dst):
+                return  # Already linked by an earlier file or run
+        except OSError:
+            pass  # dst does not exist yet
+        staging_path = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+        staging_path.unlink(missing_ok=True)  # Left over from an interrupted run
+        try:
+            os.link(src, staging_path)
+        except OSError:
+            # Cross-device temp dir or filesystem without hardlink support
+            shutil.copy2(src, staging_path)
+        os.replace(staging_path, dst)
+    
+    def _resolve_image_reference(self, img_path: str, md_dir: Path, embedded: Dict[Path, Path], label: str,
+                                 image_exists=None) -> Optional[str]:
+        """Resolve one image reference to the path pandoc should see, copying local assets to temp.
+        
+        image_exists optionally replaces Path.exists() for local assets.
+        Returns None when the reference should be left untouched (URLs, data URIs, missing files).
+        """
+        # Skip if it's already a temp file or absolute URL
+        if img_path.startswith('http') or img_path.startswith('data:'):
+            return None
+        
+        # Check if this is a diagram generated by our script (Mermaid or PlantUML)
+        if img_path.startswith('temp/') or img_path.startswith('temp\\'):
+            # Convert relative temp path to absolute path for pandoc
+            abs_img_path = self.temp_dir / img_path.replace('temp/', '').replace('temp\\', '')
+            if abs_img_path.exists():
+                self._log_debug(f"Converted temp image path to absolute: {img_path} -> {abs_img_path}")
+                return str(abs_img_path)
+            self._log_warning(f"Temp image not found: {abs_img_path}")
+            return None
+        
+        # Resolve relative path from markdown file location
+        if not os.path.isabs(img_path):
+            full_img_path = md_dir / img_path
+        else:
+            full_img_path = Path(img_path)
         
-        return processed_content
+        if not (image_exists(full_img_path) if image_exists else full_img_path.exists()):
+            self._log_warning(f"{label[0].upper()}{label[1:]} not found: {full_img_path}")
+            return None
+        
+        temp_img_path = embedded.get(full_img_path)
+        if temp_img_path is None:
+            # Copy image to temp directory
+            temp_img_name = f"embedded_{full_img_path.stem}_{full_img_path.suffix}"
+            temp_img_path = self.temp_dir / temp_img_name
+            try:
+                self._link_or_copy(full_img_path, temp_img_path)
+            except Exception as e:
+                self._log_warning(f"Failed to embed {label} {img_path}: {e}")
+                return None
+            embedded[full_img_path] = temp_img_path
+            self._log_debug(f"Embedded {label}: {img_path} -> {temp_img_name}")
+        
+        return str(temp_img_path)
     
-    def _create_html_template(self, content: str, margins: Dict[str, str], title: str) -> str:
-        """Create HTML template with proper styling, margins, and document title."""
+    def _build_css_template(self) -> string.Template:
+        """Pre-fill the page stylesheet with the active style profile's font sizes.
         
-        # Get style profile configuration
+        Returns a template that only needs the page margins.
+        """
         profile = self.STYLE_PROFILES[self.style_profile]
         font_scale = profile["font_scale"]
-        base_font_size = profile["base_font_size"]
         
-        # Convert margins to cm for CSS
-        top_cm = self._convert_margin_to_cm(margins['top'])
-        right_cm = self._convert_margin_to_cm(margins['right'])
-        bottom_cm = self._convert_margin_to_cm(margins['bottom'])
-        left_cm = self._convert_margin_to_cm(margins['left'])
+        return string.Template(_PAGE_CSS_TEMPLATE.safe_substitute(
+            base_font_size=profile["base_font_size"],
+            h1_size=f"{1.6 * font_scale:.1f}",
+            h2_size=f"{1.3 * font_scale:.1f}",
+            h3_size=f"{1.1 * font_scale:.1f}",
+            h4_size=f"{1.0 * font_scale:.1f}",
+            h5_size=f"{0.9 * font_scale:.1f}",
+            small_size=f"{0.8 * font_scale:.1f}",
+        ))
+    
+    def _page_css(self, margins: Dict[str, str]) -> str:
+        """Return the complete page stylesheet for the given margins (cached per margin set)."""
+        key = (margins['top'], margins['right'], margins['bottom'], margins['left'])
+        css = self._page_css_cache.get(key)
+        if css is None:
+            # Convert margins to cm for CSS
+            top_cm, right_cm, bottom_cm, left_cm = self._margins_cm(margins)
+            
+            # Max image height: 80% of content area to leave room for headings/text
+            img_max_height_cm = 29.7 - top_cm - bottom_cm
+            
+            css = self._css_template.substitute(
+                top_cm=top_cm,
+                right_cm=right_cm,
+                bottom_cm=bottom_cm,
+                left_cm=left_cm,
+                img_max_height_cm=f"{img_max_height_cm:.2f}",
+            )
+            self._page_css_cache[key] = css
+        return css
+    
+    def _stylesheet_path(self, margins: Dict[str, str]) -> Path:
+        """Write the page stylesheet for (profile, margins) to the temp dir once and return its path.
         
-        # Max image height: 80% of content area to leave room for headings/text
-        img_max_height_cm = 29.7 - top_cm - bottom_cm
+        Every document with the same profile and margins links the same file, so Chromium
+        parses it once per browser instead of once per document.
+        """
+        margins_key = "_".join(margins[side] for side in ('top', 'right', 'bottom', 'left'))
+        css_path = (self.temp_dir / f"style_{self.style_profile}_{margins_key}.css").absolute()
+        if not css_path.exists():
+            # Write atomically: parallel workers may create the same stylesheet concurrently
+            self.temp_dir.mkdir(parents=True, exist_ok=True)
+            partial_path = css_path.with_name(f"{css_path.name}.{os.getpid()}.part")
+            partial_path.write_text(self._page_css(margins), encoding='utf-8')
+            os.replace(partial_path, css_path)
+        return css_path
+    
+    def _create_html_template(self, content: str, margins: Dict[str, str], title: str, inline_css: bool = False) -> str:
+        """Create HTML template with proper styling, margins, and document title.
         
-        html_template = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <style>
-        @page {{
-            margin: {top_cm}cm {right_cm}cm {bottom_cm}cm {left_cm}cm;
-            size: A4 portrait;
-            width: 210mm;
-            height: 297mm;
-        }}
-        
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            line-height: 1.4;
-            color: #333;
-            max-width: none;
-            margin: 0;
-            padding: 0;
-            font-size: {base_font_size};
-            width: 100%;
-            box-sizing: border-box;
-        }}
-        
-        /* Ensure content fits within A4 page boundaries */
-        * {{
-            box-sizing: border-box;
-        }}
-        
-        h1, h2, h3, h4, h5, h6 {{
-            color: #2c3e50;
-            margin-top: 0.8em;
-            margin-bottom: 0.3em;
-            font-weight: 600;
-        }}
-        
-        h1 {{
-            font-size: {1.6 * font_scale:.1f}em;
-            border-bottom: 2px solid #3498db;
-            padding-bottom: 0.2em;
-        }}
-        
-        h2 {{
-            font-size: {1.3 * font_scale:.1f}em;
-            border-bottom: 1px solid #bdc3c7;
-            padding-bottom: 0.1em;
-        }}
-        
-        h3 {{
-            font-size: {1.1 * font_scale:.1f}em;
-        }}
-        
-        h4 {{
-            font-size: {1.0 * font_scale:.1f}em;
-            text-decoration: underline;
-        }}
-        
-        h5 {{
-            font-size: {0.9 * font_scale:.1f}em;
-            text-decoration: underline;
-        }}
-        
-        h6 {{
-            font-size: {0.8 * font_scale:.1f}em;
-            text-decoration: underline;
-        }}
-        
-        p {{
-            margin: 0.5em 0;
-            text-align: justify;
-        }}
-        
-        code {{
-            background-color: #f8f9fa;
-            border: 1px solid #e9ecef;
-            border-radius: 3px;
-            padding: 0.1em 0.3em;
-            font-family: 'Courier New', Consolas, monospace;
-            font-size: {0.8 * font_scale:.1f}em;
-            color: #e83e8c;
-        }}
-        
-        pre {{
-            background-color: #f8f9fa;
-            border: 1px solid #e9ecef;
-            border-radius: 5px;
-            padding: 0.5em;
-            overflow-x: auto;
-            margin: 0.5em 0;
-            font-size: {0.8 * font_scale:.1f}em;
-        }}
-        
-        pre code {{
-            background: none;
-            border: none;
-            padding: 0;
-            color: #333;
-        }}
-        
-        blockquote {{
-            border-left: 4px solid #3498db;
-            margin: 0.5em 0;
-            padding: 0.3em 0.8em;
-            background-color: #f8f9fa;
-            color: #555;
-        }}
-        
-        table {{
-            border-collapse: collapse;
-            width: 100%;
-            margin: 0.5em 0;
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-        }}
-        
-        th, td {{
-            border: 1px solid #ddd;
-            padding: 0.3em;
-            text-align: left;
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-        }}
-        
-        th {{
-            background-color: #f8f9fa;
-            font-weight: 600;
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-        }}
-        
-        ul, ol {{
-            margin: 0.5em 0;
-            padding-left: 1.5em;
-            display: block;
-        }}
-        
-        li {{
-            margin: 0.2em 0;
-            display: list-item;
-            list-style-type: disc;
-        }}
-        
-        ul li {{
-            list-style-type: disc;
-        }}
-        
-        ol li {{
-            list-style-type: decimal;
-        }}
-        
-        /* Ensure nested lists work properly */
-        ul ul, ol ol, ul ol, ol ul {{
-            margin: 0.2em 0;
-            padding-left: 1.2em;
-        }}
-        
-        ul ul li {{
-            list-style-type: circle;
-        }}
-        
-        ul ul ul li {{
-            list-style-type: square;
-        }}
-        
-        img {{
-            max-width: 100%;
-            max-height: {img_max_height_cm:.2f}cm;
-            width: auto;
-            height: auto;
-            display: block;
-            margin: 0.5em auto;
-            object-fit: contain;
-        }}
-        
-        /* Specific styling for Mermaid diagram images */
-        img[alt*=""] {{
-            margin: 0.3em auto;
-            padding: 0;
-            border: none;
-            background: transparent;
-        }}
-        
-        a {{
-            color: #3498db;
-            text-decoration: none;
-        }}
-        
-        a:hover {{
-            text-decoration: underline;
-        }}
-        
-        .page-break {{
-            page-break-before: always;
-        }}
-        
-        /* Better page break handling for A4 */
-        h1, h2, h3 {{
-            page-break-after: avoid;
-            break-after: avoid;
-        }}
-        
-        h1, h2, h3, h4, h5, h6 {{
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }}
-        
-        p, li {{
-            orphans: 3;
-            widows: 3;
-        }}
-        
-        /* Prevent large elements from breaking across pages */
-        pre, blockquote, table, img {{
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }}
-        
-        /* Ensure tables fit within page width */
-        table {{
-            max-width: 100%;
-            table-layout: auto;
-        }}
-        
-        /* Force table font inheritance and override any defaults */
-        table, table *, table th, table td, table tr {{
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-            line-height: inherit !important;
-        }}
-        
-        /* Additional specificity for markdown-generated tables */
-        body table, body table th, body table td {{
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-        }}
-    </style>
-</head>
-<body>
-    {content}
-</body>
-</html>
+        By default the page links the shared stylesheet file in the temp dir; pass
+        inline_css=True for standalone HTML that is saved to the output directory.
         """
+        if inline_css:
+            stylesheet = f"<style>\n{self._page_css(margins)}    </style>"
+        else:
+            stylesheet = f'<link rel="stylesheet" href="{self._stylesheet_path(margins).as_uri()}">'
         
-        return html_template
+        return _HTML_TEMPLATE.substitute(
+            title=html.escape(title),
+            stylesheet=stylesheet,
+            content=content,
+        )
 
     def _extract_title(self, md_file: Path, content: str) -> str:
         """Extract the document title from markdown content.
@@ -1505,52 +1892,43 @@ class MarkdownToPDFConverter:
         2) Setext H1 style (line followed by '===')
         3) Humanized filename stem
         """
-        import re
+        # Titles live at the top of a note; only scan the head of the document
+        head = content[:_TITLE_SCAN_CHARS]
 
         # 1) ATX H1: lines that start with '# ' but not '## '
-        for line in content.splitlines():
-            stripped = line.strip()
-            if stripped.startswith('# '):
-                heading_text = stripped[2:].strip()
-                if heading_text:
-                    return heading_text
-
-        # 2) Setext H1: a line followed by a line of '=' (at least 3)
-        lines = content.splitlines()
-        for i in range(len(lines) - 1):
-            current_line = lines[i].rstrip()
-            underline = lines[i + 1].strip()
-            if current_line and re.fullmatch(r"=\s*=+", underline) or re.fullmatch(r"=+", underline):
-                return current_line.strip()
+        match = _ATX_H1_PATTERN.search(head)
+        if match:
+            return match.group('title').strip()
+
+        # 2) Setext H1: a non-blank line followed by a line of '='
+        match = _SETEXT_H1_PATTERN.search(head)
+        if match:
+            return match.group('title').strip()
 
         # 3) Fallback to humanized filename stem
         stem = md_file.stem.replace('_', ' ').replace('-', ' ').strip()
         return stem.title() if stem else md_file.stem
     
-    async def _convert_html_to_pdf(self, html_file: Path, output_pdf: Path, margins: Dict[str, str]) -> bool:
+    async def _convert_html_to_pdf(self, html_content: str, output_pdf: Path, margins: Dict[str, str]) -> bool:
         """Convert HTML to PDF using Playwright (Puppeteer approach).
         
+        The HTML is handed to the page directly (no intermediate file); images are
+        already inlined by pandoc's --self-contained output and the stylesheet is a
+        shared file:// link.
         Retries once with a fresh browser if the browser process crashes mid-conversion.
         """
         max_attempts = 2
         
         for attempt in range(1, max_attempts + 1):
             try:
-                # Reuse browser instance
-                await self._ensure_browser()
-                page = self._local.page
+                # Reuse browser instance and its PDF page
+                page = await self._get_pdf_page()
                 
-                # Load HTML file
-                await page.goto(html_file.absolute().as_uri())
-                
-                # Wait for content to load
-                await page.wait_for_load_state('networkidle')
+                # Load HTML and wait for content to settle
+                await page.set_content(html_content, wait_until='networkidle')
                 
                 # Convert margins to cm for PDF generation
-                top_cm = self._convert_margin_to_cm(margins['top'])
-                right_cm = self._convert_margin_to_cm(margins['right'])
-                bottom_cm = self._convert_margin_to_cm(margins['bottom'])
-                left_cm = self._convert_margin_to_cm(margins['left'])
+                top_cm, right_cm, bottom_cm, left_cm = self._margins_cm(margins)
                 
                 # Generate PDF with precise A4 settings
                 await page.pdf(
@@ -1641,19 +2019,20 @@ class MarkdownToPDFConverter:
                 html = html.replace(file_ref, copied_files[abs_key])
         
         output_html = bundle_dir / f"{stem}.html"
-        with open(output_html, 'w', encoding='utf-8') as f:
-            f.write(html)
+        output_html.write_text(html, encoding='utf-8')
         
         self._log_info(f"Saved HTML bundle to {bundle_dir} ({len(copied_files)} assets)")
     
-    def _convert_single_file(self, md_file: Path) -> tuple[str, str]:
+    def _convert_single_file(self, md_file: Path, md_hash: Optional[str] = None) -> tuple[str, str]:
         """Convert a single markdown file to PDF. Returns (status, filename).
         
-        Status is one of: 'converted', 'skipped', 'failed'.
+        Status is one of: 'converted', 'skipped', 'failed'. md_hash is the markdown hash
+        precomputed by convert_all; the file is hashed here only when it is not supplied.
         """
         try:
             filename = md_file.name
             output_pdf = self.pdf_dir / f"{md_file.stem}.pdf"
+            current_markdown_hash = md_hash
             
             # Check if conversion is needed before processing (unless force_regenerate is True)
             if not self.force_regenerate:
@@ -1661,7 +2040,8 @@ class MarkdownToPDFConverter:
                 if not output_pdf.exists():
                     self._log_info(f"Output pdf missing for {filename} - regenerating")
                 else:
-                    current_markdown_hash = calculate_file_hash(md_file)
+                    if current_markdown_hash is None:
+                        current_markdown_hash = calculate_file_hash(md_file)
                     
                     if not self.state_manager.needs_regeneration(filename, current_markdown_hash, output_pdf, self.style_profile,
                                                                 self.diagram_width, self.diagram_height, self.page_margins, True):
@@ -1669,89 +2049,84 @@ class MarkdownToPDFConverter:
                         return "skipped", filename
             
             try:
-                if self._convert_md_to_pdf(md_file, output_pdf):
+                if self._convert_md_to_pdf(md_file, output_pdf, current_markdown_hash):
                     return "converted", filename
                 else:
                     return "failed", filename
             finally:
-                # Clean up browser and event loop resources after processing file
-                tls = self._local
-                if hasattr(tls, 'event_loop') and tls.event_loop:
-                    tls.event_loop.run_until_complete(self._close_browser())
-                    tls.event_loop.close()
-                    tls.event_loop = None
+                # Only the diagram page is dropped; the browser and PDF page are reused for the next file
+                self._run_async(self._close_diagram_page())
                 
         except Exception as e:
             self._log_error(f"Error processing {md_file.name}: {e}")
             return "failed", md_file.name
 
-    def _convert_md_to_pdf(self, md_file: Path, output_pdf: Path) -> bool:
-        """Convert markdown file to PDF."""
+    def _convert_md_to_pdf(self, md_file: Path, output_pdf: Path, markdown_hash: Optional[str] = None) -> bool:
+        """Convert markdown file to PDF.
+        
+        markdown_hash is the hash already computed by the up-to-date check; the file is only hashed when it is not supplied.
+        """
         try:
-            # Create event loop once for entire file processing
-            tls = self._local
-            if not hasattr(tls, 'event_loop') or tls.event_loop is None or tls.event_loop.is_closed():
-                tls.event_loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(tls.event_loop)
-            
             # Calculate current markdown hash for saving state
-            current_markdown_hash = calculate_file_hash(md_file)
+            current_markdown_hash = markdown_hash or calculate_file_hash(md_file)
             filename = md_file.name
             
             self._log_info(f"Converting {filename} - markdown has changed or PDF missing")
             
             # Create progress bar for this file's conversion steps
-            with tqdm(total=6, desc=f"  {filename}", unit="step", leave=False) as pbar:
+            with tqdm(total=6, desc=f"  {filename}", unit="step", leave=False,
+                      disable=not self.show_inner_progress) as pbar:
                 # Step 1: Read markdown content
                 pbar.set_description(f"  {filename} - Reading")
-                with open(md_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                content = md_file.read_text(encoding='utf-8')
                 pbar.update(1)
                 
                 # Step 2: Process content
                 pbar.set_description(f"  {filename} - Processing")
                 processed_content = self._filter_sections_for_print(content)
-                file_id = md_file.stem
                 pbar.update(1)
                 
                 # Step 3: Process diagrams
                 pbar.set_description(f"  {filename} - Diagrams")
-                processed_content = self._replace_mermaid_with_images(processed_content, file_id, filename)
-                # Close browser after Mermaid rendering to free memory before PlantUML + PDF steps
-                tls.event_loop.run_until_complete(self._close_browser())
-                processed_content = self._replace_plantuml_with_images(processed_content, file_id, filename)
+                processed_content = self._replace_mermaid_with_images(processed_content, filename)
+                # Close the Mermaid page to free its memory before PlantUML + PDF steps
+                self._run_async(self._close_diagram_page())
+                processed_content = self._replace_plantuml_with_images(processed_content, filename)
                 pbar.update(1)
                 
                 # Step 4: Process page breaks and images
                 pbar.set_description(f"  {filename} - Images")
-                processed_content = self._process_page_breaks(processed_content)
-                processed_content = self._process_and_embed_images(processed_content, md_file)
+                # Page breaks and image references are rewritten in a single scan
+                processed_content = self._process_and_embed_images(processed_content, md_file, page_breaks=True)
                 pbar.update(1)
                 
                 # Step 5: Convert to HTML
                 pbar.set_description(f"  {filename} - HTML")
                 doc_title = self._extract_title(md_file, content)
-                temp_md = self.temp_dir / f"temp_{md_file.name}"
-                with open(temp_md, 'w', encoding='utf-8') as f:
-                    f.write(processed_content)
-                
-                html_file = self.temp_dir / f"{md_file.stem}.html"
-                cmd = [
-                    "pandoc",
-                    str(temp_md),
-                    "-o", str(html_file),
-                    "--standalone",
-                    "--self-contained",
-                    "--css", "data:text/css,",
-                ]
-                
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                if result.returncode != 0:
-                    self._log_error(f"Pandoc failed: {result.stderr}")
-                    return False
+                html_output = None
+                if self._pandoc_server:
+                    html_output = self._pandoc_via_server(
+                        processed_content, "html", {"standalone": True, "embed-resources": True}
+                    )
                 
-                with open(html_file, 'r', encoding='utf-8') as f:
-                    html_content = f.read()
+                if html_output is not None:
+                    html_content = html_output.decode('utf-8')
+                else:
+                    # Markdown goes in on stdin and HTML comes back on stdout: no temp files
+                    cmd = [
+                        "pandoc",
+                        "--from", "markdown",
+                        "--to", "html",
+                        "--standalone",
+                        "--self-contained",
+                        "--css", "data:text/css,",
+                    ]
+                    
+                    result = subprocess.run(cmd, input=processed_content, capture_output=True, encoding='utf-8')
+                    if result.returncode != 0:
+                        self._log_error(f"Pandoc failed: {result.stderr}")
+                        return False
+                    html_content = result.stdout
                 
                 # Strip pandoc's HTML wrapper so we only inject <body> content
                 # into our own template (avoids invalid nested <html> documents)
@@ -1762,24 +2137,23 @@ class MarkdownToPDFConverter:
                 
                 margins = self._parse_margins()
                 enhanced_html = self._create_html_template(html_content, margins, doc_title)
-                enhanced_html_file = self.temp_dir / f"enhanced_{md_file.stem}.html"
-                with open(enhanced_html_file, 'w', encoding='utf-8') as f:
-                    f.write(enhanced_html)
                 
-                # Save HTML output if requested
+                # Save HTML output if requested (with the stylesheet inlined so it stands alone)
+                if self.html_dir or self.save_html_bundle:
+                    standalone_html = self._create_html_template(html_content, margins, doc_title, inline_css=True)
                 if self.html_dir:
                     output_html = self.html_dir / f"{md_file.stem}.html"
-                    shutil.copy2(enhanced_html_file, output_html)
+                    output_html.write_text(standalone_html, encoding='utf-8')
                     self._log_debug(f"Saved HTML to {output_html}")
                 if self.save_html_bundle:
-                    self._save_html_bundle(enhanced_html, md_file)
+                    self._save_html_bundle(standalone_html, md_file)
                 pbar.update(1)
                 
                 # Step 6: Convert to PDF
                 pbar.set_description(f"  {filename} - PDF")
                 self._log_debug(f"Converting HTML to PDF with margins: {margins}")
-                success = tls.event_loop.run_until_complete(
-                    self._convert_html_to_pdf(enhanced_html_file, output_pdf, margins)
+                success = self._run_async(
+                    self._convert_html_to_pdf(enhanced_html, output_pdf, margins)
                 )
                 pbar.update(1)
             
@@ -1801,6 +2175,11 @@ class MarkdownToPDFConverter:
     
     def convert_all(self, cleanup: bool = True, parallel: bool = True) -> None:
         """Convert all markdown files in source directory to PDF."""
+        # Hashes are only memoized within one run; sources may have changed since the last
+        clear_file_hash_cache()
+        # Read every stored state in one query so the per-file up-to-date checks are dict lookups
+        self.state_manager.load_all()
+        
         md_files = list(self.source_dir.glob("*.md"))
         
         if not md_files:
@@ -1815,12 +2194,29 @@ class MarkdownToPDFConverter:
         self._log_info(f"Output directory: {self.pdf_dir.absolute()}")
         self._log_info(f"Found {len(md_files)} markdown files: {[f.name for f in md_files]}")
         
+        # Hashing is I/O bound: read every source once, concurrently, before any conversion starts
+        md_hashes = self._hash_sources(md_files)
+        
+        # Diagram rendering is server-bound and independent across files: do all of it up front
+        self._pre_render_plantuml_diagrams(md_files, md_hashes)
+        
         if parallel and len(md_files) > 1:
             self._log_info(f"Using parallel processing with {self.max_workers} workers")
-            self._convert_all_parallel(md_files, cleanup)
+            self._convert_all_parallel(md_files, cleanup, md_hashes)
         else:
             self._log_info("Using sequential processing")
-            self._convert_all_sequential(md_files, cleanup)
+            self._convert_all_sequential(md_files, cleanup, md_hashes)
+    
+    def _hash_sources(self, md_files: List[Path]) -> Dict[Path, Optional[str]]:
+        """Hash markdown files on a thread pool. Unreadable files map to None (retried per file)."""
+        def hash_or_none(md_file: Path) -> Optional[str]:
+            try:
+                return calculate_file_hash(md_file)
+            except RuntimeError:
+                return None
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(32, len(md_files)))) as pool:
+            return dict(zip(md_files, pool.map(hash_or_none, md_files)))
     
     def _get_constructor_kwargs(self) -> dict:
         """Return the kwargs needed to reconstruct this converter in a worker process."""
@@ -1838,9 +2234,11 @@ class MarkdownToPDFConverter:
             'force_regenerate': self.force_regenerate,
             'save_html': self.save_html,
             'save_html_bundle': self.save_html_bundle,
+            # Workers' nested bars would interleave on the terminal; the parent's file bar is enough
+            'show_inner_progress': False,
         }
     
-    def _convert_all_parallel(self, md_files: List[Path], cleanup: bool) -> None:
+    def _convert_all_parallel(self, md_files: List[Path], cleanup: bool, md_hashes: Optional[Dict[Path, Optional[str]]] = None) -> None:
         """Convert files in parallel using ProcessPoolExecutor.
         
         Each worker runs in its own OS process with a separate Chromium instance,
@@ -1862,7 +2260,10 @@ class MarkdownToPDFConverter:
             initargs=(converter_kwargs,)
         ) as executor:
             # Submit all tasks
-            future_to_file = {executor.submit(_worker_convert_file, md_file): md_file for md_file in md_files}
+            md_hashes = md_hashes or {}
+            future_to_file = {
+                executor.submit(_worker_convert_file, md_file, md_hashes.get(md_file)): md_file for md_file in md_files
+            }
             
             # Process completed tasks with progress bar
             with tqdm(total=len(md_files), desc="Converting files", unit="file") as pbar:
@@ -1894,7 +2295,7 @@ class MarkdownToPDFConverter:
             shutil.rmtree(self.temp_dir, ignore_errors=True)
             self._log_debug(f"Cleaned up temporary directory: {self.temp_dir}")
     
-    def _convert_all_sequential(self, md_files: List[Path], cleanup: bool) -> None:
+    def _convert_all_sequential(self, md_files: List[Path], cleanup: bool, md_hashes: Optional[Dict[Path, Optional[str]]] = None) -> None:
         """Convert files sequentially (original implementation)."""
         success_count = 0
         skipped_count = 0
@@ -1902,7 +2303,7 @@ class MarkdownToPDFConverter:
         
         # Use progress bar for sequential conversion
         for md_file in tqdm(md_files, desc="Converting files", unit="file"):
-            status, filename = self._convert_single_file(md_file)
+            status, filename = self._convert_single_file(md_file, (md_hashes or {}).get(md_file))
             if status == "converted":
                 success_count += 1
             elif status == "skipped":
@@ -1910,6 +2311,9 @@ class MarkdownToPDFConverter:
             else:
                 failed_count += 1
         
+        # The browser was kept alive across files; shut it down now the batch is done
+        self._run_async(self._close_browser())
+        
         total_processed = success_count + skipped_count + failed_count
         self._log_success(f"Sequential conversion complete: {success_count} files converted, {skipped_count} files skipped, {failed_count} files failed ({total_processed}/{len(md_files)} total)")
         self._log_info(f"PDF files saved to: {self.pdf_dir.absolute()}")
@@ -1919,10 +2323,9 @@ class MarkdownToPDFConverter:
             self._log_debug(f"Cleaned up temporary directory: {self.temp_dir}")
 
 
-def main():
-    """Main entry point."""
-    import argparse
-    
+@functools.lru_cache(maxsize=1)
+def _build_parser() -> argparse.ArgumentParser:
+    """Build the command-line parser (once per process)."""
     parser = argparse.ArgumentParser(description="Convert markdown files to PDF with Mermaid and PlantUML support (Puppeteer approach)")
     parser.add_argument("--source", default=None, help="Source directory (default: from config/env/docs)")
     parser.add_argument("--output-dir", default=None, help="Output directory (default: from config/env/output). PDF files will be saved in output/pdf/ subfolder")
@@ -1940,8 +2343,20 @@ def main():
     parser.add_argument("--force", action="store_true", help="Force regeneration of all files, bypassing document verification")
     parser.add_argument("--save-html", action="store_true", help="Save the intermediate HTML files alongside PDFs (output/html/)")
     parser.add_argument("--save-html-bundle", action="store_true", help="Save HTML with external image assets in output/html/{name}/")
+    return parser
+
+
+def run_from_args(args) -> None:
+    """Run a conversion from parsed arguments.
     
-    args = parser.parse_args()
+    args is the namespace produced by the CLI parser; programmatic callers may pass a
+    types.SimpleNamespace to skip argument parsing entirely. Any option it leaves out takes
+    its CLI default.
+    """
+    # Fill in options the caller left out from the parser's declared defaults, without parsing
+    defaults = {action.dest: action.default for action in _build_parser()._actions
+                if action.default is not argparse.SUPPRESS}
+    args = argparse.Namespace(**{**defaults, **vars(args)})
     
     # Build config from CLI args
     cli_config = {}
@@ -1955,13 +2370,11 @@ def main():
         cli_config["db_path"] = args.db_path
     if args.max_diagram_width:
         # Parse dimension value (can be int string or percentage)
-        from .config import parse_dimension_value
         parsed = parse_dimension_value(args.max_diagram_width)
         if parsed is not None:
             cli_config["max_diagram_width"] = parsed
     if args.max_diagram_height:
         # Parse dimension value (can be int string or percentage)
-        from .config import parse_dimension_value
         parsed = parse_dimension_value(args.max_diagram_height)
         if parsed is not None:
             cli_config["max_diagram_height"] = parsed
@@ -2002,5 +2415,11 @@ def main():
     converter.convert_all(cleanup=not args.no_cleanup, parallel=not args.no_parallel)
 
 
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Main entry point."""
+    run_from_args(_build_parser().parse_args(argv))
+
+
 if __name__ == "__main__":
     main()
@@ -6,15 +6,45 @@ Provides platform-specific installation guidance.
 MIT License - Copyright (c) 2025 Markdown to PDF Converter
 """
 
+import os
+import json
+import functools
+import shlex
+import shutil
 import subprocess
 import sys
 import platform
+import importlib.util
+from pathlib import Path
 from typing import Tuple, List, Optional
 from colorama import Fore, Style, init
 
 init(autoreset=True)
 
 
+@functools.lru_cache(maxsize=None)
+def _tool_available(command: str, run_version: bool) -> bool:
+    """Probe an external tool once per process (PATH lookup, plus `--version` if run_version)."""
+    if shutil.which(command) is None:
+        return False
+    if not run_version:
+        return True
+    
+    try:
+        # Only the exit status matters: discard the version banner instead of piping it back
+        subprocess.run(
+            [command, "--version"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            timeout=5
+        )
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
+        return False
+
+
 class DependencyChecker:
     """Check and report on required and optional dependencies."""
     
@@ -25,49 +55,111 @@ class DependencyChecker:
         self.missing_external_tools: List[Tuple[str, str]] = []  # (name, install_instructions)
     
     def check_python_package(self, package_name: str, import_name: Optional[str] = None) -> bool:
-        """Check if a Python package is installed."""
+        """Check if a Python package is installed.
+        
+        Only the import system's finders are consulted; the package itself is not imported.
+        """
         if import_name is None:
             import_name = package_name
         
         try:
-            __import__(import_name)
-            return True
-        except ImportError:
+            found = importlib.util.find_spec(import_name) is not None
+        except (ImportError, ValueError):
+            found = False
+        if not found:
             self.missing_python_packages.append(package_name)
+        return found
+    
+    def check_external_tool(self, command: str, name: str, install_instructions: str,
+                            run_version: bool = False) -> bool:
+        """Check if an external tool is available.
+        
+        By default this is a PATH lookup, which starts no process (pandoc and Calibre are slow
+        to launch). With run_version=True the tool is also executed with --version.
+        Results are cached for the life of the process; missing tools are still recorded per checker.
+        """
+        if not _tool_available(command, run_version):
+            self.missing_external_tools.append((name, install_instructions))
             return False
+        return True
+    
+    def _playwright_browsers_dir(self, package_dir: Path) -> Path:
+        """Directory Playwright installs browsers into (mirrors its registry's defaults)."""
+        browsers_path = os.environ.get("PLAYWRIGHT_BROWSERS_PATH")
+        if browsers_path == "0":
+            return package_dir / "driver" / "package" / ".local-browsers"
+        if browsers_path:
+            return Path(browsers_path)
+        if self.system == "Windows":
+            return Path(os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local")) / "ms-playwright"
+        elif self.system == "Darwin":  # macOS
+            return Path.home() / "Library" / "Caches" / "ms-playwright"
+        else:  # Linux
+            return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "ms-playwright"
     
-    def check_external_tool(self, command: str, name: str, install_instructions: str) -> bool:
-        """Check if an external tool is available."""
+    def _chromium_revision_installed(self) -> bool:
+        """Check on disk whether the Chromium revision pinned by the installed Playwright is present.
+        
+        Reads the bundled driver's browsers.json and looks for the installer's completion marker,
+        without importing Playwright or starting its driver. Newer Playwright releases launch
+        headless Chromium from a separate chromium-headless-shell download, so when that entry is
+        listed it must be present as well. False means "not confirmed".
+        """
         try:
-            subprocess.run(
-                [command, "--version"],
-                capture_output=True,
-                check=True,
-                timeout=5
-            )
-            return True
-        except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-            self.missing_external_tools.append((name, install_instructions))
+            spec = importlib.util.find_spec("playwright")
+            package_dir = Path(spec.submodule_search_locations[0])
+            browsers_json = package_dir / "driver" / "package" / "browsers.json"
+            with open(browsers_json, 'r', encoding='utf-8') as f:
+                browsers = json.load(f)["browsers"]
+            revisions = {b["name"]: b["revision"] for b in browsers
+                         if b["name"] in ("chromium", "chromium-headless-shell")}
+        except Exception:
+            return False
+        if "chromium" not in revisions:
             return False
+        
+        browsers_dir = self._playwright_browsers_dir(package_dir)
+        # Install directories use underscores in the browser name, e.g. chromium_headless_shell-1169
+        return all(
+            (browsers_dir / f"{name.replace('-', '_')}-{revision}" / "INSTALLATION_COMPLETE").exists()
+            for name, revision in revisions.items()
+        )
     
     def check_playwright_browsers(self) -> bool:
-        """Check if Playwright browsers are installed."""
+        """Check if Playwright browsers are installed.
+        
+        The pinned revision is looked up on disk first; Playwright's Node driver is only
+        started when that cannot confirm it.
+        """
+        if self._chromium_revision_installed():
+            return True
+        
         try:
-            result = subprocess.run(
-                [sys.executable, "-m", "playwright", "install", "--dry-run", "chromium"],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            # If chromium is already installed, dry-run will succeed
-            # If not installed, it will mention installation
-            return "chromium" in result.stdout.lower() or result.returncode == 0
+            # Ask Playwright where its Chromium lives from this process, instead of starting a
+            # second interpreter for `playwright install --dry-run` (which also succeeded when
+            # the browser was missing)
+            from playwright.sync_api import sync_playwright
+            with sync_playwright() as playwright:
+                executable_path = playwright.chromium.executable_path
+            return os.path.exists(executable_path)
         except Exception:
             return False
     
+    def _quoted_executable(self) -> str:
+        """The running interpreter's path, quoted for pasting into this platform's shell."""
+        if self.system == "Windows":
+            return subprocess.list2cmdline([sys.executable])
+        return shlex.quote(sys.executable)
+    
+    def get_pip_install_command(self, package_name: str) -> str:
+        """Get the command to install a Python package, preferring uv when it is on PATH."""
+        if shutil.which("uv"):
+            return f"uv pip install --python {self._quoted_executable()} {package_name}"
+        return f"{self._quoted_executable()} -m pip install {package_name}"
+    
     def get_playwright_install_command(self) -> str:
         """Get platform-specific Playwright install command."""
-        return f"{sys.executable} -m playwright install chromium"
+        return f"{self._quoted_executable()} -m playwright install chromium"
     
     def get_pandoc_install_instructions(self) -> str:
         """Get platform-specific Pandoc installation instructions."""
@@ -97,7 +189,7 @@ class DependencyChecker:
         
         if not self.check_python_package("playwright", "playwright"):
             all_ok = False
-            messages.append(f"{Fore.RED}[MISSING]{Style.RESET_ALL} playwright - Run: pip install playwright")
+            messages.append(f"{Fore.RED}[MISSING]{Style.RESET_ALL} playwright - Run: {self.get_pip_install_command('playwright')}")
             messages.append(f"  Then install browser: {self.get_playwright_install_command()}")
         else:
             print(f"{Fore.GREEN}[OK]{Style.RESET_ALL} playwright is available")
@@ -111,13 +203,13 @@ class DependencyChecker:
         
         if not self.check_python_package("plantuml", "plantuml"):
             all_ok = False
-            messages.append(f"{Fore.RED}[MISSING]{Style.RESET_ALL} plantuml - Run: pip install plantuml")
+            messages.append(f"{Fore.RED}[MISSING]{Style.RESET_ALL} plantuml - Run: {self.get_pip_install_command('plantuml')}")
         else:
             print(f"{Fore.GREEN}[OK]{Style.RESET_ALL} plantuml is available")
         
         if not self.check_python_package("colorama", "colorama"):
             all_ok = False
-            messages.append(f"{Fore.RED}[MISSING]{Style.RESET_ALL} colorama - Run: pip install colorama")
+            messages.append(f"{Fore.RED}[MISSING]{Style.RESET_ALL} colorama - Run: {self.get_pip_install_command('colorama')}")
         else:
             print(f"{Fore.GREEN}[OK]{Style.RESET_ALL} colorama is available")
         
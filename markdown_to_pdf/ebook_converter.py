@@ -8,11 +8,22 @@ MIT License - Copyright (c) 2025 Markdown to PDF Converter
 
 import os
 import sys
+import argparse
 import subprocess
 import tempfile
 import shutil
 import json
+import base64
+import hashlib
+import importlib.util
+import urllib.request
+import functools
+import re
 import time
+import html
+import mimetypes
+import string
+import uuid
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import asyncio
@@ -20,1868 +31,2506 @@ from playwright.async_api import async_playwright
 import plantuml
 from colorama import init, Fore, Back, Style
 from PIL import Image, ImageFilter
-from .verification import DocumentStateManager, calculate_file_hash
-from .config import Config
+from .verification import DocumentStateManager, calculate_file_hash, clear_file_hash_cache
+from .config import Config, parse_dimension_value
 from .dependencies import check_dependencies
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import threading
 import multiprocessing
+import multiprocessing.util
 from tqdm import tqdm
 
-# --- Module-level worker infrastructure for ProcessPoolExecutor ---
-_ebook_worker_converter = None
+# Page stylesheet for HTML -> PDF rendering. Profile-dependent font sizes are filled in once per
+# converter (see _build_css_template); margins are filled in per margin set (see _page_css).
+_PAGE_CSS_TEMPLATE = string.Template("""@page {
+    margin: ${top_cm}cm ${right_cm}cm ${bottom_cm}cm ${left_cm}cm;
+    size: A4 portrait;
+    width: 210mm;
+    height: 297mm;
+}
 
+body {
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
+    line-height: 1.4;
+    color: #333;
+    max-width: none;
+    margin: 0;
+    padding: 0;
+    font-size: ${base_font_size};
+    width: 100%;
+    box-sizing: border-box;
+}
 
-def _init_ebook_worker_process(converter_kwargs: dict) -> None:
-    """Initializer called once per worker process. Creates a process-local converter."""
-    global _ebook_worker_converter
-    _ebook_worker_converter = MarkdownToEbookConverter(**converter_kwargs)
+/* Ensure content fits within A4 page boundaries */
+* {
+    box-sizing: border-box;
+}
 
+h1, h2, h3, h4, h5, h6 {
+    color: #2c3e50;
+    margin-top: 0.8em;
+    margin-bottom: 0.3em;
+    font-weight: 600;
+}
 
-def _ebook_worker_convert_file(md_file: Path) -> tuple:
-    """Top-level function executed in worker process. Converts a single file."""
-    return _ebook_worker_converter._convert_single_file(md_file)
+h1 {
+    font-size: ${h1_size}em;
+    border-bottom: 2px solid #3498db;
+    padding-bottom: 0.2em;
+}
 
+h2 {
+    font-size: ${h2_size}em;
+    border-bottom: 1px solid #bdc3c7;
+    padding-bottom: 0.1em;
+}
 
-# Initialize colorama for cross-platform colored output
-init(autoreset=True)
+h3 {
+    font-size: ${h3_size}em;
+}
 
+h4 {
+    font-size: ${h4_size}em;
+    text-decoration: underline;
+}
 
-class MarkdownToEbookConverter:
-    """Markdown to Ebook converter supporting PDF, EPUB, and MOBI formats."""
-    
-    # Style profiles configuration
-    STYLE_PROFILES = {
-        "a4-print": {
-            "name": "A4 Print (Default)",
-            "description": "Standard print-optimized styling with 12px base font",
-            "font_scale": 1.0,
-            "base_font_size": "12px",
-            "formats": ["pdf"]
-        },
-        "a4-screen": {
-            "name": "A4 Screen (Large)",
-            "description": "Screen-optimized styling with 30% larger fonts for better readability",
-            "font_scale": 1.3,
-            "base_font_size": "15.6px",
-            "formats": ["pdf"]
-        },
-        "kindle-basic": {
-            "name": "Kindle Basic",
-            "description": "Basic Kindle formatting optimized for e-ink displays",
-            "font_scale": 1.0,
-            "base_font_size": "12px",
-            "formats": ["epub", "mobi"]
-        },
-        "kindle-large": {
-            "name": "Kindle Large Text",
-            "description": "Large text for better readability on Kindle devices",
-            "font_scale": 1.2,
-            "base_font_size": "14px",
-            "formats": ["epub", "mobi"]
-        },
-        "kindle-paperwhite-11": {
-            "name": "Kindle Paperwhite 11th Gen",
-            "description": "Optimized for Kindle Paperwhite 11th generation (6.8\" 300ppi display)",
-            "font_scale": 1.1,
-            "base_font_size": "13px",
-            "formats": ["epub", "mobi"]
-        }
+h5 {
+    font-size: ${h5_size}em;
+    text-decoration: underline;
+}
+
+h6 {
+    font-size: ${small_size}em;
+    text-decoration: underline;
+}
+
+p {
+    margin: 0.5em 0;
+    text-align: justify;
+}
+
+code {
+    background-color: #f8f9fa;
+    border: 1px solid #e9ecef;
+    border-radius: 3px;
+    padding: 0.1em 0.3em;
+    font-family: 'Courier New', Consolas, monospace;
+    font-size: ${small_size}em;
+    color: #e83e8c;
+}
+
+pre {
+    background-color: #f8f9fa;
+    border: 1px solid #e9ecef;
+    border-radius: 5px;
+    padding: 0.5em;
+    overflow-x: auto;
+    margin: 0.5em 0;
+    font-size: ${small_size}em;
+}
+
+pre code {
+    background: none;
+    border: none;
+    padding: 0;
+    color: #333;
+}
+
+blockquote {
+    border-left: 4px solid #3498db;
+    margin: 0.5em 0;
+    padding: 0.3em 0.8em;
+    background-color: #f8f9fa;
+    color: #555;
+}
+
+table {
+    border-collapse: collapse;
+    width: 100%;
+    margin: 0.5em 0;
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+}
+
+th, td {
+    border: 1px solid #ddd;
+    padding: 0.3em;
+    text-align: left;
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+}
+
+th {
+    background-color: #f8f9fa;
+    font-weight: 600;
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+}
+
+ul, ol {
+    margin: 0.5em 0;
+    padding-left: 1.5em;
+    display: block;
+}
+
+li {
+    margin: 0.2em 0;
+    display: list-item;
+    list-style-type: disc;
+}
+
+ul li {
+    list-style-type: disc;
+}
+
+ol li {
+    list-style-type: decimal;
+}
+
+/* Ensure nested lists work properly */
+ul ul, ol ol, ul ol, ol ul {
+    margin: 0.2em 0;
+    padding-left: 1.2em;
+}
+
+ul ul li {
+    list-style-type: circle;
+}
+
+ul ul ul li {
+    list-style-type: square;
+}
+
+img {
+    max-width: 100%;
+    max-height: ${img_max_height_cm}cm;
+    width: auto;
+    height: auto;
+    display: block;
+    margin: 0.5em auto;
+    object-fit: contain;
+}
+
+/* Specific styling for Mermaid diagram images */
+img[alt*=""] {
+    margin: 0.3em auto;
+    padding: 0;
+    border: none;
+    background: transparent;
+}
+
+a {
+    color: #3498db;
+    text-decoration: none;
+}
+
+a:hover {
+    text-decoration: underline;
+}
+
+.page-break {
+    page-break-before: always;
+}
+
+/* Better page break handling for A4 */
+h1, h2, h3 {
+    page-break-after: avoid;
+    break-after: avoid;
+}
+
+h1, h2, h3, h4, h5, h6 {
+    page-break-inside: avoid;
+    break-inside: avoid;
+}
+
+p, li {
+    orphans: 3;
+    widows: 3;
+}
+
+/* Prevent large elements from breaking across pages */
+pre, blockquote, table, img {
+    page-break-inside: avoid;
+    break-inside: avoid;
+}
+
+/* Ensure tables fit within page width */
+table {
+    max-width: 100%;
+    table-layout: auto;
+}
+
+/* Force table font inheritance and override any defaults */
+table, table *, table th, table td, table tr {
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+    line-height: inherit !important;
+}
+
+/* Additional specificity for markdown-generated tables */
+body table, body table th, body table td {
+    font-size: ${base_font_size} !important;
+    font-family: inherit !important;
+}
+""")
+
+# Per-document HTML shell; ${stylesheet} is either a <link> to the shared stylesheet file
+# (PDF rendering) or an inline <style> block (saved HTML output)
+_HTML_TEMPLATE = string.Template("""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>${title}</title>
+    ${stylesheet}
+</head>
+<body>
+    ${content}
+</body>
+</html>
+""")
+
+
+# Markdown ![alt](src) or HTML <img src="..."> reference; match.lastgroup tells which form matched
+_IMAGE_REF_PATTERN = re.compile(
+    r'(?P<md>!\[(?P<alt>[^\]]*)\]\((?P<md_src>[^)]+)\))'
+    r'|(?P<html><img[^>]+src=["\'](?P<html_src>[^"\']+)["\'][^>]*>)'
+)
+
+
+# Title extraction (see _extract_title): ATX "# Title" and setext "Title\n=====" level-1 headings
+_TITLE_SCAN_CHARS = 8192
+_ATX_H1_PATTERN = re.compile(r'^[ \t]*# (?P<title>[^\n]*\S)', re.MULTILINE)
+# Setext underlines may have spaces between the '=' signs ('= = =', '= ==')
+_SETEXT_H1_PATTERN = re.compile(r'^(?P<title>[^\n]*\S)[ \t]*\r?\n[ \t]*=[= \t]*\r?$', re.MULTILINE)
+
+
+# Mermaid/PlantUML code blocks, optionally preceded by a <!-- no-resize --> or <!-- scale:N% -->
+# modifier line. Handles both Unix (\n) and Windows (\r\n) line endings.
+# Groups: 1 = "no-resize", 2 = scale percentage digits, 3 = diagram code
+_DIAGRAM_PATTERNS = {
+    kind: re.compile(
+        r'(?:<!--\s*(?:(no-resize)|scale:(\d+)%)\s*-->\s*\r?\n)?```' + kind + r'\r?\n(.*?)\r?\n```',
+        re.DOTALL | re.IGNORECASE
+    )
+    for kind in ("mermaid", "plantuml")
+}
+
+# Upper bound on PlantUML server requests in flight at once for one document, and for the
+# up-front pass over every file in a batch (see _pre_render_plantuml_diagrams)
+_PLANTUML_CONCURRENCY = 4
+_PLANTUML_PRERENDER_CONCURRENCY = 16
+
+# Diagram cache key part for Mermaid diagrams rendered in the browser (see _diagram_cache_path)
+_PLAYWRIGHT_RENDERER_ID = ("playwright",)
+
+
+# Page break markers, all rewritten in a single pass:
+#   <!-- page-break -->              HTML comment
+#   <div class="page-break"></div>   HTML div (already the target form for PDF)
+#   ```page-break\n```               custom code block
+#   <page-break>                     custom tag
+#   ---\n{.page-break}               horizontal rule with Pandoc attribute
+_PAGE_BREAK_DIV = '<div class="page-break"></div>'
+_PAGE_BREAK_PATTERN = re.compile(
+    r'<!--\s*page-break\s*-->'
+    r'|<div class="page-break"></div>'
+    r'|```page-break\n```'
+    r'|<page-break>'
+    r'|---\s*\n\s*\{\.page-break\}',
+    re.IGNORECASE
+)
+
+# Page breaks and image references rewritten together in one scan (see _process_and_embed_images);
+# the page-break alternative keeps its case-insensitivity, the image alternatives stay case-sensitive
+_PAGE_BREAK_OR_IMAGE_PATTERN = re.compile(
+    f'(?P<page_break>(?i:{_PAGE_BREAK_PATTERN.pattern}))|{_IMAGE_REF_PATTERN.pattern}'
+)
+
+
+# Margin conversion is pure and sees the same few margin strings for every document: memoize it
+_MARGIN_PATTERN = re.compile(r'^(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*(cm|in|mm|pt|px)?$')
+
+
+@functools.lru_cache(maxsize=64)
+def _margin_to_cm(margin_str: str) -> float:
+    """Convert a margin string (e.g. "1in", "2.5cm") to centimeters; unparseable values give 1 inch."""
+    match = _MARGIN_PATTERN.match(margin_str.strip())
+    if not match:
+        return 2.54  # default 1 inch in cm
+    
+    value_str, unit = match.groups()
+    value = float(value_str)
+    
+    # Convert to cm (no unit means inches)
+    if unit == 'cm':
+        return value
+    elif unit == 'mm':
+        return value / 10
+    elif unit == 'pt':
+        return value * 0.0352778
+    elif unit == 'px':
+        return value * 0.0264583
+    else:
+        return value * 2.54
+
+
+@functools.lru_cache(maxsize=64)
+def _margins_to_cm(margins_key: tuple) -> tuple:
+    """Convert a (top, right, bottom, left) margin-string tuple to centimeters."""
+    return tuple(_margin_to_cm(margin) for margin in margins_key)
+
+
+# Device-specific EPUB stylesheet for the kindle-paperwhite-11 profile (see _create_paperwhite_css)
+_PAPERWHITE_CSS = """
+/* Kindle Paperwhite 11th Generation Optimized CSS */
+/* 6.8" E Ink Carta screen, 1648 x 1236 pixels, 300 ppi */
+
+/* Base styles optimized for 300ppi display */
+body {
+    font-family: "Bookerly", "Caecilia", "Helvetica", "Arial", sans-serif;
+    font-size: 13px;
+    line-height: 1.6;
+    color: #000000;
+    margin: 0;
+    padding: 0.8em;
+    text-align: justify;
+    hyphens: auto;
+    -webkit-hyphens: auto;
+    -moz-hyphens: auto;
+    -ms-hyphens: auto;
+}
+
+/* Media query for Kindle Paperwhite 11th generation */
+@media only screen and (min-width: 1648px) and (max-width: 1648px) and (min-height: 1236px) and (max-height: 1236px) {
+    body {
+        font-size: 14px;
+        line-height: 1.7;
+        padding: 1em;
     }
     
-    def __init__(self, source_dir: str, output_dir: str, temp_dir: str, 
-                 output_format: str = "pdf", page_margins: str = "1in 0.75in", 
-                 debug: bool = False, db_path: Optional[str] = None, 
-                 style_profile: str = "a4-print", max_workers: int = 4,
-                 author: str = "Unknown Author", language: str = "en",
-                 max_diagram_width = 1680, max_diagram_height = 2240, 
-                 force_regenerate: bool = False):
-        """Initialize the converter.
-        
-        Args:
-            max_diagram_width: Max width in pixels (int, only resize if rendered exceeds) or percentage of rendered size (str like "80%")
-            max_diagram_height: Max height in pixels (int, only resize if rendered exceeds) or percentage of rendered size (str like "80%")
-            force_regenerate: If True, bypass verification and regenerate all files
-        """
-        self.source_dir = Path(source_dir)
-        self.output_dir = Path(output_dir)
-        self.temp_dir = Path(temp_dir)
-        self.output_format = output_format.lower()
-        self.page_margins = page_margins
-        self.debug = debug
-        self.style_profile = style_profile
-        self.max_workers = max_workers
-        self.author = author
-        self.language = language
-        self.diagram_width = max_diagram_width
-        self.diagram_height = max_diagram_height
-        self.force_regenerate = force_regenerate
-        self._lock = threading.Lock()  # For logging in sequential mode
-        
-        # Browser and event loop state (process-isolated; each worker process gets its own converter)
-        self._local = type('BrowserState', (), {})()
-        
-        # Performance optimization: reuse PlantUML client for connection pooling
-        # Get PlantUML server URL from config (supports local or external server)
-        from .config import Config
-        config = Config()
-        self._plantuml_server = config.get_plantuml_server()
-        self._plantuml_client = plantuml.PlantUML(url=self._plantuml_server)
-        self._log_debug(f"Using PlantUML server: {self._plantuml_server}")
-        
-        # Create format-specific output directory
-        self.format_output_dir = self.output_dir / self.output_format
-        
-        # Validate output format
-        valid_formats = ["pdf", "epub", "mobi"]
-        if self.output_format not in valid_formats:
-            raise ValueError(f"Invalid output format '{self.output_format}'. Valid formats: {valid_formats}")
-        
-        # Validate style profile
-        if style_profile not in self.STYLE_PROFILES:
-            available_profiles = ", ".join(self.STYLE_PROFILES.keys())
-            raise ValueError(f"Invalid style profile '{style_profile}'. Available profiles: {available_profiles}")
-        
-        # Check if style profile supports the output format
-        profile = self.STYLE_PROFILES[self.style_profile]
-        if self.output_format not in profile["formats"]:
-            supported_formats = ", ".join(profile["formats"])
-            raise ValueError(f"Style profile '{style_profile}' does not support format '{self.output_format}'. Supported formats: {supported_formats}")
-        
-        # Initialize document state manager with configurable db_path
-        if db_path is None:
-            config = Config()
-            db_path = config.get_db_path()
-        self.state_manager = DocumentStateManager(db_path)
-        
-        # Create directories
-        self.output_dir.mkdir(exist_ok=True)
-        self.format_output_dir.mkdir(exist_ok=True)
-        self.temp_dir.mkdir(exist_ok=True)
-        
-        # Log configuration
-        profile_info = self.STYLE_PROFILES[self.style_profile]
-        self._log_info(f"Using style profile: {profile_info['name']} - {profile_info['description']}")
-        self._log_info(f"Output format: {self.output_format.upper()}")
-        self._log_debug(f"Default diagram dimensions: {self.diagram_width}x{self.diagram_height}px")
+    h1 {
+        font-size: 1.8em;
+        margin-top: 1.2em;
+        margin-bottom: 0.6em;
+        page-break-after: avoid;
+    }
     
-    def _log_debug(self, message: str) -> None:
-        """Log debug message with color (only if debug mode is enabled)."""
-        if self.debug:
-            with self._lock:
-                print(f"{Fore.CYAN}[DEBUG]{Style.RESET_ALL} {message}")
-    
-    def _log_info(self, message: str) -> None:
-        """Log info message with color."""
-        with self._lock:
-            print(f"{Fore.GREEN}[INFO]{Style.RESET_ALL} {message}")
+    h2 {
+        font-size: 1.5em;
+        margin-top: 1em;
+        margin-bottom: 0.5em;
+        page-break-after: avoid;
+    }
     
-    def _log_warning(self, message: str) -> None:
-        """Log warning message with color."""
-        with self._lock:
-            print(f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} {message}")
+    h3 {
+        font-size: 1.3em;
+        margin-top: 0.8em;
+        margin-bottom: 0.4em;
+        page-break-after: avoid;
+    }
     
-    def _log_error(self, message: str) -> None:
-        """Log error message with color."""
-        with self._lock:
-            print(f"{Fore.RED}[ERROR]{Style.RESET_ALL} {message}")
+    h4 {
+        font-size: 1.2em;
+        margin-top: 0.7em;
+        margin-bottom: 0.3em;
+        page-break-after: avoid;
+    }
     
-    def _log_success(self, message: str) -> None:
-        """Log success message with color."""
-        with self._lock:
-            print(f"{Fore.GREEN}[OK]{Style.RESET_ALL} {message}")
+    h5 {
+        font-size: 1.1em;
+        margin-top: 0.6em;
+        margin-bottom: 0.3em;
+        page-break-after: avoid;
+    }
     
-    async def _launch_browser(self) -> None:
-        """Launch a fresh Chromium browser instance."""
-        tls = self._local
-        if not hasattr(tls, 'playwright') or tls.playwright is None:
-            tls.playwright = await async_playwright().start()
-        tls.browser = await tls.playwright.chromium.launch(
-            headless=True,
-            args=[
-                '--disable-dev-shm-usage',  # Use /tmp instead of /dev/shm (prevents OOM crashes)
-                '--disable-gpu',             # No GPU in headless mode
-                '--no-sandbox',              # Required in some environments
-            ]
-        )
+    h6 {
+        font-size: 1.05em;
+        margin-top: 0.5em;
+        margin-bottom: 0.3em;
+        page-break-after: avoid;
+    }
     
-    async def _ensure_browser(self, device_scale_factor: int = 1) -> None:
-        """Ensure browser instance is initialized and ready. Reuses existing browser if available."""
-        tls = self._local
-        
-        if not hasattr(tls, 'browser') or tls.browser is None or not tls.browser.is_connected():
-            self._log_debug("Initializing browser instance")
-            await self._launch_browser()
-        
-        # Create a new page, restarting the browser if it turns out to be dead
-        if hasattr(tls, 'page') and tls.page and not tls.page.is_closed():
-            try:
-                await tls.page.close()
-            except Exception:
-                pass
-        try:
-            tls.page = await tls.browser.new_page(device_scale_factor=device_scale_factor)
-        except Exception:
-            # Browser reported connected but is actually dead — restart it
-            self._log_warning("Browser connection stale, restarting...")
-            await self._close_browser()
-            await self._launch_browser()
-            tls.page = await tls.browser.new_page(device_scale_factor=device_scale_factor)
+    p {
+        margin: 0.6em 0;
+        text-indent: 0;
+    }
     
-    async def _close_browser(self) -> None:
-        """Close browser and cleanup resources."""
-        tls = self._local
-        
-        # Grab references and null them out first to prevent double-close on crash
-        page = getattr(tls, 'page', None)
-        browser = getattr(tls, 'browser', None)
-        pw = getattr(tls, 'playwright', None)
-        tls.page = None
-        tls.browser = None
-        tls.playwright = None
-        
-        try:
-            if page and not page.is_closed():
-                await page.close()
-        except Exception:
-            pass
-        try:
-            if browser and browser.is_connected():
-                await browser.close()
-        except Exception:
-            pass
-        try:
-            if pw:
-                await pw.stop()
-        except Exception:
-            pass
-        
-        self._log_debug("Browser instance closed and cleaned up")
+    /* Code blocks optimized for e-ink */
+    pre {
+        background-color: #f5f5f5;
+        border: 1px solid #ddd;
+        border-radius: 3px;
+        padding: 0.8em;
+        margin: 1em 0;
+        font-size: 11px;
+        line-height: 1.4;
+        overflow-x: auto;
+        page-break-inside: avoid;
+    }
     
-    def _validate_margin(self, margin_str: str) -> str:
-        """Validate and normalize a single margin value."""
-        import re
-        
-        # Extract numeric value and unit
-        match = re.match(r'^(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*(cm|in|mm|pt|px)?$', margin_str.strip())
-        if not match:
-            raise ValueError(f"Invalid margin format: '{margin_str}'. Use format like '1in', '2.5cm', '10mm', etc.")
-        
-        value_str, unit = match.groups()
-        value = float(value_str)
-        
-        # Set default unit to 'in' if not specified
-        if not unit:
-            unit = 'in'
-        
-        # Convert to inches for validation
-        if unit == 'cm':
-            value_inches = value / 2.54
-        elif unit == 'mm':
-            value_inches = value / 25.4
-        elif unit == 'pt':
-            value_inches = value / 72
-        elif unit == 'px':
-            value_inches = value / 96  # Assuming 96 DPI
-        else:  # 'in'
-            value_inches = value
-        
-        # Validate range: minimum 0 inches, maximum 3 inches
-        if value_inches < 0:
-            raise ValueError(f"Margin cannot be negative: '{margin_str}'. Minimum value is 0.")
-        elif value_inches > 3:
-            raise ValueError(f"Margin too large: '{margin_str}'. Maximum value is 3 inches (7.62cm).")
-        
-        return f"{value}{unit}"
+    code {
+        background-color: #f5f5f5;
+        border: 1px solid #ddd;
+        border-radius: 2px;
+        padding: 0.2em 0.4em;
+        font-size: 11px;
+        font-family: "Courier New", "Monaco", monospace;
+    }
     
-    def _parse_margins(self) -> Dict[str, str]:
-        """Parse margin string into individual margin values."""
-        margin_parts = self.page_margins.split()
-        
-        if len(margin_parts) == 1:
-            # All margins same
-            margin = self._validate_margin(margin_parts[0])
-            return {'top': margin, 'right': margin, 'bottom': margin, 'left': margin}
-        elif len(margin_parts) == 2:
-            # Vertical and horizontal
-            vertical = self._validate_margin(margin_parts[0])
-            horizontal = self._validate_margin(margin_parts[1])
-            return {'top': vertical, 'right': horizontal, 'bottom': vertical, 'left': horizontal}
-        elif len(margin_parts) == 4:
-            # Top, right, bottom, left
-            return {
-                'top': self._validate_margin(margin_parts[0]),
-                'right': self._validate_margin(margin_parts[1]),
-                'bottom': self._validate_margin(margin_parts[2]),
-                'left': self._validate_margin(margin_parts[3])
-            }
-        else:
-            raise ValueError(f"Invalid margin format: '{self.page_margins}'. Use 1, 2, or 4 values.")
+    /* Tables optimized for 6.8" screen */
+    table {
+        width: 100%;
+        border-collapse: collapse;
+        margin: 1em 0;
+        font-size: 12px;
+        page-break-inside: avoid;
+    }
     
-    def _convert_margin_to_cm(self, margin_str: str) -> float:
-        """Convert margin string to centimeters for Puppeteer."""
-        import re
-        
-        match = re.match(r'^(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*(cm|in|mm|pt|px)?$', margin_str.strip())
-        if not match:
-            return 2.54  # default 1 inch in cm
-        
-        value_str, unit = match.groups()
-        value = float(value_str)
-        
-        if not unit:
-            unit = 'in'
-        
-        # Convert to cm
-        if unit == 'cm':
-            return value
-        elif unit == 'in':
-            return value * 2.54
-        elif unit == 'mm':
-            return value / 10
-        elif unit == 'pt':
-            return value * 0.0352778
-        elif unit == 'px':
-            return value * 0.0264583
-        else:
-            return value * 2.54
+    th, td {
+        border: 1px solid #ddd;
+        padding: 0.4em 0.6em;
+        text-align: left;
+        vertical-align: top;
+    }
     
-    def _get_viewport_dimensions(self) -> tuple[int, int]:
-        """Get viewport dimensions for diagram rendering (always integers).
-        
-        The viewport is set larger than the target output dimensions so diagrams
-        render at their natural size with full detail.  The final image size is
-        then determined by _fit_diagram_to_page and scale annotations.
-        
-        Returns:
-            Tuple of (width, height) in pixels for viewport size
-        """
-        default_width = 3360
-        default_height = 4480
-        
-        if isinstance(self.diagram_width, int):
-            width = self.diagram_width * 2
-        else:
-            width = default_width
-            
-        if isinstance(self.diagram_height, int):
-            height = self.diagram_height * 2
-        else:
-            height = default_height
-            
-        return width, height
+    th {
+        background-color: #f8f8f8;
+        font-weight: bold;
+    }
     
-    def _get_page_width_px(self) -> int:
-        """Get the target page content width in pixels for diagram sizing."""
-        if isinstance(self.diagram_width, int):
-            return self.diagram_width
-        return 1680
+    /* Images optimized for 300ppi */
+    img {
+        max-width: 100%;
+        height: auto;
+        display: block;
+        margin: 1em auto;
+        page-break-inside: avoid;
+    }
     
-    def _get_page_content_height_px(self) -> int:
-        """Get the A4 content area height in pixels, in the same coordinate
-        system as _get_page_width_px().  Accounts for configured margins."""
-        margins = self._parse_margins()
-        top_cm = self._convert_margin_to_cm(margins['top'])
-        bottom_cm = self._convert_margin_to_cm(margins['bottom'])
-        left_cm = self._convert_margin_to_cm(margins['left'])
-        right_cm = self._convert_margin_to_cm(margins['right'])
-        content_width_cm = 21.0 - left_cm - right_cm
-        content_height_cm = 29.7 - top_cm - bottom_cm
-        page_width_px = self._get_page_width_px()
-        return int(page_width_px * content_height_cm / content_width_cm)
+    /* Lists with better spacing */
+    ul, ol {
+        margin: 0.8em 0;
+        padding-left: 1.5em;
+    }
     
-    def _fit_diagram_to_page(self, image_path: Path, scale_percent: float = 100.0, dpi_scale: int = 1) -> bool:
-        """Resize a diagram image to fit within a single A4 page.
-        
-        The image is scaled so that its width equals page_width * scale_percent / 100.
-        If the resulting height exceeds the A4 content area, the image is scaled down
-        further so the height fits — the more constraining dimension wins.
-        
-        The CSS max-height in the HTML template provides the visual constraint at
-        render time; the PNG-level cap here keeps file sizes reasonable so Chromium's
-        PDF renderer can handle the embedded base64 images.
-        
-        Args:
-            image_path: Path to the rendered diagram PNG
-            scale_percent: Target width as percentage of page width (100 = full width)
-            dpi_scale: DPI multiplier for high-resolution rendering (2 = Retina/2x)
-            
-        Returns:
-            True if successful
-        """
+    li {
+        margin: 0.3em 0;
+        line-height: 1.5;
+    }
+    
+    /* Blockquotes */
+    blockquote {
+        border-left: 3px solid #ccc;
+        margin: 1em 0;
+        padding: 0.5em 1em;
+        background-color: #f9f9f9;
+        font-style: italic;
+    }
+    
+    /* Links */
+    a {
+        color: #0066cc;
+        text-decoration: none;
+    }
+    
+    a:visited {
+        color: #663399;
+    }
+    
+    /* Page breaks */
+    .page-break {
+        page-break-before: always;
+    }
+    
+    /* Avoid widows and orphans */
+    p, li {
+        orphans: 2;
+        widows: 2;
+    }
+    
+    /* Chapter breaks */
+    h1, h2 {
+        page-break-before: auto;
+    }
+    
+    /* Ensure headings don't break across pages */
+    h1, h2, h3, h4, h5, h6 {
+        page-break-after: avoid;
+        page-break-inside: avoid;
+    }
+}
+
+/* Fallback styles for other devices */
+h1, h2, h3, h4, h5, h6 {
+    color: #000000;
+    font-weight: bold;
+    page-break-after: avoid;
+}
+
+h1 { font-size: 1.6em; margin: 1em 0 0.5em 0; }
+h2 { font-size: 1.4em; margin: 0.8em 0 0.4em 0; }
+h3 { font-size: 1.2em; margin: 0.7em 0 0.3em 0; }
+h4 { font-size: 1.1em; margin: 0.6em 0 0.3em 0; text-decoration: underline; }
+h5 { font-size: 1.05em; margin: 0.5em 0 0.3em 0; text-decoration: underline; }
+h6 { font-size: 1em; margin: 0.5em 0 0.3em 0; text-decoration: underline; }
+
+p { margin: 0.5em 0; }
+pre { background-color: #f5f5f5; padding: 0.5em; margin: 0.5em 0; }
+code { background-color: #f5f5f5; padding: 0.1em 0.3em; }
+table { border-collapse: collapse; width: 100%; margin: 0.5em 0; }
+th, td { border: 1px solid #ddd; padding: 0.3em; }
+th { background-color: #f8f8f8; }
+img { max-width: 100%; height: auto; display: block; margin: 0.5em auto; }
+ul, ol { margin: 0.5em 0; padding-left: 1.5em; }
+li { margin: 0.2em 0; }
+blockquote { border-left: 3px solid #ccc; margin: 0.5em 0; padding: 0.3em 0.8em; background-color: #f9f9f9; }
+a { color: #0066cc; text-decoration: none; }
+"""
+
+
+def _minify_css(css: str) -> str:
+    """Strip comments and redundant whitespace from a stylesheet."""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+# Packaged into every EPUB/MOBI, so it is shipped minified (~40% smaller than the source above)
+_PAPERWHITE_CSS_MIN = _minify_css(_PAPERWHITE_CSS)
+
+
+# --- Module-level worker infrastructure for ProcessPoolExecutor ---
+_ebook_worker_converter = None
+# Seconds a worker waits for its browser to close while exiting
+_WORKER_SHUTDOWN_TIMEOUT = 10
+
+
+def _init_ebook_worker_process(converter_kwargs: dict) -> None:
+    """Initializer called once per worker process. Creates a process-local converter."""
+    global _ebook_worker_converter
+    _ebook_worker_converter = MarkdownToEbookConverter(**converter_kwargs)
+    _ebook_worker_converter.state_manager.load_all()
+    # The browser stays up across files; close it when the pool shuts the worker down
+    # (multiprocessing exits workers without running atexit handlers, but runs these finalizers)
+    multiprocessing.util.Finalize(None, _shutdown_ebook_worker_process, exitpriority=10)
+
+
+def _shutdown_ebook_worker_process() -> None:
+    """Finalizer run as a worker process exits. Closes the process-local browser.
+    
+    The wait is bounded: a hung Chromium must not keep the worker (and with it pool shutdown)
+    alive. On timeout the event loop is stopped and the process exits without a clean close.
+    """
+    if _ebook_worker_converter is not None:
         try:
-            target_width = int(self._get_page_width_px() * scale_percent / 100.0 * dpi_scale)
-            max_height = int(self._get_page_content_height_px() * dpi_scale)
-            
-            with Image.open(image_path) as img:
-                if img.mode not in ('RGB', 'RGBA'):
-                    if img.mode in ('P', 'PA', 'LA') and 'transparency' in img.info:
-                        img = img.convert('RGBA')
-                    else:
-                        img = img.convert('RGB')
-                
-                orig_width, orig_height = img.size
-                
-                width_scale = target_width / orig_width
-                height_after_width_fit = int(orig_height * width_scale)
-                
-                if height_after_width_fit <= max_height:
-                    scale_factor = width_scale
-                    new_width = target_width
-                    new_height = height_after_width_fit
-                    constraint = f"{scale_percent}% of page width"
-                else:
-                    scale_factor = max_height / orig_height
-                    new_width = int(orig_width * scale_factor)
-                    new_height = max_height
-                    constraint = "capped to page height"
-                
-                if orig_width == new_width and orig_height == new_height:
-                    self._log_debug(f"Diagram already at target size {new_width}x{new_height}px")
-                    return True
-                
-                is_upscaling = scale_factor > 1.0
-                resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                
-                if is_upscaling:
-                    sharpened = resized.filter(ImageFilter.UnsharpMask(radius=1.0, percent=200, threshold=2))
-                else:
-                    sharpened = resized.filter(ImageFilter.UnsharpMask(radius=0.5, percent=150, threshold=3))
-                
-                if image_path.suffix.lower() in ['.png']:
-                    sharpened.save(image_path, format='PNG', compress_level=6, optimize=False)
-                elif image_path.suffix.lower() in ['.jpg', '.jpeg']:
-                    sharpened.save(image_path, format='JPEG', quality=100, subsampling=0, optimize=False)
-                else:
-                    sharpened.save(image_path, optimize=False)
-                
-                direction = "upscaled" if is_upscaling else "downscaled"
-                self._log_debug(f"Fit diagram to page: {orig_width}x{orig_height} -> {new_width}x{new_height} ({direction}, {constraint})")
-            
-            return True
-        except Exception as e:
-            self._log_warning(f"Failed to fit diagram to page: {e}")
-            return False
+            _ebook_worker_converter._run_async(_ebook_worker_converter._close_browser(), timeout=_WORKER_SHUTDOWN_TIMEOUT)
+        except FutureTimeoutError:
+            _ebook_worker_converter._log_warning(f"Browser did not close within {_WORKER_SHUTDOWN_TIMEOUT}s; abandoning it")
+            _ebook_worker_converter._loop.call_soon_threadsafe(_ebook_worker_converter._loop.stop)
+
+
+def _ebook_worker_convert_file(md_file: Path, md_hash: Optional[str] = None) -> tuple:
+    """Top-level function executed in worker process. Converts a single file."""
+    return _ebook_worker_converter._convert_single_file(md_file, md_hash)
+
+
+# Initialize colorama for cross-platform colored output
+init(autoreset=True)
+
+
+class MarkdownToEbookConverter:
+    """Markdown to Ebook converter supporting PDF, EPUB, and MOBI formats."""
     
-    def _parse_dimension_value(self, value, original_size: int) -> Optional[int]:
-        """Parse dimension value that can be max pixels (int) or percentage (str).
+    # Style profiles configuration
+    STYLE_PROFILES = {
+        "a4-print": {
+            "name": "A4 Print (Default)",
+            "description": "Standard print-optimized styling with 12px base font",
+            "font_scale": 1.0,
+            "base_font_size": "12px",
+            "formats": ["pdf"]
+        },
+        "a4-screen": {
+            "name": "A4 Screen (Large)",
+            "description": "Screen-optimized styling with 30% larger fonts for better readability",
+            "font_scale": 1.3,
+            "base_font_size": "15.6px",
+            "formats": ["pdf"]
+        },
+        "kindle-basic": {
+            "name": "Kindle Basic",
+            "description": "Basic Kindle formatting optimized for e-ink displays",
+            "font_scale": 1.0,
+            "base_font_size": "12px",
+            "formats": ["epub", "mobi"]
+        },
+        "kindle-large": {
+            "name": "Kindle Large Text",
+            "description": "Large text for better readability on Kindle devices",
+            "font_scale": 1.2,
+            "base_font_size": "14px",
+            "formats": ["epub", "mobi"]
+        },
+        "kindle-paperwhite-11": {
+            "name": "Kindle Paperwhite 11th Gen",
+            "description": "Optimized for Kindle Paperwhite 11th generation (6.8\" 300ppi display)",
+            "font_scale": 1.1,
+            "base_font_size": "13px",
+            "formats": ["epub", "mobi"]
+        }
+    }
+    
+    def __init__(self, source_dir: str, output_dir: str, temp_dir: str, 
+                 output_format: str = "pdf", page_margins: str = "1in 0.75in", 
+                 debug: bool = False, db_path: Optional[str] = None, 
+                 style_profile: str = "a4-print", max_workers: int = 4,
+                 author: str = "Unknown Author", language: str = "en",
+                 max_diagram_width = 1680, max_diagram_height = 2240, 
+                 force_regenerate: bool = False, show_inner_progress: bool = True,
+                 both_mobi_formats: bool = False):
+        """Initialize the converter.
         
         Args:
-            value: int for max pixels (only resize if original exceeds), 
-                   str like "80%" for percentage of original (always applied, max 100%)
-            original_size: Original dimension in pixels (for percentage calculation)
-            
-        Returns:
-            Target dimension in pixels, or None if no resizing needed
+            max_diagram_width: Max width in pixels (int, only resize if rendered exceeds) or percentage of rendered size (str like "80%")
+            max_diagram_height: Max height in pixels (int, only resize if rendered exceeds) or percentage of rendered size (str like "80%")
+            force_regenerate: If True, bypass verification and regenerate all files
+            show_inner_progress: If False, hide the per-file step and per-diagram progress bars
+            both_mobi_formats: If True, build MOBI files with both the legacy MOBI 6 and KF8 sections
         """
-        if value is None:
-            return None
-            
-        # If it's already an int (max pixels constraint)
-        if isinstance(value, int):
-            # Only resize if original exceeds the max
-            if original_size > value:
-                return value
-            else:
-                return None  # Keep original size
-            
-        # If it's a string, check for percentage
-        if isinstance(value, str):
-            value_stripped = value.strip()
-            if value_stripped.endswith('%'):
-                try:
-                    percent = float(value_stripped[:-1])
-                    if percent > 0:
-                        # Always apply percentage (supports both downsizing and upscaling)
-                        return int(original_size * percent / 100.0)
-                except ValueError:
-                    pass
-            else:
-                # Try parsing as int string
-                try:
-                    parsed_int = int(value_stripped)
-                    # Only resize if original exceeds the max
-                    if original_size > parsed_int:
-                        return parsed_int
-                    else:
-                        return None  # Keep original size
-                except ValueError:
-                    pass
+        self.source_dir = Path(source_dir)
+        self.output_dir = Path(output_dir)
+        self.temp_dir = Path(temp_dir)
+        self.output_format = output_format.lower()
+        self.page_margins = page_margins
+        self.debug = debug
+        self.style_profile = style_profile
+        self.max_workers = max_workers
+        self.author = author
+        self.language = language
+        self.diagram_width = max_diagram_width
+        self.diagram_height = max_diagram_height
+        self.force_regenerate = force_regenerate
+        self.show_inner_progress = show_inner_progress
+        self.both_mobi_formats = both_mobi_formats
+        self._lock = threading.Lock()  # For logging in sequential mode
         
-        return None
+        # Browser state (process-isolated; each worker process gets its own converter)
+        self._local = type('BrowserState', (), {})()
+        
+        # All Playwright coroutines run on one persistent event loop owned by a daemon thread;
+        # callers submit work with _run_async() and block only on the result
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._run_event_loop, name="playwright-loop", daemon=True)
+        self._loop_thread.start()
+        
+        # Performance optimization: reuse PlantUML client for connection pooling
+        # Get PlantUML server URL from config (supports local or external server)
+        from .config import Config
+        config = Config()
+        self._plantuml_server = config.get_plantuml_server()
+        self._plantuml_client = plantuml.PlantUML(url=self._plantuml_server)
+        self._log_debug(f"Using PlantUML server: {self._plantuml_server}")
+        
+        # Optional resident `pandoc server`; when unset or unreachable, pandoc runs as a subprocess
+        self._pandoc_server = config.get_pandoc_server()
+        if self._pandoc_server:
+            self._log_debug(f"Using pandoc server: {self._pandoc_server}")
+        
+        # Optional in-process Calibre (MOBI): imported lazily on first use from calibre_lib_dir;
+        # None = not tried yet, False = unavailable (use the ebook-convert subprocess)
+        self._calibre_lib_dir = config.get_calibre_lib_dir()
+        self._calibre_api = None
+        
+        # EPUB backend: "ebooklib" zips the book in-process from pandoc's HTML; pandoc stays the
+        # fallback when ebooklib is not installed or assembly fails
+        self._epub_backend = config.get_epub_backend()
+        # Only probed here; ebooklib (and lxml) are imported on first use, not on every run
+        if self._epub_backend == "ebooklib" and importlib.util.find_spec("ebooklib") is None:
+            self._log_warning("epub_backend is 'ebooklib' but the ebooklib package is not installed; using pandoc")
+            self._epub_backend = "pandoc"
+        
+        # Mermaid renderer: the native mmdr binary skips Chromium entirely when available;
+        # Playwright stays the fallback for "auto" and for any diagram mmdr fails on
+        self._mermaid_renderer = config.get_mermaid_renderer()
+        self._mmdr_path = shutil.which("mmdr") if self._mermaid_renderer in ("auto", "mmdr") else None
+        if self._mermaid_renderer == "mmdr" and self._mmdr_path is None:
+            self._log_warning("mermaid_renderer is 'mmdr' but the mmdr binary was not found on PATH; falling back to Playwright")
+        self._log_debug(f"Mermaid renderer: {'mmdr (' + self._mmdr_path + ')' if self._mmdr_path else 'playwright'}")
+        
+        # Identifies what renders each diagram kind, for the diagram cache key; the mmdr binary's
+        # mtime stands in for its version (an upgrade replaces the file) without running it
+        mermaid_renderer_id = _PLAYWRIGHT_RENDERER_ID
+        if self._mmdr_path:
+            try:
+                mermaid_renderer_id = ("mmdr", self._mmdr_path, os.stat(self._mmdr_path).st_mtime_ns)
+            except OSError:
+                mermaid_renderer_id = ("mmdr", self._mmdr_path)
+        self._diagram_renderer_ids = {"mermaid": mermaid_renderer_id, "plantuml": (self._plantuml_server,)}
+        
+        # Create format-specific output directory
+        self.format_output_dir = self.output_dir / self.output_format
+        
+        # Validate output format
+        valid_formats = ["pdf", "epub", "mobi"]
+        if self.output_format not in valid_formats:
+            raise ValueError(f"Invalid output format '{self.output_format}'. Valid formats: {valid_formats}")
+        
+        # Validate style profile
+        if style_profile not in self.STYLE_PROFILES:
+            available_profiles = ", ".join(self.STYLE_PROFILES.keys())
+            raise ValueError(f"Invalid style profile '{style_profile}'. Available profiles: {available_profiles}")
+        
+        # Check if style profile supports the output format
+        profile = self.STYLE_PROFILES[self.style_profile]
+        if self.output_format not in profile["formats"]:
+            supported_formats = ", ".join(profile["formats"])
+            raise ValueError(f"Style profile '{style_profile}' does not support format '{self.output_format}'. Supported formats: {supported_formats}")
+        
+        # Initialize document state manager with configurable db_path
+        if db_path is None:
+            config = Config()
+            db_path = config.get_db_path()
+        self.state_manager = DocumentStateManager(db_path)
+        
+        # Create directories
+        self.output_dir.mkdir(exist_ok=True)
+        self.format_output_dir.mkdir(exist_ok=True)
+        self.temp_dir.mkdir(exist_ok=True)
+        
+        # Log configuration
+        profile_info = self.STYLE_PROFILES[self.style_profile]
+        self._log_info(f"Using style profile: {profile_info['name']} - {profile_info['description']}")
+        
+        # Profile-dependent CSS is identical for every document, so format it only once
+        self._css_template = self._build_css_template()
+        self._page_css_cache: Dict[tuple, str] = {}
+        self._paperwhite_css_path: Optional[Path] = None
+        
+        # Pandoc EPUB options shared by every file; only input, output and title vary per call.
+        # No --self-contained: the EPUB container already packages every referenced image, so
+        # base64-inlining them into the XHTML only costs memory and time
+        self._pandoc_epub_args = [
+            "--standalone",
+            f"--metadata=author:{self.author}",
+            f"--metadata=language:{self.language}",
+            "--toc",
+            "--toc-depth=3",
+        ]
+        self._log_info(f"Output format: {self.output_format.upper()}")
+        self._log_debug(f"Default diagram dimensions: {self.diagram_width}x{self.diagram_height}px")
     
-    def _resize_image(self, image_path: Path, max_width = None, max_height = None) -> bool:
-        """Resize image while maintaining aspect ratio.
+    def _log_debug(self, message: str) -> None:
+        """Log debug message with color (only if debug mode is enabled)."""
+        if self.debug:
+            with self._lock:
+                print(f"{Fore.CYAN}[DEBUG]{Style.RESET_ALL} {message}")
+    
+    def _log_info(self, message: str) -> None:
+        """Log info message with color."""
+        with self._lock:
+            print(f"{Fore.GREEN}[INFO]{Style.RESET_ALL} {message}")
+    
+    def _log_warning(self, message: str) -> None:
+        """Log warning message with color."""
+        with self._lock:
+            print(f"{Fore.YELLOW}[WARNING]{Style.RESET_ALL} {message}")
+    
+    def _log_error(self, message: str) -> None:
+        """Log error message with color."""
+        with self._lock:
+            print(f"{Fore.RED}[ERROR]{Style.RESET_ALL} {message}")
+    
+    def _log_success(self, message: str) -> None:
+        """Log success message with color."""
+        with self._lock:
+            print(f"{Fore.GREEN}[OK]{Style.RESET_ALL} {message}")
+    
+    def _run_event_loop(self) -> None:
+        """Run the converter's event loop forever (target of the loop thread)."""
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+    
+    def _run_async(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the event-loop thread and wait for its result.
         
-        Args:
-            image_path: Path to the image file
-            max_width: Maximum width - int (pixels), str ("80%"), or None (uses self.diagram_width)
-            max_height: Maximum height - int (pixels), str ("80%"), or None (uses self.diagram_height)
-            
-        Returns:
-            True if resize was successful, False otherwise
+        Raises concurrent.futures.TimeoutError if timeout (seconds) elapses first.
         """
-        try:
-            if max_width is None:
-                max_width = self.diagram_width
-            if max_height is None:
-                max_height = self.diagram_height
-            
-            # Open the image
-            with Image.open(image_path) as img:
-                # Convert image to RGB/RGBA mode if needed (fixes "wrong mode" errors)
-                # Some diagram renderers produce images in palette mode (P) or other modes
-                # that don't support all PIL operations like UnsharpMask filter
-                original_mode = img.mode
-                mode_converted = False
-                if img.mode not in ('RGB', 'RGBA'):
-                    # Preserve transparency if present
-                    if img.mode in ('P', 'PA', 'LA') and 'transparency' in img.info:
-                        img = img.convert('RGBA')
-                    else:
-                        img = img.convert('RGB')
-                    mode_converted = True
-                    self._log_debug(f"Converted image from mode {original_mode} to {img.mode} for processing")
-                
-                # Get original dimensions
-                orig_width, orig_height = img.size
-                
-                self._log_debug(f"Checking resize for {image_path.name}: original={orig_width}x{orig_height}, max={max_width}x{max_height}")
-                
-                # Parse dimensions (resolve percentages based on original size)
-                target_width = self._parse_dimension_value(max_width, orig_width)
-                target_height = self._parse_dimension_value(max_height, orig_height)
-                
-                self._log_debug(f"Parsed target dimensions: width={target_width}, height={target_height}")
-                
-                # If no valid dimensions, check if we need to save mode conversion
-                if target_width is None and target_height is None:
-                    if mode_converted:
-                        # Save the mode-converted image even though no resize is needed
-                        if image_path.suffix.lower() in ['.png']:
-                            img.save(image_path, format='PNG', compress_level=6, optimize=False)
-                        elif image_path.suffix.lower() in ['.jpg', '.jpeg']:
-                            img.save(image_path, format='JPEG', quality=100, subsampling=0, optimize=False)
-                        else:
-                            img.save(image_path, optimize=False)
-                        self._log_debug(f"Saved mode-converted image (no resize needed)")
-                    else:
-                        self._log_debug(f"Image {orig_width}x{orig_height} is within max constraints {max_width}x{max_height}, no resize needed")
-                    return True
-                
-                # Calculate scaling factor to fit within target dimensions while maintaining aspect ratio
-                if target_width is not None and target_height is not None:
-                    width_ratio = target_width / orig_width
-                    height_ratio = target_height / orig_height
-                    scale_factor = min(width_ratio, height_ratio)
-                elif target_width is not None:
-                    scale_factor = target_width / orig_width
-                else:  # target_height is not None
-                    scale_factor = target_height / orig_height
-                
-                # Only resize if scale factor differs from 1.0
-                if scale_factor != 1.0:
-                    new_width = int(orig_width * scale_factor)
-                    new_height = int(orig_height * scale_factor)
-                    
-                    is_upscaling = scale_factor > 1.0
-                    
-                    # Resize using high-quality Lanczos resampling (best for both up and downscaling)
-                    resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    
-                    # Apply sharpening optimized for the scaling direction
-                    if is_upscaling:
-                        # For upscaling: Use stronger sharpening to enhance details and reduce softness
-                        # radius: larger for upscaling to cover more area
-                        # percent: higher to enhance edges more aggressively
-                        # threshold: lower to sharpen more details
-                        sharpened = resized_img.filter(ImageFilter.UnsharpMask(radius=1.0, percent=200, threshold=2))
-                    else:
-                        # For downscaling: Use moderate sharpening to compensate for resize blur
-                        sharpened = resized_img.filter(ImageFilter.UnsharpMask(radius=0.5, percent=150, threshold=3))
-                    
-                    # Save with maximum quality settings
-                    # For PNG: compress_level 0-9 (higher = smaller file but still lossless)
-                    # For JPEG: quality 95-100 (near-lossless)
-                    if image_path.suffix.lower() in ['.png']:
-                        sharpened.save(image_path, format='PNG', compress_level=6, optimize=False)
-                    elif image_path.suffix.lower() in ['.jpg', '.jpeg']:
-                        sharpened.save(image_path, format='JPEG', quality=100, subsampling=0, optimize=False)
-                    else:
-                        sharpened.save(image_path, optimize=False)
-                    
-                    scale_direction = "upscaled" if is_upscaling else "downscaled"
-                    self._log_debug(f"Resized image from {orig_width}x{orig_height} to {new_width}x{new_height} ({scale_direction} with optimized sharpening)")
-                else:
-                    self._log_debug(f"Image {orig_width}x{orig_height} already within target bounds, no resize needed")
-            
-            return True
-            
-        except Exception as e:
-            self._log_error(f"Failed to resize image {image_path}: {e}")
-            return False
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+    
+    async def _launch_browser(self) -> None:
+        """Launch a fresh Chromium browser instance."""
+        tls = self._local
+        if not hasattr(tls, 'playwright') or tls.playwright is None:
+            tls.playwright = await async_playwright().start()
+        tls.browser = await tls.playwright.chromium.launch(
+            headless=True,
+            args=[
+                '--disable-dev-shm-usage',  # Use /tmp instead of /dev/shm (prevents OOM crashes)
+                '--disable-gpu',             # No GPU in headless mode
+                '--no-sandbox',              # Required in some environments
+            ]
+        )
     
-    async def _render_mermaid_diagram(self, mermaid_code: str, output_path: Path) -> tuple[bool, str]:
-        """Render Mermaid diagram to image using Playwright."""
+    async def _ensure_browser(self, device_scale_factor: int = 1) -> None:
+        """Ensure browser instance is initialized and ready. Reuses existing browser if available."""
+        tls = self._local
+        
+        if not hasattr(tls, 'browser') or tls.browser is None or not tls.browser.is_connected():
+            self._log_debug("Initializing browser instance")
+            await self._launch_browser()
+        
+        # Create a new page, restarting the browser if it turns out to be dead
+        if hasattr(tls, 'page') and tls.page and not tls.page.is_closed():
+            try:
+                await tls.page.close()
+            except Exception:
+                pass
         try:
-            # 2x device scale for high-DPI rasterization of vector SVGs
-            await self._ensure_browser(device_scale_factor=2)
-            page = self._local.page
-            
-            # Set viewport for high-resolution rendering using fixed pixel dimensions
-            viewport_width, viewport_height = self._get_viewport_dimensions()
-            await page.set_viewport_size({"width": viewport_width, "height": viewport_height})
-            await page.emulate_media(media="screen")
-                
-            # Create HTML with Mermaid
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="utf-8">
-                <style>
-                    body {{
-                        margin: 0;
-                        padding: 10px;
-                        background: white;
-                        font-family: Arial, sans-serif;
-                    }}
-                    .mermaid {{
-                        background: white;
-                        display: inline-block;
-                        padding: 5px;
-                    }}
-                    .mermaid svg {{
-                        max-width: none;
-                        height: auto;
-                        display: block;
-                        font-family: Arial, sans-serif;
-                    }}
-                    .mermaid .node rect {{
-                        rx: 3;
-                        ry: 3;
-                    }}
-                    .mermaid .edgePath .path {{
-                        stroke-width: 1.5px;
-                    }}
-                </style>
-            </head>
-            <body>
-                <pre class="mermaid">
-                    {mermaid_code}
-                </pre>
-                <script type="module">
-                    import mermaid from 'https://cdn.jsdelivr.net/npm/mermaid@11/dist/mermaid.esm.min.mjs';
-                    
-                    mermaid.initialize({{
-                        startOnLoad: false,
-                        theme: 'default',
-                        themeVariables: {{
-                            primaryColor: '#ff6b6b',
-                            primaryTextColor: '#333',
-                            primaryBorderColor: '#ff6b6b',
-                            lineColor: '#333',
-                            secondaryColor: '#4ecdc4',
-                            tertiaryColor: '#45b7d1'
-                        }},
-                        flowchart: {{
-                            useMaxWidth: false,
-                            htmlLabels: true,
-                            curve: 'basis'
-                        }},
-                        sequence: {{
-                            useMaxWidth: false,
-                            diagramMarginY: 3,
-                            diagramMarginX: 10,
-                            messageFontSize: 12,
-                            actorFontSize: 12,
-                            actorMargin: 20,
-                            messageMargin: 10
-                        }},
-                        gantt: {{
-                            useMaxWidth: false
-                        }},
-                        class: {{
-                            useMaxWidth: false
-                        }}
-                    }});
-                    await mermaid.run();
-                </script>
-            </body>
-            </html>
-            """
-            
-            await page.set_content(html_content)
-            
-            # Wait for Mermaid to render using dimension stability detection
-            # Wait for Mermaid to render using dimension stability detection
-            max_wait_time = 5000  # 5 seconds max
-            poll_interval = 100  # 100ms polling
-            stability_checks = 3  # Number of consecutive stable checks required
-            elapsed_time = 0
-            
-            # First, wait for SVG to appear
-            svg_found = False
-            while elapsed_time < max_wait_time and not svg_found:
-                svg_element = await page.query_selector('.mermaid svg')
-                if svg_element:
-                    svg_content = await svg_element.inner_html()
-                    if svg_content and len(svg_content.strip()) > 0:
-                        self._log_debug(f"Mermaid SVG detected in {elapsed_time}ms")
-                        svg_found = True
-                        break
-                
-                await page.wait_for_timeout(poll_interval)
-                elapsed_time += poll_interval
-            
-            if not svg_found:
-                self._log_warning(f"Mermaid SVG not found after {max_wait_time}ms")
-            else:
-                # Wait for dimensions to stabilize
-                mermaid_element = await page.query_selector('.mermaid')
-                if mermaid_element:
-                    stable_count = 0
-                    last_box = None
-                    stability_start = elapsed_time
-                    
-                    while elapsed_time < max_wait_time and stable_count < stability_checks:
-                        await page.wait_for_timeout(50)  # Short wait between checks
-                        current_box = await mermaid_element.bounding_box()
-                        
-                        if current_box and last_box:
-                            # Check if dimensions are stable (within 1px tolerance for floating point)
-                            width_stable = abs(current_box['width'] - last_box['width']) < 1
-                            height_stable = abs(current_box['height'] - last_box['height']) < 1
-                            
-                            if width_stable and height_stable:
-                                stable_count += 1
-                            else:
-                                stable_count = 0  # Reset if dimensions changed
-                        
-                        last_box = current_box
-                        elapsed_time += 50
-                    
-                    if stable_count >= stability_checks:
-                        self._log_debug(f"Mermaid diagram layout stabilized in {elapsed_time - stability_start}ms (total: {elapsed_time}ms)")
-                    else:
-                        self._log_warning(f"Mermaid diagram dimensions did not stabilize after {max_wait_time}ms")
-            
-            # Normalize SVGs that use width="100%" (e.g. Mermaid 11 classDiagram)
-            # to explicit pixel dimensions from the viewBox, so the browser
-            # renders them at full fidelity before we scale and rasterize.
-            await page.evaluate("""() => {
-                const svg = document.querySelector('.mermaid svg');
-                if (!svg) return;
-                const vb = svg.getAttribute('viewBox');
-                const w = svg.getAttribute('width');
-                if (vb && (!w || w.includes('%'))) {
-                    const parts = vb.split(/[\\s,]+/);
-                    const natW = parseFloat(parts[2]);
-                    const natH = parseFloat(parts[3]);
-                    if (natW > 0 && natH > 0) {
-                        svg.setAttribute('width', natW);
-                        svg.setAttribute('height', natH);
-                        svg.style.maxWidth = 'none';
-                    }
-                }
-            }""")
-            await page.wait_for_timeout(50)
-            
-            # Scale the SVG up to the target page width BEFORE rasterizing.
-            # SVGs are vector graphics, so this produces a perfectly crisp image
-            # at any resolution — no blurry upscaling of a small raster.
-            target_width = self._get_page_width_px()
-            scaled = await page.evaluate(f"""() => {{
-                const svg = document.querySelector('.mermaid svg');
-                if (!svg) return false;
-                const viewBox = svg.getAttribute('viewBox');
-                if (viewBox) {{
-                    const parts = viewBox.split(/[\\s,]+/);
-                    const natW = parseFloat(parts[2]);
-                    const natH = parseFloat(parts[3]);
-                    if (natW > 0 && natH > 0) {{
-                        const scale = {target_width} / natW;
-                        svg.setAttribute('width', {target_width});
-                        svg.setAttribute('height', Math.ceil(natH * scale));
-                        svg.style.maxWidth = 'none';
-                        return true;
-                    }}
-                }}
-                // Fallback: use current rendered size
-                const rect = svg.getBoundingClientRect();
-                if (rect.width > 0) {{
-                    const scale = {target_width} / rect.width;
-                    svg.setAttribute('width', {target_width});
-                    svg.setAttribute('height', Math.ceil(rect.height * scale));
-                    svg.style.maxWidth = 'none';
-                    return true;
-                }}
-                return false;
-            }}""")
-            if scaled:
-                self._log_debug(f"Scaled SVG to {target_width}px wide before rasterization")
-            
-            # Brief pause for the browser to re-layout at the new SVG size
-            await page.wait_for_timeout(100)
+            tls.page = await tls.browser.new_page(device_scale_factor=device_scale_factor)
+        except Exception:
+            # Browser reported connected but is actually dead — restart it
+            self._log_warning("Browser connection stale, restarting...")
+            await self._close_browser()
+            await self._launch_browser()
+            tls.page = await tls.browser.new_page(device_scale_factor=device_scale_factor)
+    
+    async def _get_pdf_page(self):
+        """Return the persistent page used for PDF printing, launching the browser if needed.
+        
+        Unlike the diagram page, this page is kept open and reused for every document
+        printed while the browser is alive.
+        """
+        tls = self._local
+        
+        if not hasattr(tls, 'browser') or tls.browser is None or not tls.browser.is_connected():
+            self._log_debug("Initializing browser instance")
+            await self._launch_browser()
+            tls.pdf_page = None
+        
+        page = getattr(tls, 'pdf_page', None)
+        if page is None or page.is_closed():
+            page = await tls.browser.new_page()
+            # Give the page a file:// origin so set_content() documents may link
+            # the stylesheet file in the temp dir
+            anchor = (self.temp_dir / "pdf_page.html").absolute()
+            if not anchor.exists():
+                self.temp_dir.mkdir(parents=True, exist_ok=True)
+                anchor.write_text("<!DOCTYPE html><html></html>", encoding='utf-8')
+            await page.goto(anchor.as_uri())
+            tls.pdf_page = page
+        return page
+    
+    async def _close_diagram_page(self) -> None:
+        """Close the diagram rendering page, keeping the browser and PDF page alive for reuse."""
+        tls = self._local
+        page = getattr(tls, 'page', None)
+        tls.page = None
+        try:
+            if page and not page.is_closed():
+                await page.close()
+        except Exception:
+            pass
+    
+    async def _close_browser(self) -> None:
+        """Close browser and cleanup resources."""
+        tls = self._local
+        
+        # Grab references and null them out first to prevent double-close on crash
+        page = getattr(tls, 'page', None)
+        pdf_page = getattr(tls, 'pdf_page', None)
+        browser = getattr(tls, 'browser', None)
+        pw = getattr(tls, 'playwright', None)
+        tls.page = None
+        tls.pdf_page = None
+        tls.browser = None
+        tls.playwright = None
+        
+        for open_page in (page, pdf_page):
+            try:
+                if open_page and not open_page.is_closed():
+                    await open_page.close()
+            except Exception:
+                pass
+        try:
+            if browser and browser.is_connected():
+                await browser.close()
+        except Exception:
+            pass
+        try:
+            if pw:
+                await pw.stop()
+        except Exception:
+            pass
+        
+        self._log_debug("Browser instance closed and cleaned up")
+    
+    def _validate_margin(self, margin_str: str) -> str:
+        """Validate and normalize a single margin value."""
+        import re
+        
+        # Extract numeric value and unit
+        match = re.match(r'^(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\s*(cm|in|mm|pt|px)?$', margin_str.strip())
+        if not match:
+            raise ValueError(f"Invalid margin format: '{margin_str}'. Use format like '1in', '2.5cm', '10mm', etc.")
+        
+        value_str, unit = match.groups()
+        value = float(value_str)
+        
+        # Set default unit to 'in' if not specified
+        if not unit:
+            unit = 'in'
+        
+        # Convert to inches for validation
+        if unit == 'cm':
+            value_inches = value / 2.54
+        elif unit == 'mm':
+            value_inches = value / 25.4
+        elif unit == 'pt':
+            value_inches = value / 72
+        elif unit == 'px':
+            value_inches = value / 96  # Assuming 96 DPI
+        else:  # 'in'
+            value_inches = value
+        
+        # Validate range: minimum 0 inches, maximum 3 inches
+        if value_inches < 0:
+            raise ValueError(f"Margin cannot be negative: '{margin_str}'. Minimum value is 0.")
+        elif value_inches > 3:
+            raise ValueError(f"Margin too large: '{margin_str}'. Maximum value is 3 inches (7.62cm).")
+        
+        return f"{value}{unit}"
+    
+    def _parse_margins(self) -> Dict[str, str]:
+        """Parse margin string into individual margin values."""
+        margin_parts = self.page_margins.split()
+        
+        if len(margin_parts) == 1:
+            # All margins same
+            margin = self._validate_margin(margin_parts[0])
+            return {'top': margin, 'right': margin, 'bottom': margin, 'left': margin}
+        elif len(margin_parts) == 2:
+            # Vertical and horizontal
+            vertical = self._validate_margin(margin_parts[0])
+            horizontal = self._validate_margin(margin_parts[1])
+            return {'top': vertical, 'right': horizontal, 'bottom': vertical, 'left': horizontal}
+        elif len(margin_parts) == 4:
+            # Top, right, bottom, left
+            return {
+                'top': self._validate_margin(margin_parts[0]),
+                'right': self._validate_margin(margin_parts[1]),
+                'bottom': self._validate_margin(margin_parts[2]),
+                'left': self._validate_margin(margin_parts[3])
+            }
+        else:
+            raise ValueError(f"Invalid margin format: '{self.page_margins}'. Use 1, 2, or 4 values.")
+    
+    def _margins_cm(self, margins: Dict[str, str]) -> tuple[float, float, float, float]:
+        """Return (top, right, bottom, left) margins in centimeters (memoized per margin set)."""
+        return _margins_to_cm((margins['top'], margins['right'], margins['bottom'], margins['left']))
+    
+    def _get_viewport_dimensions(self) -> tuple[int, int]:
+        """Get viewport dimensions for diagram rendering (always integers).
+        
+        The viewport is set larger than the target output dimensions so diagrams
+        render at their natural size with full detail.  The final image size is
+        then determined by _fit_diagram_to_page and scale annotations.
+        
+        Returns:
+            Tuple of (width, height) in pixels for viewport size
+        """
+        default_width = 3360
+        default_height = 4480
+        
+        if isinstance(self.diagram_width, int):
+            width = self.diagram_width * 2
+        else:
+            width = default_width
             
-            # Take screenshot of the scaled element
-            mermaid_element = await page.query_selector('.mermaid')
-            if mermaid_element:
-                bounding_box = await mermaid_element.bounding_box()
-                if bounding_box:
-                    await mermaid_element.screenshot(
-                        path=str(output_path), 
-                        type='png',
-                        scale='device'
-                    )
-                else:
-                    await page.screenshot(
-                        path=str(output_path), 
-                        type='png', 
-                        full_page=True,
-                        scale='device'
-                    )
-            else:
-                await page.screenshot(
-                    path=str(output_path), 
-                    type='png', 
-                    full_page=True,
-                    scale='device'
-                )
+        if isinstance(self.diagram_height, int):
+            height = self.diagram_height * 2
+        else:
+            height = default_height
             
-            return True, ""
-                
-        except Exception as e:
-            error_msg = f"Failed to render Mermaid diagram: {e}"
-            self._log_error(error_msg)
-            return False, error_msg
+        return width, height
+    
+    def _get_page_width_px(self) -> int:
+        """Get the target page content width in pixels for diagram sizing."""
+        if isinstance(self.diagram_width, int):
+            return self.diagram_width
+        return 1680
+    
+    def _get_page_content_height_px(self) -> int:
+        """Get the A4 content area height in pixels, in the same coordinate
+        system as _get_page_width_px().  Accounts for configured margins."""
+        top_cm, right_cm, bottom_cm, left_cm = self._margins_cm(self._parse_margins())
+        content_width_cm = 21.0 - left_cm - right_cm
+        content_height_cm = 29.7 - top_cm - bottom_cm
+        page_width_px = self._get_page_width_px()
+        return int(page_width_px * content_height_cm / content_width_cm)
     
-    def _render_plantuml_diagram(self, plantuml_code: str, output_path: Path, max_retries: int = 3) -> tuple[bool, str]:
-        """Render PlantUML diagram to image using the plantuml library.
+    def _fit_diagram_to_page(self, image_path: Path, scale_percent: float = 100.0, dpi_scale: int = 1) -> bool:
+        """Resize a diagram image to fit within a single A4 page.
         
-        Retries on transient network errors (SSL, connection, timeout) with exponential backoff.
-        Creates a fresh client on each retry to avoid reusing broken connections.
-        """
-        last_error_msg = ""
-        client = self._plantuml_client
+        The image is scaled so that its width equals page_width * scale_percent / 100.
+        If the resulting height exceeds the A4 content area, the image is scaled down
+        further so the height fits — the more constraining dimension wins.
         
-        for attempt in range(1, max_retries + 1):
-            try:
-                # Render the diagram to PNG and get raw image data
-                image_data = client.processes(plantuml_code)
+        The CSS max-height in the HTML template provides the visual constraint at
+        render time; the PNG-level cap here keeps file sizes reasonable so Chromium's
+        PDF renderer can handle the embedded base64 images.
+        
+        Args:
+            image_path: Path to the rendered diagram PNG
+            scale_percent: Target width as percentage of page width (100 = full width)
+            dpi_scale: DPI multiplier for high-resolution rendering (2 = Retina/2x)
+            
+        Returns:
+            True if successful
+        """
+        try:
+            target_width = int(self._get_page_width_px() * scale_percent / 100.0 * dpi_scale)
+            max_height = int(self._get_page_content_height_px() * dpi_scale)
+            
+            with Image.open(image_path) as img:
+                if img.mode not in ('RGB', 'RGBA'):
+                    if img.mode in ('P', 'PA', 'LA') and 'transparency' in img.info:
+                        img = img.convert('RGBA')
+                    else:
+                        img = img.convert('RGB')
                 
-                # Write the image data to file
-                with open(output_path, 'wb') as f:
-                    f.write(image_data)
+                orig_width, orig_height = img.size
+                
+                width_scale = target_width / orig_width
+                height_after_width_fit = int(orig_height * width_scale)
                 
-                # Check if the file was created successfully
-                if output_path.exists() and output_path.stat().st_size > 0:
-                    if attempt > 1:
-                        self._log_debug(f"PlantUML diagram rendered successfully on attempt {attempt}")
-                    self._log_debug(f"PlantUML diagram rendered successfully to: {output_path}")
-                    return True, ""
+                if height_after_width_fit <= max_height:
+                    scale_factor = width_scale
+                    new_width = target_width
+                    new_height = height_after_width_fit
+                    constraint = f"{scale_percent}% of page width"
                 else:
-                    last_error_msg = "PlantUML diagram file was not created or is empty"
-                    self._log_error(last_error_msg)
-                    return False, last_error_msg
-                    
-            except Exception as e:
-                # Handle exception carefully - some PlantUML exceptions don't have proper string representation
-                error_type = type(e).__name__
-                try:
-                    error_details = str(e)
-                except:
-                    error_details = "Unknown error (exception string conversion failed)"
-                last_error_msg = f"Failed to render PlantUML diagram: {error_type}: {error_details}"
+                    scale_factor = max_height / orig_height
+                    new_width = int(orig_width * scale_factor)
+                    new_height = max_height
+                    constraint = "capped to page height"
                 
-                # Check if this is a transient network error worth retrying
-                transient_keywords = ["SSL", "SSLError", "ConnectionError", "ConnectionReset", 
-                                      "TimeoutError", "Timeout", "BrokenPipe", "RemoteDisconnected"]
-                is_transient = any(kw.lower() in last_error_msg.lower() for kw in transient_keywords)
+                if orig_width == new_width and orig_height == new_height:
+                    self._log_debug(f"Diagram already at target size {new_width}x{new_height}px")
+                    return True
                 
-                if is_transient and attempt < max_retries:
-                    wait_time = 2 ** attempt  # 2s, 4s
-                    self._log_warning(f"PlantUML request failed (attempt {attempt}/{max_retries}): {error_type}. Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
-                    # Create a fresh client to discard any broken SSL/connection state
-                    client = plantuml.PlantUML(url=self._plantuml_server)
+                is_upscaling = scale_factor > 1.0
+                resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                
+                if is_upscaling:
+                    sharpened = resized.filter(ImageFilter.UnsharpMask(radius=1.0, percent=200, threshold=2))
                 else:
-                    self._log_error(last_error_msg)
-                    return False, last_error_msg
-        
-        # Should not reach here, but just in case
-        return False, last_error_msg
+                    sharpened = resized.filter(ImageFilter.UnsharpMask(radius=0.5, percent=150, threshold=3))
+                
+                if image_path.suffix.lower() in ['.png']:
+                    sharpened.save(image_path, format='PNG', compress_level=6, optimize=False)
+                elif image_path.suffix.lower() in ['.jpg', '.jpeg']:
+                    sharpened.save(image_path, format='JPEG', quality=100, subsampling=0, optimize=False)
+                else:
+                    sharpened.save(image_path, optimize=False)
+                
+                direction = "upscaled" if is_upscaling else "downscaled"
+                self._log_debug(f"Fit diagram to page: {orig_width}x{orig_height} -> {new_width}x{new_height} ({direction}, {constraint})")
+            
+            return True
+        except Exception as e:
+            self._log_warning(f"Failed to fit diagram to page: {e}")
+            return False
     
-    def _replace_mermaid_with_images(self, content: str, file_id: str = "", filename: str = "") -> str:
-        """Replace Mermaid code blocks with image references.
-        
-        Supports HTML comment modifiers on line above diagram:
-        <!-- no-resize -->
-        ```mermaid
-        graph TD
-            A --> B
-        ```
+    def _parse_dimension_value(self, value, original_size: int) -> Optional[int]:
+        """Parse dimension value that can be max pixels (int) or percentage (str).
         
-        <!-- scale:150% -->
-        ```mermaid
-        graph TD
-            A --> B
-        ```
+        Args:
+            value: int for max pixels (only resize if original exceeds), 
+                   str like "80%" for percentage of original (always applied, max 100%)
+            original_size: Original dimension in pixels (for percentage calculation)
+            
+        Returns:
+            Target dimension in pixels, or None if no resizing needed
         """
-        import re
-        
-        # Pattern to match optional HTML comment modifiers on line above, followed by mermaid block
-        # Handles both Unix (\n) and Windows (\r\n) line endings
-        # Captures: no-resize OR scale:X%
-        mermaid_pattern = r'(?:<!--\s*(?:(no-resize)|scale:(\d+)%)\s*-->\s*\r?\n)?```mermaid\r?\n(.*?)\r?\n```'
-        
-        # Find all matches with their modifiers
-        matches = list(re.finditer(mermaid_pattern, content, re.DOTALL | re.IGNORECASE))
+        if value is None:
+            return None
+            
+        # If it's already an int (max pixels constraint)
+        if isinstance(value, int):
+            # Only resize if original exceeds the max
+            if original_size > value:
+                return value
+            else:
+                return None  # Keep original size
+            
+        # If it's a string, check for percentage
+        if isinstance(value, str):
+            value_stripped = value.strip()
+            if value_stripped.endswith('%'):
+                try:
+                    percent = float(value_stripped[:-1])
+                    if percent > 0:
+                        # Always apply percentage (supports both downsizing and upscaling)
+                        return int(original_size * percent / 100.0)
+                except ValueError:
+                    pass
+            else:
+                # Try parsing as int string
+                try:
+                    parsed_int = int(value_stripped)
+                    # Only resize if original exceeds the max
+                    if original_size > parsed_int:
+                        return parsed_int
+                    else:
+                        return None  # Keep original size
+                except ValueError:
+                    pass
         
-        if not matches:
-            return content
+        return None
+    
+    def _resize_image(self, image_path: Path, max_width = None, max_height = None) -> bool:
+        """Resize image while maintaining aspect ratio.
         
-        # Process with progress bar
-        desc = f"  {filename} - Mermaid" if filename else "  Mermaid diagrams"
-        for i, match in enumerate(tqdm(matches, desc=desc, unit="diagram", leave=False)):
-            no_resize_modifier = match.group(1)  # "no-resize" or None
-            scale_percent = match.group(2)  # percentage digits or None
-            mermaid_code = match.group(3)
-            full_block = match.group(0)
+        Args:
+            image_path: Path to the image file
+            max_width: Maximum width - int (pixels), str ("80%"), or None (uses self.diagram_width)
+            max_height: Maximum height - int (pixels), str ("80%"), or None (uses self.diagram_height)
             
-            # Determine resize behavior
-            skip_resize = no_resize_modifier is not None
-            target_scale = 100.0  # Default: fill page width
-            if scale_percent:
-                percent_value = float(scale_percent)
-                if percent_value > 0:
-                    target_scale = percent_value
+        Returns:
+            True if resize was successful, False otherwise
+        """
+        try:
+            if max_width is None:
+                max_width = self.diagram_width
+            if max_height is None:
+                max_height = self.diagram_height
+            
+            # Open the image
+            with Image.open(image_path) as img:
+                # Convert image to RGB/RGBA mode if needed (fixes "wrong mode" errors)
+                # Some diagram renderers produce images in palette mode (P) or other modes
+                # that don't support all PIL operations like UnsharpMask filter
+                original_mode = img.mode
+                mode_converted = False
+                if img.mode not in ('RGB', 'RGBA'):
+                    # Preserve transparency if present
+                    if img.mode in ('P', 'PA', 'LA') and 'transparency' in img.info:
+                        img = img.convert('RGBA')
+                    else:
+                        img = img.convert('RGB')
+                    mode_converted = True
+                    self._log_debug(f"Converted image from mode {original_mode} to {img.mode} for processing")
+                
+                # Get original dimensions
+                orig_width, orig_height = img.size
+                
+                self._log_debug(f"Checking resize for {image_path.name}: original={orig_width}x{orig_height}, max={max_width}x{max_height}")
+                
+                # Parse dimensions (resolve percentages based on original size)
+                target_width = self._parse_dimension_value(max_width, orig_width)
+                target_height = self._parse_dimension_value(max_height, orig_height)
+                
+                self._log_debug(f"Parsed target dimensions: width={target_width}, height={target_height}")
+                
+                # If no valid dimensions, check if we need to save mode conversion
+                if target_width is None and target_height is None:
+                    if mode_converted:
+                        # Save the mode-converted image even though no resize is needed
+                        if image_path.suffix.lower() in ['.png']:
+                            img.save(image_path, format='PNG', compress_level=6, optimize=False)
+                        elif image_path.suffix.lower() in ['.jpg', '.jpeg']:
+                            img.save(image_path, format='JPEG', quality=100, subsampling=0, optimize=False)
+                        else:
+                            img.save(image_path, optimize=False)
+                        self._log_debug(f"Saved mode-converted image (no resize needed)")
+                    else:
+                        self._log_debug(f"Image {orig_width}x{orig_height} is within max constraints {max_width}x{max_height}, no resize needed")
+                    return True
+                
+                # Calculate scaling factor to fit within target dimensions while maintaining aspect ratio
+                if target_width is not None and target_height is not None:
+                    width_ratio = target_width / orig_width
+                    height_ratio = target_height / orig_height
+                    scale_factor = min(width_ratio, height_ratio)
+                elif target_width is not None:
+                    scale_factor = target_width / orig_width
+                else:  # target_height is not None
+                    scale_factor = target_height / orig_height
+                
+                # Only resize if scale factor differs from 1.0
+                if scale_factor != 1.0:
+                    new_width = int(orig_width * scale_factor)
+                    new_height = int(orig_height * scale_factor)
+                    
+                    is_upscaling = scale_factor > 1.0
+                    
+                    # Resize using high-quality Lanczos resampling (best for both up and downscaling)
+                    resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                    
+                    # Apply sharpening optimized for the scaling direction
+                    if is_upscaling:
+                        # For upscaling: Use stronger sharpening to enhance details and reduce softness
+                        # radius: larger for upscaling to cover more area
+                        # percent: higher to enhance edges more aggressively
+                        # threshold: lower to sharpen more details
+                        sharpened = resized_img.filter(ImageFilter.UnsharpMask(radius=1.0, percent=200, threshold=2))
+                    else:
+                        # For downscaling: Use moderate sharpening to compensate for resize blur
+                        sharpened = resized_img.filter(ImageFilter.UnsharpMask(radius=0.5, percent=150, threshold=3))
+                    
+                    # Save with maximum quality settings
+                    # For PNG: compress_level 0-9 (higher = smaller file but still lossless)
+                    # For JPEG: quality 95-100 (near-lossless)
+                    if image_path.suffix.lower() in ['.png']:
+                        sharpened.save(image_path, format='PNG', compress_level=6, optimize=False)
+                    elif image_path.suffix.lower() in ['.jpg', '.jpeg']:
+                        sharpened.save(image_path, format='JPEG', quality=100, subsampling=0, optimize=False)
+                    else:
+                        sharpened.save(image_path, optimize=False)
+                    
+                    scale_direction = "upscaled" if is_upscaling else "downscaled"
+                    self._log_debug(f"Resized image from {orig_width}x{orig_height} to {new_width}x{new_height} ({scale_direction} with optimized sharpening)")
                 else:
-                    self._log_warning(f"Scale percentage must be greater than 0%, got {scale_percent}%. Using default (100%).")
-            
-            # Create unique image path using file_id to avoid race conditions
-            image_path = self.temp_dir / f"mermaid_diagram_{file_id}_{i}.png"
+                    self._log_debug(f"Image {orig_width}x{orig_height} already within target bounds, no resize needed")
             
-            # Render Mermaid diagram
-            modifier_info = ""
-            if skip_resize:
-                modifier_info = " (no-resize)"
-            elif target_scale != 100.0:
-                modifier_info = f" (scale:{target_scale}%)"
-            self._log_debug(f"Rendering Mermaid diagram {i} to: {image_path}{modifier_info}")
+            return True
             
-            # Reuse event loop from file processing
-            success, error_msg = self._local.event_loop.run_until_complete(
-                self._render_mermaid_diagram(mermaid_code, image_path)
+        except Exception as e:
+            self._log_error(f"Failed to resize image {image_path}: {e}")
+            return False
+    
+    def _render_mermaid_with_mmdr(self, mermaid_code: str, output_path: Path) -> tuple[bool, str]:
+        """Render Mermaid diagram to PNG with the native mmdr binary (no browser required)."""
+        try:
+            subprocess.run(
+                [self._mmdr_path, "-i", "-", "-o", str(output_path), "-f", "png", "--fastText"],
+                input=mermaid_code.encode("utf-8"),
+                capture_output=True,
+                check=True,
+                timeout=30,
             )
-            if not success:
-                raise RuntimeError(f"Mermaid diagram {i} failed to render: {error_msg}")
-            
-            # Fit diagram to page width (or scaled fraction of it)
-            if skip_resize:
-                self._log_debug(f"Skipping resize for Mermaid diagram {i} due to no-resize modifier")
-            else:
-                self._fit_diagram_to_page(image_path, scale_percent=target_scale, dpi_scale=2)
-            
-            self._log_debug(f"Mermaid diagram rendered successfully, using path: {image_path}")
-            if target_scale != 100.0 and not skip_resize:
-                img_tag = f'<img src="{image_path}" style="max-width:{target_scale}%" />'
-            else:
-                img_tag = f"![]({image_path})"
-            content = content.replace(full_block, img_tag)
-        
-        return content
+            if not output_path.exists():
+                return False, "mmdr exited successfully but produced no image"
+            return True, ""
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode("utf-8", errors="replace").strip() if e.stderr else ""
+            return False, f"mmdr failed with exit code {e.returncode}: {stderr}"
+        except Exception as e:
+            return False, f"mmdr failed: {e}"
     
-    def _replace_plantuml_with_images(self, content: str, file_id: str = "", filename: str = "") -> str:
-        """Replace PlantUML code blocks with image references.
-        
-        Supports HTML comment modifiers on line above diagram:
-        <!-- no-resize -->
-        ```plantuml
-        @startuml
-        A -> B
-        @enduml
-        ```
+    async def _render_mermaid_diagram(self, mermaid_code: str, output_path: Path) -> tuple[bool, str, tuple]:
+        """Render Mermaid diagram to image using mmdr when available, otherwise Playwright.
         
-        <!-- scale:150% -->
-        ```plantuml
-        @startuml
-        A -> B
-        @enduml
-        ```
+        Returns (success, error_msg, renderer_id), where renderer_id identifies the renderer that
+        produced the image, which differs from the configured one after a fallback.
         """
-        import re
-        
-        # Pattern to match optional HTML comment modifiers on line above, followed by plantuml block
-        # Handles both Unix (\n) and Windows (\r\n) line endings
-        # Captures: no-resize OR scale:X%
-        plantuml_pattern = r'(?:<!--\s*(?:(no-resize)|scale:(\d+)%)\s*-->\s*\r?\n)?```plantuml\r?\n(.*?)\r?\n```'
-        
-        # Find all matches with their modifiers
-        matches = list(re.finditer(plantuml_pattern, content, re.DOTALL | re.IGNORECASE))
-        
-        if not matches:
-            return content
+        if self._mmdr_path:
+            # Run the subprocess off the event-loop thread so the loop stays responsive
+            success, error_msg = await asyncio.get_running_loop().run_in_executor(
+                None, self._render_mermaid_with_mmdr, mermaid_code, output_path
+            )
+            if success:
+                return True, "", self._diagram_renderer_ids["mermaid"]
+            self._log_warning(f"{error_msg}; falling back to Playwright")
         
-        # Process with progress bar
-        desc = f"  {filename} - PlantUML" if filename else "  PlantUML diagrams"
-        for i, match in enumerate(tqdm(matches, desc=desc, unit="diagram", leave=False)):
-            no_resize_modifier = match.group(1)  # "no-resize" or None
-            scale_percent = match.group(2)  # percentage digits or None
-            plantuml_code = match.group(3)
-            full_block = match.group(0)
-            
-            # Determine resize behavior
-            skip_resize = no_resize_modifier is not None
-            target_scale = 100.0  # Default: fill page width
-            if scale_percent:
-                percent_value = float(scale_percent)
-                if percent_value > 0:
-                    target_scale = percent_value
-                else:
-                    self._log_warning(f"Scale percentage must be greater than 0%, got {scale_percent}%. Using default (100%).")
+        try:
+            # 2x device scale for high-DPI rasterization of vector SVGs
+            await self._ensure_browser(device_scale_factor=2)
+            page = self._local.page
             
-            # Create unique image path using file_id to avoid race conditions
-            image_path = self.temp_dir / f"plantuml_diagram_{file_id}_{i}.png"
+            # Set viewport for high-resolution rendering using fixed pixel dimensions
+            viewport_width, viewport_height = self._get_viewport_dimensions()
+            await page.set_viewport_size({"width": viewport_width, "height": viewport_height})
+            await page.emulate_media(media="screen")
+                
+            # Create HTML with Mermaid
+            html_content = f"""
+            <!DOCTYPE html>
+            <html>
+            <head>
+                <meta charset="utf-8">
+                <style>
+                    body {{
+                        margin: 0;
+                        padding: 10px;
+                        background: white;
+                        font-family: Arial, sans-serif;
+                    }}
+                    .mermaid {{
+                        background: white;
+                        display: inline-block;
+                        padding: 5px;
+                    }}
+                    .mermaid svg {{
+                        max-width: none;
+                        height: auto;
+                        display: block;
+                        font-family: Arial, sans-serif;
+                    }}
+                    .mermaid .node rect {{
+                        rx: 3;
+                        ry: 3;
+                    }}
+                    .mermaid .edgePath .path {{
+                        stroke-width: 1.5px;
+                    }}
+                </style>
+            </head>
+            <body>
+                <pre class="mermaid">
+                    {mermaid_code}
+                </pre>
+                <script type="module">
+                    import mermaid from 'https://cdn.jsdelivr.net/npm/mermaid@11/dist/mermaid.esm.min.mjs';
+                    
+                    mermaid.initialize({{
+                        startOnLoad: false,
+                        theme: 'default',
+                        themeVariables: {{
+                            primaryColor: '#ff6b6b',
+                            primaryTextColor: '#333',
+                            primaryBorderColor: '#ff6b6b',
+                            lineColor: '#333',
+                            secondaryColor: '#4ecdc4',
+                            tertiaryColor: '#45b7d1'
+                        }},
+                        flowchart: {{
+                            useMaxWidth: false,
+                            htmlLabels: true,
+                            curve: 'basis'
+                        }},
+                        sequence: {{
+                            useMaxWidth: false,
+                            diagramMarginY: 3,
+                            diagramMarginX: 10,
+                            messageFontSize: 12,
+                            actorFontSize: 12,
+                            actorMargin: 20,
+                            messageMargin: 10
+                        }},
+                        gantt: {{
+                            useMaxWidth: false
+                        }},
+                        class: {{
+                            useMaxWidth: false
+                        }}
+                    }});
+                    await mermaid.run();
+                </script>
+            </body>
+            </html>
+            """
             
-            # Render PlantUML diagram
-            modifier_info = ""
-            if skip_resize:
-                modifier_info = " (no-resize)"
-            elif target_scale != 100.0:
-                modifier_info = f" (scale:{target_scale}%)"
-            self._log_debug(f"Rendering PlantUML diagram {i} to: {image_path}{modifier_info}")
+            await page.set_content(html_content)
             
-            success, error_msg = self._render_plantuml_diagram(plantuml_code, image_path)
-            if not success:
-                raise RuntimeError(f"PlantUML diagram {i} failed to render: {error_msg}")
+            # Wait for Mermaid to render using dimension stability detection
+            # Wait for Mermaid to render using dimension stability detection
+            max_wait_time = 5000  # 5 seconds max
+            poll_interval = 100  # 100ms polling
+            stability_checks = 3  # Number of consecutive stable checks required
+            elapsed_time = 0
             
-            # Fit diagram to page width (or scaled fraction of it)
-            if skip_resize:
-                self._log_debug(f"Skipping resize for PlantUML diagram {i} due to no-resize modifier")
-            else:
-                self._fit_diagram_to_page(image_path, scale_percent=target_scale)
+            # First, wait for SVG to appear
+            svg_found = False
+            while elapsed_time < max_wait_time and not svg_found:
+                svg_element = await page.query_selector('.mermaid svg')
+                if svg_element:
+                    svg_content = await svg_element.inner_html()
+                    if svg_content and len(svg_content.strip()) > 0:
+                        self._log_debug(f"Mermaid SVG detected in {elapsed_time}ms")
+                        svg_found = True
+                        break
+                
+                await page.wait_for_timeout(poll_interval)
+                elapsed_time += poll_interval
             
-            self._log_debug(f"PlantUML diagram rendered successfully, using path: {image_path}")
-            if target_scale != 100.0 and not skip_resize:
-                img_tag = f'<img src="{image_path}" style="max-width:{target_scale}%" />'
+            if not svg_found:
+                self._log_warning(f"Mermaid SVG not found after {max_wait_time}ms")
             else:
-                img_tag = f"![]({image_path})"
-            content = content.replace(full_block, img_tag)
-        
-        return content
-    
-    def _process_page_breaks(self, content: str) -> str:
-        """Process page break markers in markdown content."""
-        import re
-        
-        # For ebook formats, convert page breaks to chapter breaks or remove them
-        if self.output_format in ["epub", "mobi"]:
-            # Remove page breaks for ebook formats as they don't make sense
-            content = re.sub(r'<!--\s*page-break\s*-->', '', content, flags=re.IGNORECASE)
-            content = re.sub(r'<div class="page-break"></div>', '', content)
-            content = re.sub(r'```page-break\n```', '', content, flags=re.IGNORECASE)
-            content = re.sub(r'<page-break>', '', content, flags=re.IGNORECASE)
-            content = re.sub(r'---\s*\n\s*\{\.page-break\}', '', content, flags=re.IGNORECASE | re.MULTILINE)
-        else:
-            # Keep page breaks for PDF
-            content = re.sub(r'<!--\s*page-break\s*-->', '<div class="page-break"></div>', content, flags=re.IGNORECASE)
-            content = re.sub(r'```page-break\n```', '<div class="page-break"></div>', content, flags=re.IGNORECASE)
-            content = re.sub(r'<page-break>', '<div class="page-break"></div>', content, flags=re.IGNORECASE)
-            content = re.sub(r'---\s*\n\s*\{\.page-break\}', '<div class="page-break"></div>', content, flags=re.IGNORECASE | re.MULTILINE)
-        
-        return content
-    
-    def _filter_sections_for_print(self, content: str) -> str:
-        """Filter out sections that should be ignored for print profiles."""
-        import re
-        
-        # For print profiles, remove Table of contents sections
-        if self.style_profile in ["a4-print", "a4-screen"]:
-            # Pattern to match "## Table of contents" or "### Table of contents" heading and everything until the next heading
-            toc_pattern = r'^#{2,3}\s+Table\s+of\s+contents\s*$.*?(?=^#{1,3}\s|\Z)'
-            
-            # Use MULTILINE and DOTALL flags to match across lines
-            filtered_content = re.sub(toc_pattern, '', content, flags=re.MULTILINE | re.DOTALL | re.IGNORECASE)
-            
-            # Clean up any extra whitespace that might be left
-            filtered_content = re.sub(r'\n\s*\n\s*\n', '\n\n', filtered_content)
-            
-            # Log the filtering action
-            if filtered_content != content:
-                self._log_debug("Filtered out 'Table of contents' section for print profile")
-            
-            return filtered_content
-        
-        return content
-    
-    def _process_and_embed_images(self, content: str, md_file: Path) -> str:
-        """Process and embed referenced images into the temp directory."""
-        import re
-        import shutil
-        
-        # Find all image references (both markdown and HTML img tags)
-        markdown_img_pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
-        html_img_pattern = r'<img[^>]+src=["\']([^"\']+)["\'][^>]*>'
-        
-        processed_content = content
-        md_dir = md_file.parent
-        
-        # Process markdown image references
-        for match in re.finditer(markdown_img_pattern, content):
-            alt_text = match.group(1)
-            img_path = match.group(2)
-            
-            # Skip if it's already a temp file or absolute URL
-            if img_path.startswith('http') or img_path.startswith('data:'):
-                continue
-            
-            # Check if this is a diagram generated by our script (Mermaid or PlantUML)
-            if img_path.startswith('temp/') or img_path.startswith('temp\\'):
-                # Convert relative temp path to absolute path for pandoc
-                if not os.path.isabs(img_path):
-                    # Convert to absolute path
-                    abs_img_path = self.temp_dir / img_path.replace('temp/', '').replace('temp\\', '')
-                    if abs_img_path.exists():
-                        # Replace the relative path with absolute path
-                        processed_content = processed_content.replace(
-                            f"]({img_path})",
-                            f"]({abs_img_path})"
-                        )
-                        self._log_debug(f"Converted temp image path to absolute: {img_path} -> {abs_img_path}")
+                # Wait for dimensions to stabilize
+                mermaid_element = await page.query_selector('.mermaid')
+                if mermaid_element:
+                    stable_count = 0
+                    last_box = None
+                    stability_start = elapsed_time
+                    
+                    while elapsed_time < max_wait_time and stable_count < stability_checks:
+                        await page.wait_for_timeout(50)  # Short wait between checks
+                        current_box = await mermaid_element.bounding_box()
+                        
+                        if current_box and last_box:
+                            # Check if dimensions are stable (within 1px tolerance for floating point)
+                            width_stable = abs(current_box['width'] - last_box['width']) < 1
+                            height_stable = abs(current_box['height'] - last_box['height']) < 1
+                            
+                            if width_stable and height_stable:
+                                stable_count += 1
+                            else:
+                                stable_count = 0  # Reset if dimensions changed
+                        
+                        last_box = current_box
+                        elapsed_time += 50
+                    
+                    if stable_count >= stability_checks:
+                        self._log_debug(f"Mermaid diagram layout stabilized in {elapsed_time - stability_start}ms (total: {elapsed_time}ms)")
                     else:
-                        self._log_warning(f"Temp image not found: {abs_img_path}")
-                continue
-                
-            # Resolve relative path from markdown file location
-            if not os.path.isabs(img_path):
-                full_img_path = md_dir / img_path
-            else:
-                full_img_path = Path(img_path)
+                        self._log_warning(f"Mermaid diagram dimensions did not stabilize after {max_wait_time}ms")
             
-            if full_img_path.exists():
-                # Copy image to temp directory
-                temp_img_name = f"embedded_{full_img_path.stem}_{full_img_path.suffix}"
-                temp_img_path = self.temp_dir / temp_img_name
-                
-                try:
-                    shutil.copy2(full_img_path, temp_img_path)
-                    self._log_debug(f"Embedded image: {img_path} -> {temp_img_name}")
-                    
-                    # Update the reference in content
-                    old_ref = f"![{alt_text}]({img_path})"
-                    new_ref = f"![{alt_text}]({temp_img_path})"
-                    processed_content = processed_content.replace(old_ref, new_ref)
-                    
-                except Exception as e:
-                    self._log_warning(f"Failed to embed image {img_path}: {e}")
-            else:
-                self._log_warning(f"Image not found: {full_img_path}")
-        
-        # Process HTML img tags
-        for match in re.finditer(html_img_pattern, content):
-            img_path = match.group(1)
+            # Normalize SVGs that use width="100%" (e.g. Mermaid 11 classDiagram)
+            # to explicit pixel dimensions from the viewBox, so the browser
+            # renders them at full fidelity before we scale and rasterize.
+            await page.evaluate("""() => {
+                const svg = document.querySelector('.mermaid svg');
+                if (!svg) return;
+                const vb = svg.getAttribute('viewBox');
+                const w = svg.getAttribute('width');
+                if (vb && (!w || w.includes('%'))) {
+                    const parts = vb.split(/[\\s,]+/);
+                    const natW = parseFloat(parts[2]);
+                    const natH = parseFloat(parts[3]);
+                    if (natW > 0 && natH > 0) {
+                        svg.setAttribute('width', natW);
+                        svg.setAttribute('height', natH);
+                        svg.style.maxWidth = 'none';
+                    }
+                }
+            }""")
+            await page.wait_for_timeout(50)
             
-            # Skip if it's already a temp file or absolute URL
-            if img_path.startswith('http') or img_path.startswith('data:'):
-                continue
+            # Scale the SVG up to the target page width BEFORE rasterizing.
+            # SVGs are vector graphics, so this produces a perfectly crisp image
+            # at any resolution — no blurry upscaling of a small raster.
+            target_width = self._get_page_width_px()
+            scaled = await page.evaluate(f"""() => {{
+                const svg = document.querySelector('.mermaid svg');
+                if (!svg) return false;
+                const viewBox = svg.getAttribute('viewBox');
+                if (viewBox) {{
+                    const parts = viewBox.split(/[\\s,]+/);
+                    const natW = parseFloat(parts[2]);
+                    const natH = parseFloat(parts[3]);
+                    if (natW > 0 && natH > 0) {{
+                        const scale = {target_width} / natW;
+                        svg.setAttribute('width', {target_width});
+                        svg.setAttribute('height', Math.ceil(natH * scale));
+                        svg.style.maxWidth = 'none';
+                        return true;
+                    }}
+                }}
+                // Fallback: use current rendered size
+                const rect = svg.getBoundingClientRect();
+                if (rect.width > 0) {{
+                    const scale = {target_width} / rect.width;
+                    svg.setAttribute('width', {target_width});
+                    svg.setAttribute('height', Math.ceil(rect.height * scale));
+                    svg.style.maxWidth = 'none';
+                    return true;
+                }}
+                return false;
+            }}""")
+            if scaled:
+                self._log_debug(f"Scaled SVG to {target_width}px wide before rasterization")
             
-            # Check if this is a diagram generated by our script (Mermaid or PlantUML)
-            if img_path.startswith('temp/') or img_path.startswith('temp\\'):
-                # Convert relative temp path to absolute path for pandoc
-                if not os.path.isabs(img_path):
-                    # Convert to absolute path
-                    abs_img_path = self.temp_dir / img_path.replace('temp/', '').replace('temp\\', '')
-                    if abs_img_path.exists():
-                        # Replace the relative path with absolute path
-                        processed_content = processed_content.replace(
-                            f"]({img_path})",
-                            f"]({abs_img_path})"
-                        )
-                        self._log_debug(f"Converted temp image path to absolute: {img_path} -> {abs_img_path}")
-                    else:
-                        self._log_warning(f"Temp image not found: {abs_img_path}")
-                continue
-                
-            # Resolve relative path from markdown file location
-            if not os.path.isabs(img_path):
-                full_img_path = md_dir / img_path
-            else:
-                full_img_path = Path(img_path)
+            # Brief pause for the browser to re-layout at the new SVG size
+            await page.wait_for_timeout(100)
             
-            if full_img_path.exists():
-                # Copy image to temp directory
-                temp_img_name = f"embedded_{full_img_path.stem}_{full_img_path.suffix}"
-                temp_img_path = self.temp_dir / temp_img_name
-                
-                try:
-                    shutil.copy2(full_img_path, temp_img_path)
-                    self._log_debug(f"Embedded HTML image: {img_path} -> {temp_img_name}")
-                    
-                    # Update the reference in content
-                    old_ref = match.group(0)
-                    new_ref = old_ref.replace(img_path, str(temp_img_path))
-                    processed_content = processed_content.replace(old_ref, new_ref)
-                    
-                except Exception as e:
-                    self._log_warning(f"Failed to embed HTML image {img_path}: {e}")
+            # Take screenshot of the scaled element
+            mermaid_element = await page.query_selector('.mermaid')
+            if mermaid_element:
+                bounding_box = await mermaid_element.bounding_box()
+                if bounding_box:
+                    await mermaid_element.screenshot(
+                        path=str(output_path), 
+                        type='png',
+                        scale='device'
+                    )
+                else:
+                    await page.screenshot(
+                        path=str(output_path), 
+                        type='png', 
+                        full_page=True,
+                        scale='device'
+                    )
             else:
-                self._log_warning(f"HTML image not found: {full_img_path}")
-        
-        return processed_content
-    
-    def _extract_title(self, md_file: Path, content: str) -> str:
-        """Extract the document title from markdown content."""
-        import re
-
-        # 1) ATX H1: lines that start with '# ' but not '## '
-        for line in content.splitlines():
-            stripped = line.strip()
-            if stripped.startswith('# '):
-                heading_text = stripped[2:].strip()
-                if heading_text:
-                    return heading_text
-
-        # 2) Setext H1: a line followed by a line of '=' (at least 3)
-        lines = content.splitlines()
-        for i in range(len(lines) - 1):
-            current_line = lines[i].rstrip()
-            underline = lines[i + 1].strip()
-            if current_line and re.fullmatch(r"=\s*=+", underline) or re.fullmatch(r"=+", underline):
-                return current_line.strip()
-
-        # 3) Fallback to humanized filename stem
-        stem = md_file.stem.replace('_', ' ').replace('-', ' ').strip()
-        return stem.title() if stem else md_file.stem
-    
-    def _create_html_template(self, content: str, margins: Dict[str, str], title: str) -> str:
-        """Create HTML template with proper styling, margins, and document title."""
-        
-        # Get style profile configuration
-        profile = self.STYLE_PROFILES[self.style_profile]
-        font_scale = profile["font_scale"]
-        base_font_size = profile["base_font_size"]
-        
-        # Convert margins to cm for CSS
-        top_cm = self._convert_margin_to_cm(margins['top'])
-        right_cm = self._convert_margin_to_cm(margins['right'])
-        bottom_cm = self._convert_margin_to_cm(margins['bottom'])
-        left_cm = self._convert_margin_to_cm(margins['left'])
-        
-        # Max image height: 80% of content area to leave room for headings/text
-        img_max_height_cm = 29.7 - top_cm - bottom_cm
-        
-        html_template = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{title}</title>
-    <style>
-        @page {{
-            margin: {top_cm}cm {right_cm}cm {bottom_cm}cm {left_cm}cm;
-            size: A4 portrait;
-            width: 210mm;
-            height: 297mm;
-        }}
-        
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            line-height: 1.4;
-            color: #333;
-            max-width: none;
-            margin: 0;
-            padding: 0;
-            font-size: {base_font_size};
-            width: 100%;
-            box-sizing: border-box;
-        }}
-        
-        /* Ensure content fits within A4 page boundaries */
-        * {{
-            box-sizing: border-box;
-        }}
-        
-        h1, h2, h3, h4, h5, h6 {{
-            color: #2c3e50;
-            margin-top: 0.8em;
-            margin-bottom: 0.3em;
-            font-weight: 600;
-        }}
-        
-        h1 {{
-            font-size: {1.6 * font_scale:.1f}em;
-            border-bottom: 2px solid #3498db;
-            padding-bottom: 0.2em;
-        }}
-        
-        h2 {{
-            font-size: {1.3 * font_scale:.1f}em;
-            border-bottom: 1px solid #bdc3c7;
-            padding-bottom: 0.1em;
-        }}
-        
-        h3 {{
-            font-size: {1.1 * font_scale:.1f}em;
-        }}
-        
-        h4 {{
-            font-size: {1.0 * font_scale:.1f}em;
-            text-decoration: underline;
-        }}
-        
-        h5 {{
-            font-size: {0.9 * font_scale:.1f}em;
-            text-decoration: underline;
-        }}
-        
-        h6 {{
-            font-size: {0.8 * font_scale:.1f}em;
-            text-decoration: underline;
-        }}
-        
-        p {{
-            margin: 0.5em 0;
-            text-align: justify;
-        }}
-        
-        code {{
-            background-color: #f8f9fa;
-            border: 1px solid #e9ecef;
-            border-radius: 3px;
-            padding: 0.1em 0.3em;
-            font-family: 'Courier New', Consolas, monospace;
-            font-size: {0.8 * font_scale:.1f}em;
-            color: #e83e8c;
-        }}
-        
-        pre {{
-            background-color: #f8f9fa;
-            border: 1px solid #e9ecef;
-            border-radius: 5px;
-            padding: 0.5em;
-            overflow-x: auto;
-            margin: 0.5em 0;
-            font-size: {0.8 * font_scale:.1f}em;
-        }}
-        
-        pre code {{
-            background: none;
-            border: none;
-            padding: 0;
-            color: #333;
-        }}
-        
-        blockquote {{
-            border-left: 4px solid #3498db;
-            margin: 0.5em 0;
-            padding: 0.3em 0.8em;
-            background-color: #f8f9fa;
-            color: #555;
-        }}
-        
-        table {{
-            border-collapse: collapse;
-            width: 100%;
-            margin: 0.5em 0;
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-        }}
-        
-        th, td {{
-            border: 1px solid #ddd;
-            padding: 0.3em;
-            text-align: left;
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-        }}
-        
-        th {{
-            background-color: #f8f9fa;
-            font-weight: 600;
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-        }}
-        
-        ul, ol {{
-            margin: 0.5em 0;
-            padding-left: 1.5em;
-            display: block;
-        }}
-        
-        li {{
-            margin: 0.2em 0;
-            display: list-item;
-            list-style-type: disc;
-        }}
-        
-        ul li {{
-            list-style-type: disc;
-        }}
-        
-        ol li {{
-            list-style-type: decimal;
-        }}
-        
-        /* Ensure nested lists work properly */
-        ul ul, ol ol, ul ol, ol ul {{
-            margin: 0.2em 0;
-            padding-left: 1.2em;
-        }}
-        
-        ul ul li {{
-            list-style-type: circle;
-        }}
-        
-        ul ul ul li {{
-            list-style-type: square;
-        }}
-        
-        img {{
-            max-width: 100%;
-            max-height: {img_max_height_cm:.2f}cm;
-            width: auto;
-            height: auto;
-            display: block;
-            margin: 0.5em auto;
-            object-fit: contain;
-        }}
-        
-        /* Specific styling for Mermaid diagram images */
-        img[alt*=""] {{
-            margin: 0.3em auto;
-            padding: 0;
-            border: none;
-            background: transparent;
-        }}
-        
-        a {{
-            color: #3498db;
-            text-decoration: none;
-        }}
-        
-        a:hover {{
-            text-decoration: underline;
-        }}
-        
-        .page-break {{
-            page-break-before: always;
-        }}
-        
-        /* Better page break handling for A4 */
-        h1, h2, h3 {{
-            page-break-after: avoid;
-            break-after: avoid;
-        }}
-        
-        h1, h2, h3, h4, h5, h6 {{
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }}
-        
-        p, li {{
-            orphans: 3;
-            widows: 3;
-        }}
-        
-        /* Prevent large elements from breaking across pages */
-        pre, blockquote, table, img {{
-            page-break-inside: avoid;
-            break-inside: avoid;
-        }}
-        
-        /* Ensure tables fit within page width */
-        table {{
-            max-width: 100%;
-            table-layout: auto;
-        }}
-        
-        /* Force table font inheritance and override any defaults */
-        table, table *, table th, table td, table tr {{
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-            line-height: inherit !important;
-        }}
-        
-        /* Additional specificity for markdown-generated tables */
-        body table, body table th, body table td {{
-            font-size: {base_font_size} !important;
-            font-family: inherit !important;
-        }}
-    </style>
-</head>
-<body>
-    {content}
-</body>
-</html>
-        """
-        
-        return html_template
-    
-    async def _convert_html_to_pdf(self, html_file: Path, output_pdf: Path, margins: Dict[str, str]) -> bool:
-        """Convert HTML to PDF using Playwright (Puppeteer approach).
-        
-        Retries once with a fresh browser if the browser process crashes mid-conversion.
-        """
-        max_attempts = 2
-        
-        for attempt in range(1, max_attempts + 1):
-            try:
-                # Reuse browser instance
-                await self._ensure_browser()
-                page = self._local.page
-                
-                # Load HTML file
-                await page.goto(html_file.absolute().as_uri())
-                
-                # Wait for content to load
-                await page.wait_for_load_state('networkidle')
-                
-                # Convert margins to cm for PDF generation
-                top_cm = self._convert_margin_to_cm(margins['top'])
-                right_cm = self._convert_margin_to_cm(margins['right'])
-                bottom_cm = self._convert_margin_to_cm(margins['bottom'])
-                left_cm = self._convert_margin_to_cm(margins['left'])
-                
-                # Generate PDF with precise A4 settings
-                await page.pdf(
-                    path=str(output_pdf),
-                    format='A4',
-                    width='210mm',
-                    height='297mm',
-                    margin={
-                        'top': f'{top_cm}cm',
-                        'right': f'{right_cm}cm',
-                        'bottom': f'{bottom_cm}cm',
-                        'left': f'{left_cm}cm'
-                    },
-                    print_background=True,
-                    prefer_css_page_size=True,
-                    display_header_footer=False,
-                    scale=1.0
+                await page.screenshot(
+                    path=str(output_path), 
+                    type='png', 
+                    full_page=True,
+                    scale='device'
                 )
-                
-                return True
-                
-            except Exception as e:
-                error_msg = str(e)
-                is_crash = any(kw in error_msg for kw in [
-                    "Connection closed", "Browser has been closed", "Target closed",
-                    "crashed", "Protocol error"
-                ])
-                
-                if is_crash and attempt < max_attempts:
-                    self._log_warning(f"Browser crashed during PDF generation, restarting and retrying...")
-                    # Force-reset browser state so _ensure_browser creates a fresh one
-                    await self._close_browser()
-                else:
-                    self._log_error(f"Failed to convert HTML to PDF: {e}")
-                    return False
-        
-        return False
-    
-    def _convert_to_epub(self, md_file: Path, output_epub: Path, title: str) -> bool:
-        """Convert markdown to EPUB format using Pandoc."""
-        try:
-            filename = md_file.name
-            
-            # Create progress bar for EPUB conversion steps
-            with tqdm(total=5, desc=f"  {filename}", unit="step", leave=False) as pbar:
-                # Step 1: Read markdown content
-                pbar.set_description(f"  {filename} - Reading")
-                with open(md_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                pbar.update(1)
-                
-                # Step 2: Process content
-                pbar.set_description(f"  {filename} - Processing")
-                processed_content = self._filter_sections_for_print(content)
-                file_id = md_file.stem
-                pbar.update(1)
-                
-                # Step 3: Process diagrams
-                pbar.set_description(f"  {filename} - Diagrams")
-                processed_content = self._replace_mermaid_with_images(processed_content, file_id, filename)
-                # Close browser after Mermaid rendering to free memory before PlantUML steps
-                tls = self._local
-                if hasattr(tls, 'event_loop') and tls.event_loop:
-                    tls.event_loop.run_until_complete(self._close_browser())
-                processed_content = self._replace_plantuml_with_images(processed_content, file_id, filename)
-                pbar.update(1)
-                
-                # Step 4: Process page breaks and images
-                pbar.set_description(f"  {filename} - Images")
-                processed_content = self._process_page_breaks(processed_content)
-                processed_content = self._process_and_embed_images(processed_content, md_file)
-                
-                temp_md = self.temp_dir / f"temp_{md_file.name}"
-                with open(temp_md, 'w', encoding='utf-8') as f:
-                    f.write(processed_content)
-                pbar.update(1)
-                
-                # Step 5: Convert to EPUB
-                pbar.set_description(f"  {filename} - EPUB")
-                css_file = None
-                if self.style_profile == "kindle-paperwhite-11":
-                    css_file = self._create_paperwhite_css()
-                
-                cmd = [
-                    "pandoc",
-                    str(temp_md),
-                    "-o", str(output_epub),
-                    "--standalone",
-                    "--self-contained",
-                    f"--metadata=title:{title}",
-                    f"--metadata=author:{self.author}",
-                    f"--metadata=language:{self.language}",
-                    "--toc",
-                    "--toc-depth=3"
-                ]
-                
-                if css_file:
-                    cmd.extend(["--css", str(css_file)])
-                
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                if result.returncode != 0:
-                    self._log_error(f"Pandoc EPUB conversion failed: {result.stderr}")
-                    return False
-                pbar.update(1)
-            
-            return True
             
-        except Exception as e:
-            self._log_error(f"Failed to convert to EPUB: {e}")
-            return False
-    
-    def _create_paperwhite_css(self) -> Path:
-        """Create device-specific CSS for Kindle Paperwhite 11th generation."""
-        css_content = """
-/* Kindle Paperwhite 11th Generation Optimized CSS */
-/* 6.8" E Ink Carta screen, 1648 x 1236 pixels, 300 ppi */
-
-/* Base styles optimized for 300ppi display */
-body {
-    font-family: "Bookerly", "Caecilia", "Helvetica", "Arial", sans-serif;
-    font-size: 13px;
-    line-height: 1.6;
-    color: #000000;
-    margin: 0;
-    padding: 0.8em;
-    text-align: justify;
-    hyphens: auto;
-    -webkit-hyphens: auto;
-    -moz-hyphens: auto;
-    -ms-hyphens: auto;
-}
-
-/* Media query for Kindle Paperwhite 11th generation */
-@media only screen and (min-width: 1648px) and (max-width: 1648px) and (min-height: 1236px) and (max-height: 1236px) {
-    body {
-        font-size: 14px;
-        line-height: 1.7;
-        padding: 1em;
-    }
-    
-    h1 {
-        font-size: 1.8em;
-        margin-top: 1.2em;
-        margin-bottom: 0.6em;
-        page-break-after: avoid;
-    }
-    
-    h2 {
-        font-size: 1.5em;
-        margin-top: 1em;
-        margin-bottom: 0.5em;
-        page-break-after: avoid;
-    }
+            return True, "", _PLAYWRIGHT_RENDERER_ID
+                
+        except Exception as e:
+            error_msg = f"Failed to render Mermaid diagram: {e}"
+            self._log_error(error_msg)
+            return False, error_msg, _PLAYWRIGHT_RENDERER_ID
     
-    h3 {
-        font-size: 1.3em;
-        margin-top: 0.8em;
-        margin-bottom: 0.4em;
-        page-break-after: avoid;
-    }
+    async def _render_mermaid_batch(self, jobs: List[tuple], pbar=None) -> List[tuple]:
+        """Render (mermaid_code, output_path, fit_scale) jobs one after another on the shared browser page.
+        
+        Each rendered image is fitted to the page (fit_scale percent of page width, or not at
+        all when fit_scale is None) in the default executor while the next diagram renders.
+        Stops at the first failure. Returns one (success, error_msg, renderer_id) tuple per
+        attempted job.
+        """
+        loop = asyncio.get_running_loop()
+        results = []
+        fits = []
+        for mermaid_code, output_path, fit_scale in jobs:
+            result = await self._render_mermaid_diagram(mermaid_code, output_path)
+            results.append(result)
+            if pbar is not None:
+                pbar.update(1)
+            if not result[0]:
+                break
+            if fit_scale is not None:
+                fits.append(loop.run_in_executor(None, self._fit_diagram_to_page, output_path, fit_scale, 2))
+        if fits:
+            await asyncio.gather(*fits)
+        return results
+    
+    def _render_plantuml_diagram(self, plantuml_code: str, output_path: Path, max_retries: int = 3,
+                                 client: Optional[plantuml.PlantUML] = None) -> tuple[bool, str]:
+        """Render PlantUML diagram to image using the plantuml library.
+        
+        Retries on transient network errors (SSL, connection, timeout) with exponential backoff.
+        Creates a fresh client on each retry to avoid reusing broken connections.
+        Concurrent callers must pass their own client; the shared one is not thread-safe.
+        """
+        last_error_msg = ""
+        client = client or self._plantuml_client
+        
+        for attempt in range(1, max_retries + 1):
+            try:
+                # Render the diagram to PNG and get raw image data
+                image_data = client.processes(plantuml_code)
+                
+                if not image_data:
+                    last_error_msg = "PlantUML diagram file was not created or is empty"
+                    self._log_error(last_error_msg)
+                    return False, last_error_msg
+                
+                # Write to a sibling .part file and atomically move it into place, so an
+                # interrupted write never leaves a truncated PNG at output_path
+                partial_path = output_path.with_name(output_path.name + ".part")
+                with open(partial_path, 'wb') as f:
+                    f.write(image_data)
+                os.replace(partial_path, output_path)
+                
+                if attempt > 1:
+                    self._log_debug(f"PlantUML diagram rendered successfully on attempt {attempt}")
+                self._log_debug(f"PlantUML diagram rendered successfully to: {output_path}")
+                return True, ""
+                    
+            except Exception as e:
+                # Handle exception carefully - some PlantUML exceptions don't have proper string representation
+                error_type = type(e).__name__
+                try:
+                    error_details = str(e)
+                except:
+                    error_details = "Unknown error (exception string conversion failed)"
+                last_error_msg = f"Failed to render PlantUML diagram: {error_type}: {error_details}"
+                
+                # Check if this is a transient network error worth retrying
+                transient_keywords = ["SSL", "SSLError", "ConnectionError", "ConnectionReset", 
+                                      "TimeoutError", "Timeout", "BrokenPipe", "RemoteDisconnected"]
+                is_transient = any(kw.lower() in last_error_msg.lower() for kw in transient_keywords)
+                
+                if is_transient and attempt < max_retries:
+                    wait_time = 2 ** attempt  # 2s, 4s
+                    self._log_warning(f"PlantUML request failed (attempt {attempt}/{max_retries}): {error_type}. Retrying in {wait_time}s...")
+                    time.sleep(wait_time)
+                    # Create a fresh client to discard any broken SSL/connection state
+                    client = plantuml.PlantUML(url=self._plantuml_server)
+                else:
+                    self._log_error(last_error_msg)
+                    return False, last_error_msg
+        
+        # Should not reach here, but just in case
+        return False, last_error_msg
     
-    h4 {
-        font-size: 1.2em;
-        margin-top: 0.7em;
-        margin-bottom: 0.3em;
-        page-break-after: avoid;
-    }
+    async def _render_plantuml_batch(self, jobs: List[tuple], pbar=None,
+                                     concurrency: int = _PLANTUML_CONCURRENCY) -> List[tuple]:
+        """Render (plantuml_code, output_path, fit_scale) jobs concurrently against the PlantUML server.
+        
+        Up to ``concurrency`` requests run at once in the default executor, each with its
+        own client. Each rendered image is then fitted to the page (fit_scale percent of page
+        width, or not at all when fit_scale is None). Returns one (success, error_msg) tuple per job.
+        """
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(concurrency)
+        
+        async def render(plantuml_code: str, output_path: Path, fit_scale: Optional[float]) -> tuple:
+            async with limit:
+                client = plantuml.PlantUML(url=self._plantuml_server)
+                result = await loop.run_in_executor(
+                    None, self._render_plantuml_diagram, plantuml_code, output_path, 3, client
+                )
+            if pbar is not None:
+                pbar.update(1)
+            if result[0] and fit_scale is not None:
+                await loop.run_in_executor(None, self._fit_diagram_to_page, output_path, fit_scale)
+            return result
+        
+        return await asyncio.gather(*(render(*job) for job in jobs))
     
-    h5 {
-        font-size: 1.1em;
-        margin-top: 0.6em;
-        margin-bottom: 0.3em;
-        page-break-after: avoid;
-    }
+    def _pandoc_via_server(self, text: str, to: str, options: Dict[str, Any], extra_files: Optional[List[Path]] = None) -> Optional[bytes]:
+        """Convert markdown text with the configured `pandoc server` and return the output bytes.
+        
+        The server never reads the filesystem, so local images referenced by the text (and any
+        extra_files, e.g. stylesheets) are sent base64-encoded in the request's "files" map.
+        Returns None on any failure so the caller can fall back to the pandoc subprocess.
+        """
+        files: Dict[str, str] = {}
+        refs = [match.group('html_src') or match.group('md_src') for match in _IMAGE_REF_PATTERN.finditer(text)]
+        refs.extend(str(path) for path in extra_files or [])
+        for ref in refs:
+            if ref in files or ref.startswith('http') or ref.startswith('data:'):
+                continue
+            try:
+                files[ref] = base64.b64encode(Path(ref).read_bytes()).decode('ascii')
+            except OSError:
+                continue
+        
+        payload = {"text": text, "from": "markdown", "to": to, "files": files, **options}
+        request = urllib.request.Request(
+            self._pandoc_server,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                result = json.loads(response.read().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            self._log_warning(f"pandoc server request failed ({e}); falling back to pandoc subprocess")
+            return None
+        
+        if "error" in result or "output" not in result:
+            self._log_warning(f"pandoc server conversion failed ({result.get('error', 'no output')}); falling back to pandoc subprocess")
+            return None
+        for message in result.get("messages", []):
+            self._log_debug(f"pandoc server: {message}")
+        
+        output = result["output"]
+        return base64.b64decode(output) if result.get("base64") else output.encode('utf-8')
     
-    h6 {
-        font-size: 1.05em;
-        margin-top: 0.5em;
-        margin-bottom: 0.3em;
-        page-break-after: avoid;
-    }
+    def _contains_marker(self, content: str, marker: str) -> bool:
+        """Case-insensitive substring test for a lowercase marker.
+        
+        The exact-case search is tried first so the usual spelling never pays for lowercasing.
+        """
+        return marker in content or marker in content.lower()
+    
+    def _diagram_img_tag(self, image_path: Path, target_scale: float, skip_resize: bool) -> str:
+        """Build the markdown/HTML image reference for a rendered diagram."""
+        if target_scale != 100.0 and not skip_resize:
+            return f'<img src="{image_path}" style="max-width:{target_scale}%" />'
+        return f"![]({image_path})"
+    
+    def _substitute_matches(self, content: str, matches: list, replacements: List[str]) -> str:
+        """Replace each regex match span in content with its replacement, in a single pass."""
+        parts = []
+        last_end = 0
+        for match, replacement in zip(matches, replacements):
+            parts.append(content[last_end:match.start()])
+            parts.append(replacement)
+            last_end = match.end()
+        parts.append(content[last_end:])
+        return "".join(parts)
+    
+    def _diagram_blocks(self, content: str, kind: str) -> List[tuple]:
+        """Find the ``kind`` ("mermaid" or "plantuml") code blocks in content.
+        
+        Returns one (match, code, skip_resize, target_scale) tuple per block, in document order.
+        """
+        blocks = []
+        for match in _DIAGRAM_PATTERNS[kind].finditer(content):
+            no_resize_modifier = match.group(1)  # "no-resize" or None
+            scale_percent = match.group(2)  # percentage digits or None
+            
+            # Determine resize behavior
+            skip_resize = no_resize_modifier is not None
+            target_scale = 100.0  # Default: fill page width
+            if scale_percent:
+                percent_value = float(scale_percent)
+                if percent_value > 0:
+                    target_scale = percent_value
+                else:
+                    self._log_warning(f"Scale percentage must be greater than 0%, got {scale_percent}%. Using default (100%).")
+            
+            blocks.append((match, match.group(3), skip_resize, target_scale))
+        return blocks
     
-    p {
-        margin: 0.6em 0;
-        text-indent: 0;
-    }
+    def _diagram_cache_path(self, kind: str, code: str, skip_resize: bool, target_scale: float,
+                            renderer_id: Optional[tuple] = None) -> Path:
+        """Content-addressed image path for a diagram, shared by every file and worker.
+        
+        The key also covers the renderer (the configured one unless renderer_id names another)
+        and the settings that shape the fitted image, so a temp dir kept with --no-cleanup is
+        never reused across renderers or page settings.
+        """
+        if renderer_id is None:
+            renderer_id = self._diagram_renderer_ids.get(kind)
+        key = repr((kind, code.strip(), skip_resize, target_scale, self.style_profile,
+                    self.page_margins, self.diagram_width, self.diagram_height, renderer_id))
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        return self.temp_dir / "diagrams" / f"{kind}_{digest}.png"
+    
+    def _diagram_staging_path(self, image_path: Path) -> Path:
+        """Process-unique path a diagram is rendered and fitted under before moving into the cache."""
+        return image_path.with_name(f"{image_path.stem}.{os.getpid()}.png")
+    
+    def _replace_diagrams_with_images(self, content: str, kind: str, filename: str = "") -> str:
+        """Replace ``kind`` code blocks with references to rendered images.
+        
+        Images live in the content-addressed diagram cache: diagrams already rendered (by an
+        earlier block, another file, or the up-front PlantUML pass) are reused, and only the
+        missing ones are rendered, as one batch on the event-loop thread.
+        """
+        blocks = self._diagram_blocks(content, kind)
+        if not blocks:
+            return content
+        
+        label = "Mermaid" if kind == "mermaid" else "PlantUML"
+        image_paths: List[Path] = []
+        render_jobs: List[tuple] = []  # (index, code, staging_path, image_path, skip_resize)
+        pending = set()
+        
+        for i, (_, code, skip_resize, target_scale) in enumerate(blocks):
+            image_path = self._diagram_cache_path(kind, code, skip_resize, target_scale)
+            image_paths.append(image_path)
+            if image_path in pending or image_path.exists():
+                self._log_debug(f"{label} diagram {i} already rendered, reusing {image_path}")
+                continue
+            pending.add(image_path)
+            
+            modifier_info = ""
+            if skip_resize:
+                modifier_info = " (no-resize)"
+            elif target_scale != 100.0:
+                modifier_info = f" (scale:{target_scale}%)"
+            self._log_debug(f"Rendering {label} diagram {i} to: {image_path}{modifier_info}")
+            render_jobs.append((i, code, self._diagram_staging_path(image_path), image_path, skip_resize, target_scale))
+        
+        if render_jobs:
+            (self.temp_dir / "diagrams").mkdir(parents=True, exist_ok=True)
+            render_batch = self._render_mermaid_batch if kind == "mermaid" else self._render_plantuml_batch
+            desc = f"  {filename} - {label}" if filename else f"  {label} diagrams"
+            with tqdm(total=len(render_jobs), desc=desc, unit="diagram", leave=False,
+                      disable=not self.show_inner_progress) as pbar:
+                # Diagrams are fitted to page width (or a scaled fraction of it) unless marked no-resize
+                results = self._run_async(render_batch(
+                    [(code, staging_path, None if skip_resize else target_scale)
+                     for _, code, staging_path, _, skip_resize, target_scale in render_jobs],
+                    pbar
+                ))
+            
+            published: Dict[Path, Path] = {}
+            for (i, code, staging_path, image_path, skip_resize, target_scale), (success, error_msg, *renderer) in zip(render_jobs, results):
+                if not success:
+                    raise RuntimeError(f"{label} diagram {i} failed to render: {error_msg}")
+                if renderer and renderer[0] != self._diagram_renderer_ids.get(kind):
+                    # A fallback renderer drew it; file it under that renderer's key instead
+                    published[image_path] = self._diagram_cache_path(kind, code, skip_resize, target_scale, renderer[0])
+                    image_path = published[image_path]
+                # Published only once fitted, so other workers never pick up a half-processed image
+                os.replace(staging_path, image_path)
+                if skip_resize:
+                    self._log_debug(f"Skipped resize for {label} diagram {i} due to no-resize modifier")
+                self._log_debug(f"{label} diagram rendered successfully, using path: {image_path}")
+        
+            image_paths = [published.get(image_path, image_path) for image_path in image_paths]
+        
+        img_tags = [self._diagram_img_tag(image_path, target_scale, skip_resize)
+                    for image_path, (_, _, skip_resize, target_scale) in zip(image_paths, blocks)]
+        return self._substitute_matches(content, [block[0] for block in blocks], img_tags)
+    
+    def _replace_mermaid_with_images(self, content: str, filename: str = "") -> str:
+        """Replace Mermaid code blocks with image references.
+        
+        Supports HTML comment modifiers on line above diagram:
+        <!-- no-resize -->
+        ```mermaid
+        graph TD
+            A --> B
+        ```
+        
+        <!-- scale:150% -->
+        ```mermaid
+        graph TD
+            A --> B
+        ```
+        """
+        # Cheap substring check first: most documents have no diagrams at all
+        if not self._contains_marker(content, "```mermaid"):
+            return content
+        return self._replace_diagrams_with_images(content, "mermaid", filename)
     
-    /* Code blocks optimized for e-ink */
-    pre {
-        background-color: #f5f5f5;
-        border: 1px solid #ddd;
-        border-radius: 3px;
-        padding: 0.8em;
-        margin: 1em 0;
-        font-size: 11px;
-        line-height: 1.4;
-        overflow-x: auto;
-        page-break-inside: avoid;
-    }
+    def _replace_plantuml_with_images(self, content: str, filename: str = "") -> str:
+        """Replace PlantUML code blocks with image references.
+        
+        Supports HTML comment modifiers on line above diagram:
+        <!-- no-resize -->
+        ```plantuml
+        @startuml
+        A -> B
+        @enduml
+        ```
+        
+        <!-- scale:150% -->
+        ```plantuml
+        @startuml
+        A -> B
+        @enduml
+        ```
+        """
+        # Cheap substring check first: most documents have no diagrams at all
+        if not self._contains_marker(content, "```plantuml"):
+            return content
+        return self._replace_diagrams_with_images(content, "plantuml", filename)
     
-    code {
-        background-color: #f5f5f5;
-        border: 1px solid #ddd;
-        border-radius: 2px;
-        padding: 0.2em 0.4em;
-        font-size: 11px;
-        font-family: "Courier New", "Monaco", monospace;
-    }
+    def _pre_render_plantuml_diagrams(self, md_files: List[Path], md_hashes: Dict[Path, Optional[str]]) -> None:
+        """Render the PlantUML diagrams of every file about to be converted into the diagram cache.
+        
+        Diagrams are independent server round trips, so the whole batch is requested with more
+        parallelism than one file's conversion uses; the per-file step then only substitutes
+        references. Failures are left to the per-file step, which retries and reports them.
+        """
+        jobs: Dict[Path, tuple] = {}
+        for md_file in md_files:
+            # Files whose markdown is unchanged are most likely skipped; anything missed here
+            # is still rendered by the per-file step
+            state = self.state_manager.get_document_state(md_file.name)
+            if not self.force_regenerate and state and state['markdown_hash'] == self._state_hash(md_hashes.get(md_file)):
+                continue
+            try:
+                content = md_file.read_text(encoding='utf-8')
+            except (OSError, UnicodeDecodeError):
+                continue
+            if not self._contains_marker(content, "```plantuml"):
+                continue
+            for _, code, skip_resize, target_scale in self._diagram_blocks(content, "plantuml"):
+                image_path = self._diagram_cache_path("plantuml", code, skip_resize, target_scale)
+                if image_path not in jobs and not image_path.exists():
+                    jobs[image_path] = (code, self._diagram_staging_path(image_path), None if skip_resize else target_scale)
+        
+        if not jobs:
+            return
+        
+        self._log_info(f"Pre-rendering {len(jobs)} PlantUML diagram(s) across all files")
+        (self.temp_dir / "diagrams").mkdir(parents=True, exist_ok=True)
+        with tqdm(total=len(jobs), desc="PlantUML diagrams", unit="diagram", leave=False) as pbar:
+            results = self._run_async(self._render_plantuml_batch(
+                list(jobs.values()), pbar, _PLANTUML_PRERENDER_CONCURRENCY
+            ))
+        for (image_path, (_, staging_path, _)), (success, _) in zip(jobs.items(), results):
+            if success:
+                os.replace(staging_path, image_path)
     
-    /* Tables optimized for 6.8" screen */
-    table {
-        width: 100%;
-        border-collapse: collapse;
-        margin: 1em 0;
-        font-size: 12px;
-        page-break-inside: avoid;
-    }
+    def _page_break_replacement(self) -> str:
+        """Return what every page break marker is rewritten to."""
+        # For ebook formats page breaks don't make sense and are removed; PDF keeps them as divs
+        return '' if self.output_format in ["epub", "mobi"] else _PAGE_BREAK_DIV
     
-    th, td {
-        border: 1px solid #ddd;
-        padding: 0.4em 0.6em;
-        text-align: left;
-        vertical-align: top;
-    }
+    def _process_page_breaks(self, content: str) -> str:
+        """Process page break markers in markdown content."""
+        # Every supported marker contains "page-break"; skip the regex passes when none is present
+        if not self._contains_marker(content, "page-break"):
+            return content
+        
+        # One pass handles every marker form (see _PAGE_BREAK_PATTERN for the list)
+        content = _PAGE_BREAK_PATTERN.sub(self._page_break_replacement(), content)
+        
+        return content
     
-    th {
-        background-color: #f8f8f8;
-        font-weight: bold;
-    }
+    def _filter_sections_for_print(self, content: str) -> str:
+        """Filter out sections that should be ignored for print profiles."""
+        import re
+        
+        # For print profiles, remove Table of contents sections
+        if self.style_profile in ["a4-print", "a4-screen"]:
+            # Pattern to match "## Table of contents" or "### Table of contents" heading and everything until the next heading
+            toc_pattern = r'^#{2,3}\s+Table\s+of\s+contents\s*$.*?(?=^#{1,3}\s|\Z)'
+            
+            # Every match contains "contents"; skip the section scan when it is absent
+            if self._contains_marker(content, "contents"):
+                # Use MULTILINE and DOTALL flags to match across lines
+                filtered_content = re.sub(toc_pattern, '', content, flags=re.MULTILINE | re.DOTALL | re.IGNORECASE)
+            else:
+                filtered_content = content
+            
+            # Clean up any extra whitespace that might be left
+            filtered_content = re.sub(r'\n\s*\n\s*\n', '\n\n', filtered_content)
+            
+            # Log the filtering action
+            if filtered_content != content:
+                self._log_debug("Filtered out 'Table of contents' section for print profile")
+            
+            return filtered_content
+        
+        return content
     
-    /* Images optimized for 300ppi */
-    img {
-        max-width: 100%;
-        height: auto;
-        display: block;
-        margin: 1em auto;
-        page-break-inside: avoid;
-    }
+    def _process_and_embed_images(self, content: str, md_file: Path, page_breaks: bool = False) -> str:
+        """Process and embed referenced images into the temp directory.
+        
+        Markdown and HTML image references are handled in a single pass; each distinct
+        reference is resolved once and each source asset is copied at most once. With
+        page_breaks=True the same pass also rewrites page break markers (replacing a
+        separate _process_page_breaks scan).
+        """
+        md_dir = md_file.parent
+        resolved: Dict[str, Optional[str]] = {}  # reference as written -> replacement path (None = keep)
+        embedded: Dict[Path, Path] = {}  # source asset -> copy in temp dir
+        md_dir_names = None  # file names in md_dir, listed once on first use
+        
+        def image_exists(full_img_path: Path) -> bool:
+            # Images next to the note are checked against one directory listing instead of a stat each
+            nonlocal md_dir_names
+            if full_img_path.parent != md_dir:
+                return full_img_path.exists()
+            if md_dir_names is None:
+                try:
+                    with os.scandir(md_dir) as entries:
+                        md_dir_names = {entry.name for entry in entries}
+                except OSError:
+                    return full_img_path.exists()
+            return full_img_path.name in md_dir_names
+        
+        page_break = self._page_break_replacement()
+        
+        def replace_reference(match) -> str:
+            if match.lastgroup == 'page_break':
+                return page_break
+            is_html = match.lastgroup == 'html'
+            img_path = match.group('html_src') if is_html else match.group('md_src')
+            if img_path not in resolved:
+                label = "HTML image" if is_html else "image"
+                resolved[img_path] = self._resolve_image_reference(img_path, md_dir, embedded, label, image_exists)
+            new_path = resolved[img_path]
+            if new_path is None:
+                return match.group(0)
+            if is_html:
+                return match.group(0).replace(img_path, new_path)
+            return f"![{match.group('alt')}]({new_path})"
+        
+        if page_breaks and self._contains_marker(content, "page-break"):
+            return _PAGE_BREAK_OR_IMAGE_PATTERN.sub(replace_reference, content)
+        return _IMAGE_REF_PATTERN.sub(replace_reference, content)
+    
+    def _link_or_copy(self, src: Path, dst: Path) -> None:
+        """Place src at dst as a hardlink (no bytes copied), falling back to a copy.
+        
+        Embedded assets are only read from the temp dir, never modified, so sharing the inode is safe.
+        The link or copy is made under a process-unique name and then moved over dst, so another
+        worker reading dst never finds it missing or half-copied.
+        """
+        try:
+            if os.path.samefile(src, dst):
+                return  # Already linked by an earlier file or run
+        except OSError:
+            pass  # dst does not exist yet
+        staging_path = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+        staging_path.unlink(missing_ok=True)  # Left over from an interrupted run
+        try:
+            os.link(src, staging_path)
+        except OSError:
+            # Cross-device temp dir or filesystem without hardlink support
+            shutil.copy2(src, staging_path)
+        os.replace(staging_path, dst)
+    
+    def _resolve_image_reference(self, img_path: str, md_dir: Path, embedded: Dict[Path, Path], label: str,
+                                 image_exists=None) -> Optional[str]:
+        """Resolve one image reference to the path pandoc should see, copying local assets to temp.
+        
+        image_exists optionally replaces Path.exists() for local assets.
+        Returns None when the reference should be left untouched (URLs, data URIs, missing files).
+        """
+        # Skip if it's already a temp file or absolute URL
+        if img_path.startswith('http') or img_path.startswith('data:'):
+            return None
+        
+        # Check if this is a diagram generated by our script (Mermaid or PlantUML)
+        if img_path.startswith('temp/') or img_path.startswith('temp\\'):
+            # Convert relative temp path to absolute path for pandoc
+            abs_img_path = self.temp_dir / img_path.replace('temp/', '').replace('temp\\', '')
+            if abs_img_path.exists():
+                self._log_debug(f"Converted temp image path to absolute: {img_path} -> {abs_img_path}")
+                return str(abs_img_path)
+            self._log_warning(f"Temp image not found: {abs_img_path}")
+            return None
+        
+        # Resolve relative path from markdown file location
+        if not os.path.isabs(img_path):
+            full_img_path = md_dir / img_path
+        else:
+            full_img_path = Path(img_path)
+        
+        if not (image_exists(full_img_path) if image_exists else full_img_path.exists()):
+            self._log_warning(f"{label[0].upper()}{label[1:]} not found: {full_img_path}")
+            return None
+        
+        temp_img_path = embedded.get(full_img_path)
+        if temp_img_path is None:
+            # Copy image to temp directory
+            temp_img_name = f"embedded_{full_img_path.stem}_{full_img_path.suffix}"
+            temp_img_path = self.temp_dir / temp_img_name
+            try:
+                self._link_or_copy(full_img_path, temp_img_path)
+            except Exception as e:
+                self._log_warning(f"Failed to embed {label} {img_path}: {e}")
+                return None
+            embedded[full_img_path] = temp_img_path
+            self._log_debug(f"Embedded {label}: {img_path} -> {temp_img_name}")
+        
+        return str(temp_img_path)
     
-    /* Lists with better spacing */
-    ul, ol {
-        margin: 0.8em 0;
-        padding-left: 1.5em;
-    }
+    def _extract_title(self, md_file: Path, content: str) -> str:
+        """Extract the document title from markdown content."""
+        # Titles live at the top of a note; only scan the head of the document
+        head = content[:_TITLE_SCAN_CHARS]
+
+        # 1) ATX H1: lines that start with '# ' but not '## '
+        match = _ATX_H1_PATTERN.search(head)
+        if match:
+            return match.group('title').strip()
+
+        # 2) Setext H1: a non-blank line followed by a line of '='
+        match = _SETEXT_H1_PATTERN.search(head)
+        if match:
+            return match.group('title').strip()
+
+        # 3) Fallback to humanized filename stem
+        stem = md_file.stem.replace('_', ' ').replace('-', ' ').strip()
+        return stem.title() if stem else md_file.stem
     
-    li {
-        margin: 0.3em 0;
-        line-height: 1.5;
-    }
+    def _build_css_template(self) -> string.Template:
+        """Pre-fill the page stylesheet with the active style profile's font sizes.
+        
+        Returns a template that only needs the page margins.
+        """
+        profile = self.STYLE_PROFILES[self.style_profile]
+        font_scale = profile["font_scale"]
+        
+        return string.Template(_PAGE_CSS_TEMPLATE.safe_substitute(
+            base_font_size=profile["base_font_size"],
+            h1_size=f"{1.6 * font_scale:.1f}",
+            h2_size=f"{1.3 * font_scale:.1f}",
+            h3_size=f"{1.1 * font_scale:.1f}",
+            h4_size=f"{1.0 * font_scale:.1f}",
+            h5_size=f"{0.9 * font_scale:.1f}",
+            small_size=f"{0.8 * font_scale:.1f}",
+        ))
+    
+    def _page_css(self, margins: Dict[str, str]) -> str:
+        """Return the complete page stylesheet for the given margins (cached per margin set)."""
+        key = (margins['top'], margins['right'], margins['bottom'], margins['left'])
+        css = self._page_css_cache.get(key)
+        if css is None:
+            # Convert margins to cm for CSS
+            top_cm, right_cm, bottom_cm, left_cm = self._margins_cm(margins)
+            
+            # Max image height: 80% of content area to leave room for headings/text
+            img_max_height_cm = 29.7 - top_cm - bottom_cm
+            
+            css = self._css_template.substitute(
+                top_cm=top_cm,
+                right_cm=right_cm,
+                bottom_cm=bottom_cm,
+                left_cm=left_cm,
+                img_max_height_cm=f"{img_max_height_cm:.2f}",
+            )
+            self._page_css_cache[key] = css
+        return css
     
-    /* Blockquotes */
-    blockquote {
-        border-left: 3px solid #ccc;
-        margin: 1em 0;
-        padding: 0.5em 1em;
-        background-color: #f9f9f9;
-        font-style: italic;
-    }
+    def _stylesheet_path(self, margins: Dict[str, str]) -> Path:
+        """Write the page stylesheet for (profile, margins) to the temp dir once and return its path.
+        
+        Every document with the same profile and margins links the same file, so Chromium
+        parses it once per browser instead of once per document.
+        """
+        margins_key = "_".join(margins[side] for side in ('top', 'right', 'bottom', 'left'))
+        css_path = (self.temp_dir / f"style_{self.style_profile}_{margins_key}.css").absolute()
+        if not css_path.exists():
+            # Write atomically: parallel workers may create the same stylesheet concurrently
+            self.temp_dir.mkdir(parents=True, exist_ok=True)
+            partial_path = css_path.with_name(f"{css_path.name}.{os.getpid()}.part")
+            partial_path.write_text(self._page_css(margins), encoding='utf-8')
+            os.replace(partial_path, css_path)
+        return css_path
+    
+    def _create_html_template(self, content: str, margins: Dict[str, str], title: str, inline_css: bool = False) -> str:
+        """Create HTML template with proper styling, margins, and document title.
+        
+        By default the page links the shared stylesheet file in the temp dir; pass
+        inline_css=True for standalone HTML that is saved to the output directory.
+        """
+        if inline_css:
+            stylesheet = f"<style>\n{self._page_css(margins)}    </style>"
+        else:
+            stylesheet = f'<link rel="stylesheet" href="{self._stylesheet_path(margins).as_uri()}">'
+        
+        return _HTML_TEMPLATE.substitute(
+            title=html.escape(title),
+            stylesheet=stylesheet,
+            content=content,
+        )
     
-    /* Links */
-    a {
-        color: #0066cc;
-        text-decoration: none;
-    }
+    async def _convert_html_to_pdf(self, html_content: str, output_pdf: Path, margins: Dict[str, str]) -> bool:
+        """Convert HTML to PDF using Playwright (Puppeteer approach).
+        
+        The HTML is handed to the page directly (no intermediate file); images are
+        already inlined by pandoc's --self-contained output and the stylesheet is a
+        shared file:// link.
+        Retries once with a fresh browser if the browser process crashes mid-conversion.
+        """
+        max_attempts = 2
+        
+        for attempt in range(1, max_attempts + 1):
+            try:
+                # Reuse browser instance and its PDF page
+                page = await self._get_pdf_page()
+                
+                # Load HTML and wait for content to settle
+                await page.set_content(html_content, wait_until='networkidle')
+                
+                # Convert margins to cm for PDF generation
+                top_cm, right_cm, bottom_cm, left_cm = self._margins_cm(margins)
+                
+                # Generate PDF with precise A4 settings
+                await page.pdf(
+                    path=str(output_pdf),
+                    format='A4',
+                    width='210mm',
+                    height='297mm',
+                    margin={
+                        'top': f'{top_cm}cm',
+                        'right': f'{right_cm}cm',
+                        'bottom': f'{bottom_cm}cm',
+                        'left': f'{left_cm}cm'
+                    },
+                    print_background=True,
+                    prefer_css_page_size=True,
+                    display_header_footer=False,
+                    scale=1.0
+                )
+                
+                return True
+                
+            except Exception as e:
+                error_msg = str(e)
+                is_crash = any(kw in error_msg for kw in [
+                    "Connection closed", "Browser has been closed", "Target closed",
+                    "crashed", "Protocol error"
+                ])
+                
+                if is_crash and attempt < max_attempts:
+                    self._log_warning(f"Browser crashed during PDF generation, restarting and retrying...")
+                    # Force-reset browser state so _ensure_browser creates a fresh one
+                    await self._close_browser()
+                else:
+                    self._log_error(f"Failed to convert HTML to PDF: {e}")
+                    return False
+        
+        return False
     
-    a:visited {
-        color: #663399;
-    }
+    def _prepare_processed_markdown(self, md_file: Path, content: Optional[str], pbar) -> str:
+        """Run the shared markdown pipeline (filter, diagrams, page breaks, images) for EPUB/MOBI.
+        
+        content is the already-read markdown text; the file is only read when it is not supplied.
+        Advances pbar by four steps.
+        """
+        filename = md_file.name
+        
+        # Step 1: Read markdown content (unless the caller already has it)
+        pbar.set_description(f"  {filename} - Reading")
+        if content is None:
+            content = md_file.read_text(encoding='utf-8')
+        pbar.update(1)
+        
+        # Step 2: Process content
+        pbar.set_description(f"  {filename} - Processing")
+        processed_content = self._filter_sections_for_print(content)
+        pbar.update(1)
+        
+        # Step 3: Process diagrams
+        pbar.set_description(f"  {filename} - Diagrams")
+        processed_content = self._replace_mermaid_with_images(processed_content, filename)
+        # Close the Mermaid page to free its memory before PlantUML steps
+        self._run_async(self._close_diagram_page())
+        processed_content = self._replace_plantuml_with_images(processed_content, filename)
+        pbar.update(1)
+        
+        # Step 4: Process page breaks and images
+        pbar.set_description(f"  {filename} - Images")
+        # Page breaks and image references are rewritten in a single scan
+        processed_content = self._process_and_embed_images(processed_content, md_file, page_breaks=True)
+        pbar.update(1)
+        
+        return processed_content
     
-    /* Page breaks */
-    .page-break {
-        page-break-before: always;
-    }
+    def _markdown_to_html_body(self, processed_content: str, embed_resources: bool = True) -> Optional[str]:
+        """Convert processed markdown to the HTML <body> content with Pandoc.
+        
+        With embed_resources, images are inlined as data URIs (PDF pipeline); without it their
+        paths are left as written so the EPUB backend can package them. Returns None on failure.
+        """
+        html_output = None
+        if self._pandoc_server:
+            options = {"standalone": True, "embed-resources": True} if embed_resources else {}
+            html_output = self._pandoc_via_server(processed_content, "html", options)
+        
+        if html_output is not None:
+            html_content = html_output.decode('utf-8')
+        else:
+            # Markdown goes in on stdin and HTML comes back on stdout: no temp files
+            cmd = ["pandoc", "--from", "markdown", "--to", "html"]
+            if embed_resources:
+                cmd.extend(["--standalone", "--self-contained", "--css", "data:text/css,"])
+            
+            result = subprocess.run(cmd, input=processed_content, capture_output=True, encoding='utf-8')
+            if result.returncode != 0:
+                self._log_error(f"Pandoc failed: {result.stderr}")
+                return None
+            html_content = result.stdout
+        
+        # Strip pandoc's HTML wrapper so we only inject <body> content
+        # into our own template (avoids invalid nested <html> documents)
+        body_match = re.search(r'<body[^>]*>(.*)</body>', html_content, re.DOTALL | re.IGNORECASE)
+        if body_match:
+            html_content = body_match.group(1)
+        return html_content
+    
+    def _emit_epub_with_ebooklib(self, processed_content: str, title: str, output_epub: Path) -> bool:
+        """Assemble the EPUB in-process with ebooklib from pandoc's HTML (no pandoc EPUB writer)."""
+        try:
+            from ebooklib import epub
+            
+            body = self._markdown_to_html_body(processed_content, embed_resources=False)
+            if body is None:
+                return False
+            
+            book = epub.EpubBook()
+            book.set_identifier(f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, output_epub.name)}")
+            book.set_title(title)
+            book.set_language(self.language)
+            book.add_author(self.author)
+            
+            # Package local images (diagrams and embedded assets in temp) and point the XHTML at them
+            packaged: Dict[str, str] = {}
+            
+            def package_image(match) -> str:
+                src = html.unescape(match.group(2))
+                if src not in packaged:
+                    image_path = Path(src)
+                    if src.startswith(('http', 'data:')) or not image_path.is_file():
+                        return match.group(0)
+                    file_name = f"images/img{len(packaged)}{image_path.suffix.lower()}"
+                    media_type = mimetypes.guess_type(image_path.name)[0] or "application/octet-stream"
+                    book.add_item(epub.EpubImage(uid=f"img{len(packaged)}", file_name=file_name,
+                                                 media_type=media_type, content=image_path.read_bytes()))
+                    packaged[src] = file_name
+                return f'{match.group(1)}"{packaged[src]}"'
+            
+            body = re.sub(r'(<img\b[^>]*?\ssrc=)"([^"]*)"', package_image, body)
+            
+            chapter = epub.EpubHtml(title=title, file_name="ch1.xhtml", lang=self.language)
+            chapter.content = f"<html><head><title>{html.escape(title)}</title></head><body>{body}</body></html>"
+            if self.style_profile == "kindle-paperwhite-11":
+                style = epub.EpubItem(uid="style", file_name="style.css", media_type="text/css",
+                                      content=_PAPERWHITE_CSS_MIN)
+                book.add_item(style)
+                chapter.add_item(style)
+            book.add_item(chapter)
+            
+            # Same navigation depth as pandoc's --toc-depth=3
+            toc = [
+                epub.Link(f"ch1.xhtml#{heading_id}", html.unescape(re.sub(r'<[^>]+>', '', text)).strip(), heading_id)
+                for heading_id, text in re.findall(r'<h[1-3]\b[^>]*\bid="([^"]+)"[^>]*>(.*?)</h[1-3]>', body, re.DOTALL)
+            ]
+            book.toc = toc or [chapter]
+            book.add_item(epub.EpubNcx())
+            book.add_item(epub.EpubNav())
+            book.spine = ["nav", chapter]
+            
+            epub.write_epub(str(output_epub), book)
+            return True
+        except Exception as e:
+            self._log_warning(f"ebooklib EPUB assembly failed ({e}); retrying with pandoc")
+            return False
     
-    /* Avoid widows and orphans */
-    p, li {
-        orphans: 2;
-        widows: 2;
-    }
+    def _emit_epub(self, processed_content: str, title: str, output_epub: Path) -> bool:
+        """Write already-processed markdown to an EPUB (ebooklib when configured, else Pandoc)."""
+        if self._epub_backend == "ebooklib" and self._emit_epub_with_ebooklib(processed_content, title, output_epub):
+            return True
+        
+        try:
+            css_file = None
+            if self.style_profile == "kindle-paperwhite-11":
+                css_file = self._create_paperwhite_css()
+            
+            epub_output = None
+            if self._pandoc_server:
+                options = {
+                    "standalone": True,
+                    "table-of-contents": True,
+                    "toc-depth": 3,
+                    "metadata": {"title": title, "author": self.author, "language": self.language},
+                }
+                if css_file:
+                    options["css"] = [str(css_file)]
+                epub_output = self._pandoc_via_server(
+                    processed_content, "epub", options, [css_file] if css_file else None
+                )
+            
+            if epub_output is not None:
+                output_epub.write_bytes(epub_output)
+            else:
+                # Markdown goes in on stdin: no temp copy of the document is written
+                cmd = ["pandoc", "-", "--from", "markdown", "-o", str(output_epub), f"--metadata=title:{title}", *self._pandoc_epub_args]
+                if css_file:
+                    cmd.extend(["--css", str(css_file)])
+                
+                result = subprocess.run(cmd, input=processed_content, capture_output=True, encoding='utf-8')
+                if result.returncode != 0:
+                    self._log_error(f"Pandoc EPUB conversion failed: {result.stderr}")
+                    return False
+            
+            return True
+            
+        except Exception as e:
+            self._log_error(f"Failed to convert to EPUB: {e}")
+            return False
     
-    /* Chapter breaks */
-    h1, h2 {
-        page-break-before: auto;
-    }
+    def _convert_to_epub(self, md_file: Path, output_epub: Path, title: str, content: Optional[str] = None,
+                         markdown_hash: Optional[str] = None) -> bool:
+        """Convert markdown to EPUB format using Pandoc.
+        
+        content is the already-read markdown text; the file is only read when it is not supplied.
+        Likewise markdown_hash is only recomputed when the caller has not already hashed the file.
+        """
+        try:
+            filename = md_file.name
+            
+            # Create progress bar for EPUB conversion steps
+            with tqdm(total=5, desc=f"  {filename}", unit="step", leave=False,
+                      disable=not self.show_inner_progress) as pbar:
+                processed_content = self._prepare_processed_markdown(md_file, content, pbar)
+                
+                # Step 5: Convert to EPUB
+                pbar.set_description(f"  {filename} - EPUB")
+                if not self._emit_epub(processed_content, title, output_epub):
+                    return False
+                pbar.update(1)
+            
+            # Save document state
+            current_markdown_hash = markdown_hash or calculate_file_hash(md_file)
+            epub_hash = calculate_file_hash(output_epub)
+            self.state_manager.save_document_state(
+                filename, current_markdown_hash, epub_hash, self.style_profile,
+                self.diagram_width, self.diagram_height, None, False
+            )
+            
+            self._log_success(f"Converted {filename} to {output_epub.name}")
+            return True
+            
+        except Exception as e:
+            self._log_error(f"Failed to convert to EPUB: {e}")
+            return False
     
-    /* Ensure headings don't break across pages */
-    h1, h2, h3, h4, h5, h6 {
-        page-break-after: avoid;
-        page-break-inside: avoid;
-    }
-}
-
-/* Fallback styles for other devices */
-h1, h2, h3, h4, h5, h6 {
-    color: #000000;
-    font-weight: bold;
-    page-break-after: avoid;
-}
-
-h1 { font-size: 1.6em; margin: 1em 0 0.5em 0; }
-h2 { font-size: 1.4em; margin: 0.8em 0 0.4em 0; }
-h3 { font-size: 1.2em; margin: 0.7em 0 0.3em 0; }
-h4 { font-size: 1.1em; margin: 0.6em 0 0.3em 0; text-decoration: underline; }
-h5 { font-size: 1.05em; margin: 0.5em 0 0.3em 0; text-decoration: underline; }
-h6 { font-size: 1em; margin: 0.5em 0 0.3em 0; text-decoration: underline; }
-
-p { margin: 0.5em 0; }
-pre { background-color: #f5f5f5; padding: 0.5em; margin: 0.5em 0; }
-code { background-color: #f5f5f5; padding: 0.1em 0.3em; }
-table { border-collapse: collapse; width: 100%; margin: 0.5em 0; }
-th, td { border: 1px solid #ddd; padding: 0.3em; }
-th { background-color: #f8f8f8; }
-img { max-width: 100%; height: auto; display: block; margin: 0.5em auto; }
-ul, ol { margin: 0.5em 0; padding-left: 1.5em; }
-li { margin: 0.2em 0; }
-blockquote { border-left: 3px solid #ccc; margin: 0.5em 0; padding: 0.3em 0.8em; background-color: #f9f9f9; }
-a { color: #0066cc; text-decoration: none; }
-"""
+    def _create_paperwhite_css(self) -> Path:
+        """Create device-specific CSS for Kindle Paperwhite 11th generation.
         
+        The stylesheet is static, so it is written once per converter and the path reused.
+        """
+        css_file = self._paperwhite_css_path
+        if css_file is not None and css_file.exists():
+            return css_file
+        
+        # Write atomically: parallel workers share the temp dir and may create it concurrently
         css_file = self.temp_dir / "kindle_paperwhite_11.css"
-        with open(css_file, 'w', encoding='utf-8') as f:
-            f.write(css_content)
+        partial_path = css_file.with_name(f"{css_file.name}.{os.getpid()}.part")
+        partial_path.write_text(_PAPERWHITE_CSS_MIN, encoding='utf-8')
+        os.replace(partial_path, css_file)
+        self._paperwhite_css_path = css_file
         
         self._log_debug(f"Created Paperwhite 11th gen CSS: {css_file}")
         return css_file
     
+    def _load_calibre_api(self) -> Optional[tuple]:
+        """Import Calibre's conversion pipeline in-process, once per converter.
+        
+        Returns (Plumber, OptionRecommendation, Log) or None when no calibre_lib_dir is
+        configured or the import fails.
+        """
+        if self._calibre_api is None:
+            self._calibre_api = False
+            if self._calibre_lib_dir:
+                if self._calibre_lib_dir not in sys.path:
+                    sys.path.insert(0, self._calibre_lib_dir)
+                try:
+                    from calibre.ebooks.conversion.plumber import Plumber
+                    from calibre.customize.conversion import OptionRecommendation
+                    from calibre.utils.logging import Log
+                    self._calibre_api = (Plumber, OptionRecommendation, Log)
+                    self._log_debug(f"Loaded Calibre conversion pipeline from {self._calibre_lib_dir}")
+                except Exception as e:
+                    self._log_warning(f"Could not load Calibre from {self._calibre_lib_dir} ({e}); using ebook-convert")
+        return self._calibre_api or None
+    
+    def _mobi_file_type(self) -> str:
+        """Calibre's MOBI file type: KF8 only unless legacy MOBI 6 output is requested."""
+        return "both" if self.both_mobi_formats else "new"
+    
+    def _state_hash(self, markdown_hash: Optional[str]) -> Optional[str]:
+        """Hash recorded in the document state for this output.
+        
+        The MOBI file type changes the built file without changing the markdown, so MOBI records
+        carry it alongside the markdown hash and toggling --mobi-both triggers a rebuild.
+        """
+        if markdown_hash is None or self.output_format != "mobi":
+            return markdown_hash
+        return f"{markdown_hash}:{self._mobi_file_type()}"
+    
+    def _convert_epub_to_mobi_in_process(self, epub_file: Path, output_mobi: Path) -> bool:
+        """Convert EPUB to MOBI with Calibre's Plumber, skipping ebook-convert's interpreter startup."""
+        calibre_api = self._load_calibre_api()
+        if calibre_api is None:
+            return False
+        Plumber, OptionRecommendation, Log = calibre_api
+        
+        try:
+            plumber = Plumber(str(epub_file), str(output_mobi), Log(level=Log.WARN))
+            plumber.merge_ui_recommendations([
+                ('mobi_file_type', self._mobi_file_type(), OptionRecommendation.HIGH),
+                ('no_inline_toc', True, OptionRecommendation.HIGH),
+            ])
+            plumber.run()
+            return output_mobi.exists()
+        except Exception as e:
+            self._log_warning(f"In-process Calibre conversion failed ({e}); retrying with ebook-convert")
+            return False
+    
     def _convert_epub_to_mobi(self, epub_file: Path, output_mobi: Path) -> bool:
-        """Convert EPUB to MOBI using Calibre."""
+        """Convert EPUB to MOBI using Calibre (in-process when configured, else ebook-convert)."""
+        if self._calibre_lib_dir and self._convert_epub_to_mobi_in_process(epub_file, output_mobi):
+            return True
+        
         try:
             cmd = [
                 "ebook-convert",
                 str(epub_file),
                 str(output_mobi),
-                "--mobi-file-type", "both",  # Create both old and new MOBI formats
-                "--personal-doc",  # Mark as personal document
+                "--mobi-file-type", self._mobi_file_type(),  # KF8 only unless --mobi-both
                 "--no-inline-toc"  # Don't create inline table of contents
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            # Calibre logs every conversion stage to stdout; only stderr is reported, so the
+            # progress log is discarded rather than buffered in memory
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
             if result.returncode != 0:
                 self._log_error(f"Calibre MOBI conversion failed: {result.stderr}")
                 return False
@@ -1892,14 +2541,16 @@ a { color: #0066cc; text-decoration: none; }
             self._log_error(f"Failed to convert EPUB to MOBI: {e}")
             return False
     
-    def _convert_single_file(self, md_file: Path) -> tuple[str, str]:
+    def _convert_single_file(self, md_file: Path, md_hash: Optional[str] = None) -> tuple[str, str]:
         """Convert a single markdown file to the specified format. Returns (status, filename).
         
-        Status is one of: 'converted', 'skipped', 'failed'.
+        Status is one of: 'converted', 'skipped', 'failed'. md_hash is the markdown hash
+        precomputed by convert_all; the file is hashed here only when it is not supplied.
         """
         try:
             filename = md_file.name
             output_file = self.format_output_dir / f"{md_file.stem}.{self.output_format}"
+            current_markdown_hash = md_hash
             
             # Check if conversion is needed (unless force_regenerate is True)
             if not self.force_regenerate:
@@ -1907,59 +2558,52 @@ a { color: #0066cc; text-decoration: none; }
                 if not output_file.exists():
                     self._log_info(f"Output missing for {filename} - regenerating")
                 else:
-                    current_markdown_hash = calculate_file_hash(md_file)
+                    if current_markdown_hash is None:
+                        current_markdown_hash = calculate_file_hash(md_file)
                     
                     if not self.state_manager.needs_regeneration(
-                        filename, current_markdown_hash, output_file, self.style_profile,
+                        filename, self._state_hash(current_markdown_hash), output_file, self.style_profile,
                         self.diagram_width, self.diagram_height, None, False
                     ):
                         self._log_info(f"Skipping {filename} - {self.output_format.upper()} is up to date")
                         return "skipped", filename
             
             try:
-                if self._convert_md_to_format(md_file, output_file):
+                if self._convert_md_to_format(md_file, output_file, current_markdown_hash):
                     return "converted", filename
                 else:
                     return "failed", filename
             finally:
-                # Clean up browser and event loop resources after processing file
-                tls = self._local
-                if hasattr(tls, 'event_loop') and tls.event_loop:
-                    tls.event_loop.run_until_complete(self._close_browser())
-                    tls.event_loop.close()
-                    tls.event_loop = None
+                # Only the diagram page is dropped; the browser and PDF page are reused for the next file
+                self._run_async(self._close_diagram_page())
                 
         except Exception as e:
             self._log_error(f"Error processing {md_file.name}: {e}")
             return "failed", md_file.name
     
-    def _convert_md_to_format(self, md_file: Path, output_file: Path) -> bool:
-        """Convert markdown file to the specified format."""
+    def _convert_md_to_format(self, md_file: Path, output_file: Path, markdown_hash: Optional[str] = None) -> bool:
+        """Convert markdown file to the specified format.
+        
+        markdown_hash is the hash already computed by the up-to-date check; the file is only hashed when it is not supplied.
+        """
         try:
-            # Create event loop once for entire file processing
-            tls = self._local
-            if not hasattr(tls, 'event_loop') or tls.event_loop is None or tls.event_loop.is_closed():
-                tls.event_loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(tls.event_loop)
-            
-            current_markdown_hash = calculate_file_hash(md_file)
+            current_markdown_hash = markdown_hash or calculate_file_hash(md_file)
             filename = md_file.name
             
             self._log_info(f"Converting {filename} to {self.output_format.upper()} - markdown has changed or file missing")
             
             # Read markdown content
-            with open(md_file, 'r', encoding='utf-8') as f:
-                content = f.read()
+            content = md_file.read_text(encoding='utf-8')
             
             # Extract title
             doc_title = self._extract_title(md_file, content)
             
             if self.output_format == "pdf":
-                return self._convert_to_pdf(md_file, output_file, doc_title)
+                return self._convert_to_pdf(md_file, output_file, doc_title, content, current_markdown_hash)
             elif self.output_format == "epub":
-                return self._convert_to_epub(md_file, output_file, doc_title)
+                return self._convert_to_epub(md_file, output_file, doc_title, content, current_markdown_hash)
             elif self.output_format == "mobi":
-                return self._convert_to_mobi(md_file, output_file, doc_title)
+                return self._convert_to_mobi(md_file, output_file, doc_title, content, current_markdown_hash)
             else:
                 self._log_error(f"Unsupported output format: {self.output_format}")
                 return False
@@ -1968,86 +2612,61 @@ a { color: #0066cc; text-decoration: none; }
             self._log_error(f"Error converting {md_file.name}: {e}")
             return False
     
-    def _convert_to_pdf(self, md_file: Path, output_pdf: Path, title: str) -> bool:
-        """Convert markdown to PDF (reuse existing logic)."""
+    def _convert_to_pdf(self, md_file: Path, output_pdf: Path, title: str, content: Optional[str] = None,
+                        markdown_hash: Optional[str] = None) -> bool:
+        """Convert markdown to PDF (reuse existing logic).
+        
+        content is the already-read markdown text; the file is only read when it is not supplied.
+        Likewise markdown_hash is only recomputed when the caller has not already hashed the file.
+        """
         try:
-            tls = self._local
-            
             # Calculate hashes for state management
-            current_markdown_hash = calculate_file_hash(md_file)
+            current_markdown_hash = markdown_hash or calculate_file_hash(md_file)
             filename = md_file.name
             
             # Create progress bar for this file's conversion steps
-            with tqdm(total=6, desc=f"  {filename}", unit="step", leave=False) as pbar:
-                # Step 1: Read markdown content
+            with tqdm(total=6, desc=f"  {filename}", unit="step", leave=False,
+                      disable=not self.show_inner_progress) as pbar:
+                # Step 1: Read markdown content (unless the caller already has it)
                 pbar.set_description(f"  {filename} - Reading")
-                with open(md_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                if content is None:
+                    content = md_file.read_text(encoding='utf-8')
                 pbar.update(1)
                 
                 # Step 2: Process content
                 pbar.set_description(f"  {filename} - Processing")
                 processed_content = self._filter_sections_for_print(content)
-                file_id = md_file.stem
                 pbar.update(1)
                 
                 # Step 3: Process diagrams
                 pbar.set_description(f"  {filename} - Diagrams")
-                processed_content = self._replace_mermaid_with_images(processed_content, file_id, filename)
-                # Close browser after Mermaid rendering to free memory before PlantUML + PDF steps
-                tls.event_loop.run_until_complete(self._close_browser())
-                processed_content = self._replace_plantuml_with_images(processed_content, file_id, filename)
+                processed_content = self._replace_mermaid_with_images(processed_content, filename)
+                # Close the Mermaid page to free its memory before PlantUML + PDF steps
+                self._run_async(self._close_diagram_page())
+                processed_content = self._replace_plantuml_with_images(processed_content, filename)
                 pbar.update(1)
                 
                 # Step 4: Process page breaks and images
                 pbar.set_description(f"  {filename} - Images")
-                processed_content = self._process_page_breaks(processed_content)
-                processed_content = self._process_and_embed_images(processed_content, md_file)
+                # Page breaks and image references are rewritten in a single scan
+                processed_content = self._process_and_embed_images(processed_content, md_file, page_breaks=True)
                 pbar.update(1)
                 
                 # Step 5: Convert to HTML
                 pbar.set_description(f"  {filename} - HTML")
-                temp_md = self.temp_dir / f"temp_{md_file.name}"
-                with open(temp_md, 'w', encoding='utf-8') as f:
-                    f.write(processed_content)
-                
-                html_file = self.temp_dir / f"{md_file.stem}.html"
-                cmd = [
-                    "pandoc",
-                    str(temp_md),
-                    "-o", str(html_file),
-                    "--standalone",
-                    "--self-contained",
-                    "--css", "data:text/css,",
-                ]
-                
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                if result.returncode != 0:
-                    self._log_error(f"Pandoc failed: {result.stderr}")
+                html_content = self._markdown_to_html_body(processed_content)
+                if html_content is None:
                     return False
                 
-                with open(html_file, 'r', encoding='utf-8') as f:
-                    html_content = f.read()
-                
-                # Strip pandoc's HTML wrapper so we only inject <body> content
-                # into our own template (avoids invalid nested <html> documents)
-                import re as _re
-                body_match = _re.search(r'<body[^>]*>(.*)</body>', html_content, _re.DOTALL | _re.IGNORECASE)
-                if body_match:
-                    html_content = body_match.group(1)
-                
                 margins = self._parse_margins()
                 enhanced_html = self._create_html_template(html_content, margins, title)
-                enhanced_html_file = self.temp_dir / f"enhanced_{md_file.stem}.html"
-                with open(enhanced_html_file, 'w', encoding='utf-8') as f:
-                    f.write(enhanced_html)
                 pbar.update(1)
                 
                 # Step 6: Convert to PDF
                 pbar.set_description(f"  {filename} - PDF")
                 self._log_debug(f"Converting HTML to PDF with margins: {margins}")
-                success = tls.event_loop.run_until_complete(
-                    self._convert_html_to_pdf(enhanced_html_file, output_pdf, margins)
+                success = self._run_async(
+                    self._convert_html_to_pdf(enhanced_html, output_pdf, margins)
                 )
                 pbar.update(1)
             
@@ -2067,32 +2686,35 @@ a { color: #0066cc; text-decoration: none; }
             self._log_error(f"Error converting {md_file.name} to PDF: {e}")
             return False
     
-    def _convert_to_mobi(self, md_file: Path, output_mobi: Path, title: str) -> bool:
-        """Convert markdown to MOBI format."""
+    def _convert_to_mobi(self, md_file: Path, output_mobi: Path, title: str, content: Optional[str] = None,
+                         markdown_hash: Optional[str] = None) -> bool:
+        """Convert markdown to MOBI format (processed once, written to a temp EPUB, then converted by Calibre)."""
         try:
             filename = md_file.name
             
-            # Create progress bar for MOBI conversion (EPUB + Calibre conversion)
-            with tqdm(total=2, desc=f"  {filename}", unit="step", leave=False) as pbar:
-                # Step 1: Convert to EPUB first
+            # Create progress bar for MOBI conversion (shared pipeline, EPUB, Calibre conversion)
+            with tqdm(total=6, desc=f"  {filename}", unit="step", leave=False,
+                      disable=not self.show_inner_progress) as pbar:
+                processed_content = self._prepare_processed_markdown(md_file, content, pbar)
+                
+                # Step 5: Convert to EPUB first
                 pbar.set_description(f"  {filename} - EPUB")
                 epub_file = self.temp_dir / f"{md_file.stem}.epub"
-                
-                if not self._convert_to_epub(md_file, epub_file, title):
+                if not self._emit_epub(processed_content, title, epub_file):
                     return False
                 pbar.update(1)
                 
-                # Step 2: Convert EPUB to MOBI
+                # Step 6: Convert EPUB to MOBI
                 pbar.set_description(f"  {filename} - MOBI")
                 if not self._convert_epub_to_mobi(epub_file, output_mobi):
                     return False
                 pbar.update(1)
             
             # Save document state
-            current_markdown_hash = calculate_file_hash(md_file)
+            current_markdown_hash = markdown_hash or calculate_file_hash(md_file)
             mobi_hash = calculate_file_hash(output_mobi)
             self.state_manager.save_document_state(
-                md_file.name, current_markdown_hash, mobi_hash, self.style_profile,
+                md_file.name, self._state_hash(current_markdown_hash), mobi_hash, self.style_profile,
                 self.diagram_width, self.diagram_height, None, False
             )
             
@@ -2105,6 +2727,11 @@ a { color: #0066cc; text-decoration: none; }
     
     def convert_all(self, cleanup: bool = True, parallel: bool = True) -> None:
         """Convert all markdown files in source directory to the specified format."""
+        # Hashes are only memoized within one run; sources may have changed since the last
+        clear_file_hash_cache()
+        # Read every stored state in one query so the per-file up-to-date checks are dict lookups
+        self.state_manager.load_all()
+        
         md_files = list(self.source_dir.glob("*.md"))
         
         if not md_files:
@@ -2119,12 +2746,29 @@ a { color: #0066cc; text-decoration: none; }
         self._log_info(f"Output directory: {self.format_output_dir.absolute()}")
         self._log_info(f"Found {len(md_files)} markdown files: {[f.name for f in md_files]}")
         
+        # Hashing is I/O bound: read every source once, concurrently, before any conversion starts
+        md_hashes = self._hash_sources(md_files)
+        
+        # Diagram rendering is server-bound and independent across files: do all of it up front
+        self._pre_render_plantuml_diagrams(md_files, md_hashes)
+        
         if parallel and len(md_files) > 1:
             self._log_info(f"Using parallel processing with {self.max_workers} workers")
-            self._convert_all_parallel(md_files, cleanup)
+            self._convert_all_parallel(md_files, cleanup, md_hashes)
         else:
             self._log_info("Using sequential processing")
-            self._convert_all_sequential(md_files, cleanup)
+            self._convert_all_sequential(md_files, cleanup, md_hashes)
+    
+    def _hash_sources(self, md_files: List[Path]) -> Dict[Path, Optional[str]]:
+        """Hash markdown files on a thread pool. Unreadable files map to None (retried per file)."""
+        def hash_or_none(md_file: Path) -> Optional[str]:
+            try:
+                return calculate_file_hash(md_file)
+            except RuntimeError:
+                return None
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(32, len(md_files)))) as pool:
+            return dict(zip(md_files, pool.map(hash_or_none, md_files)))
     
     def _get_constructor_kwargs(self) -> dict:
         """Return the kwargs needed to reconstruct this converter in a worker process."""
@@ -2143,9 +2787,12 @@ a { color: #0066cc; text-decoration: none; }
             'max_diagram_width': self.diagram_width,
             'max_diagram_height': self.diagram_height,
             'force_regenerate': self.force_regenerate,
+            # Workers' nested bars would interleave on the terminal; the parent's file bar is enough
+            'show_inner_progress': False,
+            'both_mobi_formats': self.both_mobi_formats,
         }
     
-    def _convert_all_parallel(self, md_files: List[Path], cleanup: bool) -> None:
+    def _convert_all_parallel(self, md_files: List[Path], cleanup: bool, md_hashes: Optional[Dict[Path, Optional[str]]] = None) -> None:
         """Convert files in parallel using ProcessPoolExecutor.
         
         Each worker runs in its own OS process with a separate Chromium instance,
@@ -2167,7 +2814,10 @@ a { color: #0066cc; text-decoration: none; }
             initargs=(converter_kwargs,)
         ) as executor:
             # Submit all tasks
-            future_to_file = {executor.submit(_ebook_worker_convert_file, md_file): md_file for md_file in md_files}
+            md_hashes = md_hashes or {}
+            future_to_file = {
+                executor.submit(_ebook_worker_convert_file, md_file, md_hashes.get(md_file)): md_file for md_file in md_files
+            }
             
             # Process completed tasks with progress bar
             with tqdm(total=len(md_files), desc="Converting files", unit="file") as pbar:
@@ -2199,7 +2849,7 @@ a { color: #0066cc; text-decoration: none; }
             shutil.rmtree(self.temp_dir, ignore_errors=True)
             self._log_debug(f"Cleaned up temporary directory: {self.temp_dir}")
     
-    def _convert_all_sequential(self, md_files: List[Path], cleanup: bool) -> None:
+    def _convert_all_sequential(self, md_files: List[Path], cleanup: bool, md_hashes: Optional[Dict[Path, Optional[str]]] = None) -> None:
         """Convert files sequentially."""
         success_count = 0
         skipped_count = 0
@@ -2207,7 +2857,7 @@ a { color: #0066cc; text-decoration: none; }
         
         # Use progress bar for sequential conversion
         for md_file in tqdm(md_files, desc="Converting files", unit="file"):
-            status, filename = self._convert_single_file(md_file)
+            status, filename = self._convert_single_file(md_file, (md_hashes or {}).get(md_file))
             if status == "converted":
                 success_count += 1
             elif status == "skipped":
@@ -2215,6 +2865,9 @@ a { color: #0066cc; text-decoration: none; }
             else:
                 failed_count += 1
         
+        # The browser was kept alive across files; shut it down now the batch is done
+        self._run_async(self._close_browser())
+        
         total_processed = success_count + skipped_count + failed_count
         self._log_success(f"Sequential conversion complete: {success_count} files converted, {skipped_count} files skipped, {failed_count} files failed ({total_processed}/{len(md_files)} total)")
         self._log_info(f"{self.output_format.upper()} files saved to: {self.format_output_dir.absolute()}")
@@ -2224,10 +2877,9 @@ a { color: #0066cc; text-decoration: none; }
             self._log_debug(f"Cleaned up temporary directory: {self.temp_dir}")
 
 
-def main():
-    """Main entry point."""
-    import argparse
-    
+@functools.lru_cache(maxsize=1)
+def _build_parser() -> argparse.ArgumentParser:
+    """Build the command-line parser (once per process)."""
     parser = argparse.ArgumentParser(description="Convert markdown files to PDF, EPUB, or MOBI format with Mermaid and PlantUML support")
     parser.add_argument("--source", default=None, help="Source directory (default: from config/env/docs)")
     parser.add_argument("--output-dir", default=None, help="Output directory (default: from config/env/output). Files will be saved in subfolders by format (e.g., output/pdf/, output/mobi/)")
@@ -2246,8 +2898,21 @@ def main():
     parser.add_argument("--max-diagram-width", type=str, default=None, help="Maximum diagram width: pixels (e.g., 1680, only if rendered exceeds) or percentage of rendered size (e.g., 80%%, max 100%%). Default: 1680")
     parser.add_argument("--max-diagram-height", type=str, default=None, help="Maximum diagram height: pixels (e.g., 2240, only if rendered exceeds) or percentage of rendered size (e.g., 80%%, max 100%%). Default: 2240")
     parser.add_argument("--force", action="store_true", help="Force regeneration of all files, bypassing document verification")
-    
-    args = parser.parse_args()
+    parser.add_argument("--mobi-both", action="store_true", help="Include legacy MOBI 6 sections alongside KF8 in MOBI output (slower; only needed for very old Kindles)")
+    return parser
+
+
+def run_from_args(args) -> None:
+    """Run a conversion from parsed arguments.
+    
+    args is the namespace produced by the CLI parser; programmatic callers may pass a
+    types.SimpleNamespace to skip argument parsing entirely. Any option it leaves out takes
+    its CLI default.
+    """
+    # Fill in options the caller left out from the parser's declared defaults, without parsing
+    defaults = {action.dest: action.default for action in _build_parser()._actions
+                if action.default is not argparse.SUPPRESS}
+    args = argparse.Namespace(**{**defaults, **vars(args)})
     
     # Build config from CLI args
     cli_config = {}
@@ -2261,13 +2926,11 @@ def main():
         cli_config["db_path"] = args.db_path
     if args.max_diagram_width:
         # Parse dimension value (can be int string or percentage)
-        from .config import parse_dimension_value
         parsed = parse_dimension_value(args.max_diagram_width)
         if parsed is not None:
             cli_config["max_diagram_width"] = parsed
     if args.max_diagram_height:
         # Parse dimension value (can be int string or percentage)
-        from .config import parse_dimension_value
         parsed = parse_dimension_value(args.max_diagram_height)
         if parsed is not None:
             cli_config["max_diagram_height"] = parsed
@@ -2304,10 +2967,17 @@ def main():
         language=args.language,
         max_diagram_width=config.get_max_diagram_width(),
         max_diagram_height=config.get_max_diagram_height(),
-        force_regenerate=args.force
+        force_regenerate=args.force,
+        both_mobi_formats=args.mobi_both
     )
     converter.convert_all(cleanup=not args.no_cleanup, parallel=not args.no_parallel)
 
 
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Main entry point."""
+    run_from_args(_build_parser().parse_args(argv))
+
+
 if __name__ == "__main__":
     main()
@@ -6,14 +6,31 @@ Provides functionality to track document state and avoid unnecessary file recrea
 MIT License - Copyright (c) 2025 Markdown to PDF Converter
 """
 
+import os
 import sqlite3
 import hashlib
+import functools
+import threading
 from pathlib import Path
 from typing import Dict, Optional
 
+try:
+    import xxhash  # Optional: much faster change detection than SHA-256
+except ImportError:
+    xxhash = None
+
+# Digests from the optional xxhash backend carry this prefix, so hashes stored by the other
+# backend never compare equal and the affected documents are simply regenerated once
+_XXHASH_PREFIX = "xxh3:"
+_HASH_READ_SIZE = 1 << 20
+
 
 class DocumentStateManager:
-    """Manages document state using SQLite database to avoid unnecessary file recreation."""
+    """Manages document state using SQLite database to avoid unnecessary file recreation.
+    
+    One connection is opened lazily and reused for the manager's lifetime. The database runs
+    in WAL mode so parallel worker processes can read while another one writes.
+    """
     
     def __init__(self, db_path: str):
         """Initialize the document state manager.
@@ -24,12 +41,33 @@ class DocumentStateManager:
         self.db_path = Path(db_path)
         # Ensure parent directory exists
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # In-memory copy of every row once load_all() has been called (filename -> state)
+        self._states: Optional[Dict[str, Dict[str, str]]] = None
         self._init_database()
     
+    def _connection(self) -> sqlite3.Connection:
+        """Return the shared connection, opening it on first use."""
+        if self._conn is None:
+            # Other worker processes may hold the write lock briefly; wait instead of failing
+            self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+    
+    def close(self) -> None:
+        """Close the shared connection (it is reopened on next use)."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
     def _init_database(self) -> None:
         """Initialize the SQLite database and create the document_state table."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._lock, self._connection() as conn:
+                # WAL is persistent in the database file; readers no longer block on writers
+                conn.execute("PRAGMA journal_mode=WAL")
                 cursor = conn.cursor()
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS document_state (
@@ -49,6 +87,23 @@ class DocumentStateManager:
         except sqlite3.Error as e:
             raise RuntimeError(f"Failed to initialize database: {e}")
     
+    def load_all(self) -> Dict[str, Dict[str, str]]:
+        """Load every document state into memory with a single query.
+        
+        Afterwards get_document_state() (and so needs_regeneration()) is answered from memory;
+        saves and removals through this manager keep the in-memory copy current.
+        
+        Returns:
+            Dictionary mapping filename to its state (same keys as get_document_state)
+        """
+        states = {}
+        for row in self.get_all_documents():
+            filename = row.pop('filename')
+            row.pop('created_at')
+            states[filename] = row
+        self._states = states
+        return states
+    
     def get_document_state(self, filename: str) -> Optional[Dict[str, str]]:
         """Get document state from database.
         
@@ -58,8 +113,10 @@ class DocumentStateManager:
         Returns:
             Dictionary containing markdown_hash, pdf_hash, style_profile, diagram dimensions, margins, page_numbers, and updated_at, or None if not found
         """
+        if self._states is not None:
+            return self._states.get(filename)
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._lock, self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     SELECT markdown_hash, pdf_hash, style_profile, 
@@ -103,7 +160,7 @@ class DocumentStateManager:
             has_page_numbers: Whether page numbers are enabled (default: True)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._lock, self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT OR REPLACE INTO document_state 
@@ -118,6 +175,18 @@ class DocumentStateManager:
                 conn.commit()
         except sqlite3.Error as e:
             raise RuntimeError(f"Failed to save document state: {e}")
+        
+        if self._states is not None:
+            self._states[filename] = {
+                'markdown_hash': markdown_hash,
+                'pdf_hash': pdf_hash,
+                'style_profile': style_profile,
+                'max_diagram_width': str(max_diagram_width) if max_diagram_width is not None else None,
+                'max_diagram_height': str(max_diagram_height) if max_diagram_height is not None else None,
+                'page_margins': page_margins,
+                'has_page_numbers': 1 if has_page_numbers else 0,
+                'updated_at': None
+            }
     
     def needs_regeneration(self, filename: str, current_markdown_hash: str, pdf_path: Path, 
                           current_style_profile: str = 'a4-print',
@@ -211,7 +280,7 @@ class DocumentStateManager:
             pdf_hash: SHA-256 hash of the PDF file
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._lock, self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     UPDATE document_state 
@@ -221,6 +290,9 @@ class DocumentStateManager:
                 conn.commit()
         except sqlite3.Error as e:
             raise RuntimeError(f"Failed to update PDF hash: {e}")
+        
+        if self._states is not None and filename in self._states:
+            self._states[filename]['pdf_hash'] = pdf_hash
     
     def get_all_documents(self) -> list[Dict[str, str]]:
         """Get all document states from database.
@@ -229,7 +301,7 @@ class DocumentStateManager:
             List of dictionaries containing document state information
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._lock, self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     SELECT filename, markdown_hash, pdf_hash, style_profile, max_diagram_width, 
@@ -264,12 +336,15 @@ class DocumentStateManager:
             filename: Name of the document file to remove
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._lock, self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("DELETE FROM document_state WHERE filename = ?", (filename,))
                 conn.commit()
         except sqlite3.Error as e:
             raise RuntimeError(f"Failed to remove document: {e}")
+        
+        if self._states is not None:
+            self._states.pop(filename, None)
     
     def clear_all_documents(self) -> int:
         """Clear all documents from the database and recreate the table with current schema.
@@ -278,7 +353,7 @@ class DocumentStateManager:
             Number of documents removed
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._lock, self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT COUNT(*) FROM document_state")
                 count = cursor.fetchone()[0]
@@ -298,31 +373,53 @@ class DocumentStateManager:
                     )
                 """)
                 conn.commit()
+                if self._states is not None:
+                    self._states.clear()
                 return count
         except sqlite3.Error as e:
             raise RuntimeError(f"Failed to clear all documents: {e}")
 
 
 def calculate_file_hash(file_path: Path) -> str:
-    """Calculate SHA-256 hash of a file.
+    """Calculate a content hash of a file (xxh3-64 if xxhash is installed, else SHA-256).
+    
+    Results are memoized on (path, mtime, size), so repeated calls for an unchanged
+    file within a run do not re-read it. Use clear_file_hash_cache() between runs.
     
     Args:
         file_path: Path to the file to hash
         
     Returns:
-        SHA-256 hash as hexadecimal string
+        Hexadecimal digest ("xxh3:"-prefixed for xxhash, bare for SHA-256)
         
     Raises:
         RuntimeError: If file cannot be read or hashing fails
     """
-    sha256_hash = hashlib.sha256()
     try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
-    except Exception as e:
+        stat = os.stat(file_path)
+    except OSError as e:
         raise RuntimeError(f"Failed to calculate hash for {file_path}: {e}")
+    return _hash_file(str(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=4096)
+def _hash_file(path: str, mtime_ns: int, size: int) -> str:
+    """Hash a file's contents; mtime_ns and size only key the cache."""
+    file_hash = xxhash.xxh3_64() if xxhash is not None else hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_READ_SIZE), b""):
+                file_hash.update(chunk)
+        if xxhash is not None:
+            return _XXHASH_PREFIX + file_hash.hexdigest()
+        return file_hash.hexdigest()
+    except Exception as e:
+        raise RuntimeError(f"Failed to calculate hash for {path}: {e}")
+
+
+def clear_file_hash_cache() -> None:
+    """Forget all memoized file hashes."""
+    _hash_file.cache_clear()
 
 
 def verify_pdf_exists_and_matches(pdf_path: Path, expected_hash: str) -> bool: